@@ -2,38 +2,291 @@ import pandas as pd
 from asyncio.proactor_events import constants
 import numpy as np
 from . import assets, constants
-from typing import Dict
+from typing import Dict, Iterable, Tuple
+from scipy.stats import norm
+
+#percentiles of the paths computed with every band summary
+DEFAULT_QUANTILES = (0.01, 0.025, 0.05, 0.5, 0.95, 0.975, 0.99)
+QUANTILE_DECIMALS = 10
+
+#how confidence bands are estimated: `normal` mean -/+ z*std, `empirical` exact percentiles,
+#`sketch` percentiles from a streaming histogram fed chunk by chunk (out-of-core runs)
+BAND_ESTIMATORS = ('normal', 'empirical', 'sketch')
+DEFAULT_BAND_ESTIMATOR = 'empirical'
+DEFAULT_SKETCH_BINS = 512
+#paths fed to the sketch at once
+SKETCH_CHUNK_PATHS = 1024
+
+
+def band_quantiles(ci:float, quantiles:Iterable[float]=DEFAULT_QUANTILES) -> Tuple[float, ...]:
+    '''
+    `quantiles` plus the two tails of a `ci` band, sorted and rounded so they can key a cache
+    '''
+    qs = set(round(q, QUANTILE_DECIMALS) for q in quantiles)
+    if 0. < ci < 1.:
+        qs.update((round(1 - ci, QUANTILE_DECIMALS), round(ci, QUANTILE_DECIMALS)))
+    return tuple(sorted(qs))
+
+
+def weighted_quantile(x:np.ndarray, q:float, weights:np.ndarray, normalize:bool=True) -> np.ndarray:
+    '''
+    `q` quantile of `x` along the path axis (the first) with one weight per path, linearly interpolated:
+    the sorted values sit at `(cumulative weight - own weight) / (total - weight of the largest)`, which is the
+    `np.percentile` position `i / (n - 1)` when the weights are equal.
+    Without `normalize` the weights are likelihood ratios (mean 1 in expectation) and the positions are `/ (n - 1)`:
+    the unbiased importance sampling CDF, the better estimate of the lower tail
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    order = np.argsort(x, axis=0)
+    xs = np.take_along_axis(x, order, axis=0)
+    w = np.asarray(weights, dtype=np.float64)[order]
+    cum = np.cumsum(w, axis=0)
+    positions = (cum - w) / ((cum[-1] - w[-1]) if normalize else (x.shape[0] - 1))
+    upper = np.clip((positions <= q).sum(axis=0), 1, x.shape[0] - 1)
+    lower = upper - 1
+    p_lo, p_hi = np.take_along_axis(positions, np.expand_dims(lower, 0), axis=0)[0], np.take_along_axis(positions, np.expand_dims(upper, 0), axis=0)[0]
+    x_lo, x_hi = np.take_along_axis(xs, np.expand_dims(lower, 0), axis=0)[0], np.take_along_axis(xs, np.expand_dims(upper, 0), axis=0)[0]
+    fraction = np.clip((q - p_lo) / np.where(p_hi > p_lo, p_hi - p_lo, 1.), 0., 1.)
+    return x_lo + fraction * (x_hi - x_lo)
+
+
+def check_band_estimator(estimator:str) -> str:
+    if estimator not in BAND_ESTIMATORS:
+        raise ValueError(f'Unknown band estimator {estimator}, expected one of: ' + ','.join(BAND_ESTIMATORS))
+    return estimator
+
+
+class QuantileSketch:
+    def __init__(self, T:int, bins:int=DEFAULT_SKETCH_BINS, lower:np.ndarray=None, upper:np.ndarray=None) -> None:
+        '''
+        Mergeable per-timestamp histogram of (n, T) path chunks with float64 running sums for mean and std.
+        Bin edges span [`lower`, `upper`] (by default the range of the first chunk widened by half of it on each side);
+        values outside land in an underflow/overflow bin bounded by the exact min/max
+        '''
+        self.T = T
+        self.bins = bins
+        self.counts = np.zeros((T, bins + 2), dtype=np.int64)
+        self.n = 0
+        self.lower = None if lower is None else np.broadcast_to(np.asarray(lower, dtype=np.float64), (T,)).copy()
+        self.width = None if lower is None else (np.broadcast_to(np.asarray(upper, dtype=np.float64), (T,)) - self.lower) / bins
+        self.min = np.full(T, np.inf)
+        self.max = np.full(T, -np.inf)
+        self._shift = None
+        self._sum = np.zeros(T)
+        self._sum_sq = np.zeros(T)
+
+    def _init_edges(self, chunk:np.ndarray) -> None:
+        lo, hi = chunk.min(axis=0), chunk.max(axis=0)
+        margin = (hi - lo) / 2
+        self.lower = lo - margin
+        span = hi + margin - self.lower
+        self.width = np.where(span > 0, span, np.maximum(np.abs(lo), 1.) * 1e-9) / self.bins
+
+    def update(self, chunk:np.ndarray) -> 'QuantileSketch':
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.shape[0] == 0: return self
+        if self.lower is None: self._init_edges(chunk)
+        if self._shift is None: self._shift = chunk[0].copy()
+
+        index = np.clip(np.floor((chunk - self.lower) / self.width), -1, self.bins).astype(np.int64) + 1
+        index += np.arange(self.T) * (self.bins + 2)
+        self.counts += np.bincount(index.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+        centered = chunk - self._shift
+        self._sum += centered.sum(axis=0)
+        self._sum_sq += (centered ** 2).sum(axis=0)
+        self.min = np.minimum(self.min, chunk.min(axis=0))
+        self.max = np.maximum(self.max, chunk.max(axis=0))
+        self.n += chunk.shape[0]
+        return self
+
+    def merge(self, other:'QuantileSketch') -> 'QuantileSketch':
+        '''
+        Combine with a sketch of other paths built on the same bin edges
+        '''
+        if other.n == 0: return self
+        if self.n == 0:
+            self.__dict__.update({k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in other.__dict__.items()})
+            return self
+        if not (np.array_equal(self.lower, other.lower) and np.array_equal(self.width, other.width)):
+            raise ValueError('sketches with different bin edges cannot be merged, pass the same lower/upper to both')
+        delta = other._shift - self._shift
+        self._sum_sq += other._sum_sq + 2 * delta * other._sum + other.n * delta ** 2
+        self._sum += other._sum + other.n * delta
+        self.counts += other.counts
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n += other.n
+        return self
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self._shift + self._sum / self.n
+
+    @property
+    def std(self) -> np.ndarray:
+        centered_mean = self._sum / self.n
+        return np.sqrt(np.clip(self._sum_sq / self.n - centered_mean ** 2, 0., np.inf))
+
+    def quantile(self, q:float) -> np.ndarray:
+        '''
+        Percentile `q` per timestamp, interpolated linearly inside the bin holding rank `q * n`
+        '''
+        cumulative = self.counts.cumsum(axis=1)
+        rank = q * self.n
+        rows = np.arange(self.T)
+        b = np.minimum((cumulative < rank).sum(axis=1), self.bins + 1)
+        before = np.where(b > 0, cumulative[rows, np.maximum(b - 1, 0)], 0)
+        count = self.counts[rows, b]
+        fraction = np.where(count > 0, (rank - before) / np.maximum(count, 1), 0.)
+
+        bin_lower = self.lower + (b - 1) * self.width
+        bin_lower = np.where(b == 0, self.min, bin_lower)
+        bin_upper = np.where(b == self.bins + 1, self.max, bin_lower + self.width)
+        bin_upper = np.where(b == 0, self.lower, bin_upper)
+        return np.clip(bin_lower + fraction * (bin_upper - bin_lower), self.min, self.max)
+
+    def to_bands(self, quantiles:Iterable[float]=DEFAULT_QUANTILES) -> 'SeriesBands':
+        return SeriesBands(mean=self.mean
+                           , std=self.std
+                           , quantiles={round(q, QUANTILE_DECIMALS): self.quantile(q) for q in quantiles}
+                           , n_paths=self.n
+                           , estimator='sketch')
+
+
+class SeriesBands:
+    def __init__(self, mean:np.ndarray, std:np.ndarray, quantiles:Dict[float, np.ndarray], n_paths:int, estimator:str=DEFAULT_BAND_ESTIMATOR) -> None:
+        '''
+        Cross-sectional summary of (N, T) paths per timestamp: mean, std and percentiles.
+        `estimator` is how the percentiles were obtained and which interval `interval` returns
+        '''
+        self.mean = mean
+        self.std = std
+        self.quantiles = quantiles
+        self.n_paths = n_paths
+        self.estimator = estimator
+
+    @classmethod
+    def from_paths(cls, ts:np.ndarray, quantiles:Iterable[float]=DEFAULT_QUANTILES
+                   , estimator:str=DEFAULT_BAND_ESTIMATOR, chunk_paths:int=SKETCH_CHUNK_PATHS, weights:np.ndarray=None) -> 'SeriesBands':
+        '''
+        Mean and std accumulate in float64. `empirical` percentiles (linear interpolation, as `np.percentile`)
+        come from a single `np.partition` over the path axis, `sketch` feeds `chunk_paths` paths at a time
+        to a `QuantileSketch`, `normal` skips the percentiles.
+        With per path `weights` (importance sampling) every summary is weighted
+        '''
+        check_band_estimator(estimator)
+        n = ts.shape[0]
+        quantiles = tuple(quantiles)
+        if weights is not None:
+            if estimator == 'sketch': raise ValueError('weighted paths need the normal or empirical band estimator')
+            mean = np.average(ts, axis=0, weights=weights)
+            std = np.sqrt(np.average((ts - mean) ** 2, axis=0, weights=weights))
+            values = dict() if estimator == 'normal' else {round(q, QUANTILE_DECIMALS): weighted_quantile(ts, q, weights) for q in quantiles}
+            return cls(mean=mean, std=std, quantiles=values, n_paths=n, estimator=estimator)
+        if estimator == 'sketch':
+            sketch = QuantileSketch(ts.shape[1])
+            for start in range(0, n, chunk_paths):
+                sketch.update(ts[start:start + chunk_paths])
+            return sketch.to_bands(quantiles)
+        if estimator == 'normal':
+            return cls(mean=ts.mean(axis=0, dtype=np.float64), std=ts.std(axis=0, dtype=np.float64)
+                       , quantiles=dict(), n_paths=n, estimator=estimator)
+        positions = {q: q * (n - 1) for q in quantiles}
+        kth = sorted({int(np.floor(p)) for p in positions.values()} | {int(np.ceil(p)) for p in positions.values()})
+        partitioned = np.partition(ts, kth, axis=0) if n > 1 else ts
+        values = dict()
+        for q, p in positions.items():
+            lo, hi = int(np.floor(p)), int(np.ceil(p))
+            values[round(q, QUANTILE_DECIMALS)] = partitioned[lo] + (p - lo) * (partitioned[hi] - partitioned[lo])
+        return cls(mean=ts.mean(axis=0, dtype=np.float64)
+                   , std=ts.std(axis=0, dtype=np.float64)
+                   , quantiles=values
+                   , n_paths=n
+                   , estimator=estimator)
+
+    def quantile(self, q:float) -> np.ndarray:
+        key = round(q, QUANTILE_DECIMALS)
+        if key not in self.quantiles:
+            raise KeyError(f'quantile {q} was not computed for these bands ({self.estimator})')
+        return self.quantiles[key]
+
+    def normal_interval(self, ci:float) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        `mean -/+ z(ci) * std`, floored at 0 (same as `plotting.get_confidence_interval`)
+        '''
+        z = norm.ppf(ci)
+        return np.clip(self.mean - z * self.std, a_min=0., a_max=np.inf), self.mean + z * self.std
+
+    def empirical_interval(self, ci:float) -> Tuple[np.ndarray, np.ndarray]:
+        return self.quantile(1 - ci), self.quantile(ci)
+
+    def interval(self, ci:float) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        `ci` band of the estimator the summary was built with
+        '''
+        return self.normal_interval(ci) if self.estimator == 'normal' else self.empirical_interval(ci)
+
+
+def format_stats(stats:Dict[str, float])->Dict[str, str]:
+    '''
+    Display strings of `stats`: probabilities, returns and VaRs as percents, the rest rounded
+    '''
+    return {k: str(round(v,3))  if ('P(' not in k) and ('VaR' not in k) and ('E(R' not in k) 
+            else str(round(100*v,3))+'%'
+        
+        for k,v in stats.items()}
+
+
 class ReturnsCalculator:
-    def __init__(self, allocated_capital: np.ndarray, confidence_level: int = 5,risk_free_rate:float=0.01):
+    def __init__(self, allocated_capital: np.ndarray, confidence_level: int = 5,risk_free_rate:float=0.01,weights:np.ndarray=None):
         '''
         `allocated_capital` is expected to be a numpy array with (n,t,k) shape, where
         n: number of sims
         t: number of timestamps
         k: number of assets in the portfolio
+        `weights` are per sim likelihood ratios of importance sampled paths: the stats become the unbiased
+        weighted averages, probabilities and quantiles, the bands are self-normalized
         '''
         self.allocated_capital = allocated_capital
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        #intermediates are stored in the dtype of `allocated_capital`, sums and products accumulate in float64
+        self.dtype = allocated_capital.dtype if np.issubdtype(allocated_capital.dtype, np.floating) else np.dtype(np.float64)
         self.confidence_level = confidence_level
         self.risk_free_rate = risk_free_rate
         self._stats = {}
+        self._bands = {}
         self._calc_portfolio()
 
     def _calc_portfolio(self):
-        self.sim_portfolio = np.nan_to_num(self.allocated_capital).sum(axis=2)
+        self.sim_portfolio = np.nan_to_num(self.allocated_capital).sum(axis=2, dtype=np.float64).astype(self.dtype, copy=False)
     def calculate_returns(self):
         self.sim_retuns = np.diff(self.sim_portfolio, axis=1) / self.sim_portfolio[:, :-1]
         self.sim_retuns = np.nan_to_num(np.insert(self.sim_retuns, 0, 0, axis=1))
 
-        self.sim_cum_retuns = np.cumprod(self.sim_retuns + 1, axis=1)
+        self.sim_cum_retuns = np.cumprod(self.sim_retuns + 1, axis=1, dtype=np.float64).astype(self.dtype, copy=False)
         
         return self
     
+    def _mean(self,x):
+        #average over the sims
+        return x.mean(axis=0) if self.weights is None else (self.weights * x).mean(axis=0)
+
+    def _probability_above(self,x,level):
+        #P(x >= level); weighted sims are tilted toward losses, so the sampled side is the complement x < level
+        return (x >= level).mean() if self.weights is None else 1 - self._mean(x < level)
+
+    def _percentile(self,x,q):
+        #`q`% percentile over the sims
+        return np.percentile(x, q) if self.weights is None else float(weighted_quantile(x, q / 100, self.weights, normalize=False))
+
     def _calc_sharpe(self,r,std):
         return ((r - self.risk_free_rate/constants.AnnualTimeInterval.days.value) / std).mean()
     def calc_avg_sharpe(self,ts):
-        mean_v = ts.mean(axis=1)
-        std_v = ts.std(axis=1)
+        mean_v = ts.mean(axis=1, dtype=np.float64)
+        std_v = ts.std(axis=1, dtype=np.float64)
         # sharpe_v = ((mean_v - self.risk_free_rate/constants.AnnualTimeInterval.days.value) / std_v).mean()
-        sharpe_v = self._calc_sharpe(r=mean_v,std=std_v).mean()
+        sharpe_v = self._mean((mean_v - self.risk_free_rate/constants.AnnualTimeInterval.days.value) / std_v)
         return sharpe_v
     
     def calculate_sample_stats(self):
@@ -41,7 +294,7 @@ class ReturnsCalculator:
         Take a sample of the portfolio stochastic process and calculate performance of the time series.
 
         """
-        portfolio = self.sim_portfolio[0,:]
+        portfolio = self.sim_portfolio[0,:].astype(np.float64)
         # Calculate returns
         returns = np.diff(portfolio) / portfolio[:-1]
 
@@ -62,9 +315,11 @@ class ReturnsCalculator:
 
         # Sortino Ratio
         negative_returns = returns[returns < 0]
-        downside_deviation = np.std(negative_returns)
+        downside_deviation = np.std(negative_returns) if len(negative_returns) > 0 else 0.
         annualized_downside_deviation = downside_deviation * np.sqrt(constants.AnnualTimeInterval.days.value) 
-        sortino_ratio = (annualized_return - self.risk_free_rate) / annualized_downside_deviation
+        #no downside (e.g. a rate accruing NAV): the ratio is unbounded, signed by the excess return
+        sortino_ratio = ((annualized_return - self.risk_free_rate) / annualized_downside_deviation if annualized_downside_deviation > 0
+                         else np.inf * np.sign(annualized_return - self.risk_free_rate))
 
         self._sample_stats = {
             'Total Return': total_return,
@@ -77,24 +332,38 @@ class ReturnsCalculator:
         return self
     
     def calculate_stats(self):
-        self._stats["P(losing <50%)"] = (self.sim_cum_retuns[:, -1] >= 0.5).mean().mean()
-        self._stats["P(losing <30%)"] = (self.sim_cum_retuns[:, -1] >= 0.7).mean().mean()
-        self._stats["P(gaining 60%)"] = (self.sim_cum_retuns[:, -1] >= 1.6).mean().mean()
+        self._stats["P(losing <50%)"] = self._probability_above(self.sim_cum_retuns[:, -1], 0.5)
+        self._stats["P(losing <30%)"] = self._probability_above(self.sim_cum_retuns[:, -1], 0.7)
+        self._stats["P(gaining 60%)"] = self._mean(self.sim_cum_retuns[:, -1] >= 1.6)
         
         T = self.sim_cum_retuns.shape[1]
-        E_R = (self.sim_cum_retuns[:, -1]-1).mean()
-        E_R_anulz = ( (self.sim_cum_retuns[:, -1]-1 ) * (constants.AnnualTimeInterval.days.value/T) ).mean()
-        std_ = (self.sim_cum_retuns[:, -1]-1).std() / np.sqrt(T)
+        terminal_returns = self.sim_cum_retuns[:, -1].astype(np.float64) - 1
+        E_R = self._mean(terminal_returns)
+        E_R_anulz = self._mean( terminal_returns * (constants.AnnualTimeInterval.days.value/T) )
+        std_ = terminal_returns.std() / np.sqrt(T)
 
         self._stats["E(R)"] = E_R
         self._stats["E(R_annualized)"] = E_R_anulz
         # self._stats["Sharpe"] = round( (E_R - self.risk_free_rate) / std_, 3)
         self._stats["Sharpe"] = self.calc_avg_sharpe(self.sim_retuns)
-        self._stats[f"Daily {100-self.confidence_level}% VaR"] = np.percentile(self.sim_retuns, self.confidence_level, axis=1).mean()
-        self._stats[f"Max Total VaR"] = (self.sim_cum_retuns[:, -1]-1).min()
-        self._stats[f"Total {100-self.confidence_level}% VaR"] = np.percentile(self.sim_cum_retuns[:, -1]-1, self.confidence_level)
+        self._stats[f"Daily {100-self.confidence_level}% VaR"] = float(self._mean(np.percentile(self.sim_retuns, self.confidence_level, axis=1)))
+        #worst of n sims: with weights, the 1/(n+1) quantile the minimum of n plain sims estimates
+        self._stats[f"Max Total VaR"] = terminal_returns.min() if self.weights is None else self._percentile(terminal_returns, 100 / (len(terminal_returns) + 1))
+        self._stats[f"Total {100-self.confidence_level}% VaR"] = self._percentile(terminal_returns, self.confidence_level)
+        if self.weights is not None:
+            #Kish effective sample size of the weighted sims
+            self._stats["Effective sims"] = self.weights.sum() ** 2 / np.sum(self.weights ** 2)
         return self
 
+    def bands(self, quantiles:Iterable[float]=DEFAULT_QUANTILES, estimator:str=DEFAULT_BAND_ESTIMATOR) -> SeriesBands:
+        '''
+        Band summary of `sim_portfolio`, computed once per estimator and set of quantiles and shared by plots and stats
+        '''
+        key = (estimator, tuple(sorted(round(q, QUANTILE_DECIMALS) for q in quantiles)))
+        if key not in self._bands:
+            self._bands[key] = SeriesBands.from_paths(self.sim_portfolio, key[1], estimator, weights=self.weights)
+        return self._bands[key]
+
     @property
     def stats(self):        
         return self._stats
@@ -104,10 +373,7 @@ class ReturnsCalculator:
         return self._sample_stats
     
     def _format_values(self)->Dict:
-        return {k: str(round(v,3))  if ('P(' not in k) and ('VaR' not in k) and ('E(R' not in k) 
-                else str(round(100*v,3))+'%'
-            
-            for k,v in self._stats.items()}
+        return format_stats(self._stats)
     @property
     def stats_str(self):
         return '\n'+'\n'.join([f'{k}:{v}' for k,v in self._format_values().items()] )
@@ -115,3 +381,164 @@ class ReturnsCalculator:
     @property
     def stats_df(self):
         return pd.DataFrame(self._format_values().items(),columns=['Metric','Value'])
+
+
+#stats of the terminal returns whose precision adaptive runs track, `Total VaR` is taken at the run confidence level
+PRECISION_METRICS = ('E(R)', 'Total VaR', 'P(losing <30%)')
+#standard error every tracked stat must reach, in return units (0.005 = 0.5%)
+DEFAULT_TOLERANCE = 0.005
+#two-sided 95% normal quantile of the order statistic interval of `QuantileAccumulator`
+_Z95 = norm.ppf(0.975)
+
+
+class MomentAccumulator:
+    def __init__(self) -> None:
+        '''
+        Count, mean and sum of squared deviations of a sample fed batch by batch, merged with the pairwise
+        (Chan et al.) update so batches can be summarized independently; standard error of the mean `std / sqrt(n)`
+        '''
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def update(self, values:np.ndarray) -> 'MomentAccumulator':
+        x = np.asarray(values, dtype=np.float64).ravel()
+        batch = MomentAccumulator()
+        if x.size > 0:
+            batch.n = x.size
+            batch.mean = x.mean()
+            batch.m2 = ((x - batch.mean) ** 2).sum()
+        return self.merge(batch)
+
+    def merge(self, other:'MomentAccumulator') -> 'MomentAccumulator':
+        n = self.n + other.n
+        if n == 0: return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        return self
+
+    @property
+    def estimate(self) -> float:
+        return float(self.mean)
+
+    @property
+    def standard_error(self) -> float:
+        if self.n < 2: return float('inf')
+        return float(np.sqrt(self.m2 / (self.n - 1) / self.n))
+
+
+class QuantileAccumulator:
+    def __init__(self, q:float) -> None:
+        '''
+        Exact `q` quantile of a sample fed batch by batch (batches are kept and merged by concatenation).
+        The standard error is distribution free: the order statistics `x_(k-)`, `x_(k+)`, `k -/+ = nq -/+ 1.96 sqrt(nq(1-q))`,
+        bracket the quantile with 95% probability, so their spread over 2*1.96 plays the role of one standard error
+        '''
+        self.q = q
+        self._batches = []
+
+    def update(self, values:np.ndarray) -> 'QuantileAccumulator':
+        self._batches.append(np.asarray(values, dtype=np.float64).ravel())
+        return self
+
+    def merge(self, other:'QuantileAccumulator') -> 'QuantileAccumulator':
+        if other.q != self.q: raise ValueError(f'cannot merge the {other.q} quantile into the {self.q} one')
+        self._batches.extend(other._batches)
+        return self
+
+    @property
+    def n(self) -> int:
+        return sum(b.size for b in self._batches)
+
+    @property
+    def estimate(self) -> float:
+        return float(np.percentile(np.concatenate(self._batches), 100 * self.q)) if self.n > 0 else float('nan')
+
+    @property
+    def standard_error(self) -> float:
+        n = self.n
+        half_width = _Z95 * np.sqrt(n * self.q * (1 - self.q))
+        lower, upper = int(np.floor(n * self.q - half_width)), int(np.ceil(n * self.q + half_width))
+        #too few paths for the interval to sit inside the sample
+        if n < 2 or lower < 0 or upper > n - 1: return float('inf')
+        x = np.concatenate(self._batches)
+        x.partition((lower, upper))
+        return float((x[upper] - x[lower]) / (2 * _Z95))
+
+
+#per metric sample of the (n,) terminal cumulative returns
+_PRECISION_SAMPLES = {'E(R)': lambda terminal: terminal - 1
+                      , 'Total VaR': lambda terminal: terminal - 1
+                      , 'P(losing <30%)': lambda terminal: terminal >= 0.7
+                      }
+
+
+class PrecisionTracker:
+    def __init__(self, metrics:Iterable[str]=PRECISION_METRICS, confidence_level:int=5, tolerance:float=DEFAULT_TOLERANCE) -> None:
+        '''
+        Estimates and standard errors of `metrics` (keyed by their `ReturnsCalculator.stats` name) accumulated over
+        batches of paths; `converged` once every standard error is within `tolerance`
+        '''
+        unknown = [m for m in metrics if m not in _PRECISION_SAMPLES]
+        if len(unknown) > 0:
+            raise ValueError('Unknown precision metrics: ' + ','.join(unknown) + ', expected some of: ' + ','.join(PRECISION_METRICS))
+        self.tolerance = tolerance
+        self._metrics = {}
+        for metric in metrics:
+            if metric == 'Total VaR':
+                self._metrics[f'Total {100-confidence_level}% VaR'] = (metric, QuantileAccumulator(confidence_level / 100))
+            else:
+                self._metrics[metric] = (metric, MomentAccumulator())
+        self.batches = 0
+        #why the adaptive run stopped: `tolerance`, `max_paths` or `time_budget`
+        self.stop_reason = None
+
+    def update(self, returns:'ReturnsCalculator') -> 'PrecisionTracker':
+        terminal = returns.sim_cum_retuns[:, -1].astype(np.float64)
+        for metric, accumulator in self._metrics.values():
+            accumulator.update(_PRECISION_SAMPLES[metric](terminal))
+        self.batches += 1
+        return self
+
+    def merge(self, other:'PrecisionTracker') -> 'PrecisionTracker':
+        for name, (_, accumulator) in self._metrics.items():
+            accumulator.merge(other._metrics[name][1])
+        self.batches += other.batches
+        return self
+
+    @property
+    def n_paths(self) -> int:
+        return next(iter(self._metrics.values()))[1].n if self._metrics else 0
+
+    @property
+    def estimates(self) -> Dict[str, float]:
+        return {name: accumulator.estimate for name, (_, accumulator) in self._metrics.items()}
+
+    @property
+    def standard_errors(self) -> Dict[str, float]:
+        return {name: accumulator.standard_error for name, (_, accumulator) in self._metrics.items()}
+
+    @property
+    def converged(self) -> bool:
+        return all(se <= self.tolerance for se in self.standard_errors.values())
+
+    def to_dict(self) -> dict:
+        standard_errors = self.standard_errors
+        return dict(n_paths=self.n_paths, batches=self.batches, tolerance=self.tolerance
+                    , converged=self.converged, stop_reason=self.stop_reason
+                    , metrics={name: dict(estimate=estimate, standard_error=standard_errors[name]) for name, estimate in self.estimates.items()})
+
+    def to_stats(self) -> Dict[str, float]:
+        '''
+        Flat `metric -> value` view, same layout as `ReturnsCalculator.stats`
+        '''
+        stats = {f'{name} std error': se for name, se in self.standard_errors.items()}
+        stats['Adaptive paths'] = self.n_paths
+        stats['Adaptive batches'] = self.batches
+        return stats
+
+    @property
+    def stats_df(self) -> pd.DataFrame:
+        return pd.DataFrame(format_stats(self.to_stats()).items(), columns=['Metric','Value'])
@@ -138,6 +138,8 @@ class EuropeanNaiveOption(Asset):
         self._ALIVE = False
         self._strike = None
         self._T = None
+        self._written_at = 0
+        self._side = TransactionType.SHORT_SELL
         self._premium_value = 0.0
 
     @property
@@ -148,22 +150,52 @@ class EuropeanNaiveOption(Asset):
     def type(self):
         return self._type
 
-    def write(self,current_price:float,strike:float,amount:float,expiration:int):
+    @property
+    def strike(self):
+        return self._strike
+
+    @property
+    def expiration(self):
+        return self._T
+
+    @property
+    def side(self):
+        return self._side
+
+    @property
+    def is_short(self) -> bool:
+        return self._side == TransactionType.SHORT_SELL
+
+    def write(self,current_price:float,strike:float,amount:float,expiration:int,written_at:int=0,side:TransactionType=TransactionType.SHORT_SELL,use_premium_cache:bool=False):
         '''
         When option is written, it becomes alive until assigmen
         the function returns `premium_value`
+        `expiration` is the time step of the assigment, `written_at` is the time step of the writing
+        `use_premium_cache` prices from the premium-per-notional lookup table instead of building a new pricing engine
         '''
         if self._ALIVE: return 0.0
         
         self._strike = strike
         self.amount = amount
         self._T = expiration
+        self._written_at = written_at
+        self._side = side
         self._ALIVE = True
 
+        if use_premium_cache:
+            self._premium_value = self.amount * pricing.option_premium(spot_price=current_price
+                                                                    ,strike=self._strike
+                                                                    ,maturity=expiration - written_at
+                                                                    ,volatility= self._volatility
+                                                                    ,risk_free_rate= self._risk_free_rate
+                                                                    ,option_type=self._type
+                                                                    )
+            return self
+
         #create BSM priceing engine 
         price_engine = pricing.create_option(spot_price=current_price
                                             ,strike=self._strike
-                                            ,maturity=expiration
+                                            ,maturity=expiration - written_at
                                             ,volatility= self._volatility
                                             ,risk_free_rate= self._risk_free_rate
                                             ,option_type=self._type
@@ -0,0 +1,293 @@
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from . import analysis, engine, executor, multi_asset, plotting, series_gen, utils, wad_engine
+
+#(N, T) grid used when no sizes are requested
+DEFAULT_SIZES = [(10, 365), (100, 365)]
+#relative slowdown above which a case is reported as a regression
+DEFAULT_THRESHOLD = 0.10
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    N: int
+    T: int
+    repeat: int
+    min: float
+    median: float
+    mean: float
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}[N={self.N},T={self.T}]'
+
+
+class BenchmarkComparison(NamedTuple):
+    key: str
+    baseline: float
+    current: float
+    ratio: float
+    regression: bool
+
+    def __str__(self) -> str:
+        flag = 'REGRESSION' if self.regression else 'ok'
+        return f'{self.key}: {self.baseline:.4f}s -> {self.current:.4f}s ({self.ratio:.2f}x) {flag}'
+
+
+def _config(N: int, T: int, return_function: str = 'Lognormal Random Walk', **strategy_params) -> utils.Config:
+    config = utils.read_config('default_config.json')
+    config.data_mode = 'simulation'
+    config.return_function = return_function
+    config.return_function_params.update(dict(N=N, T=T, mu=0.0, sigma=0.5, current_price=100.))
+    config.strategy_function_params.update(strategy_params)
+    return config
+
+
+def _options_params() -> dict:
+    return dict(option_every_itervals=30, option_duration=25, option_amount_pct_of_notional=0.3)
+
+
+def _no_options_params() -> dict:
+    return dict(option_every_itervals=int(1e10), option_duration=int(1e10))
+
+
+def _price_paths(N: int, T: int) -> np.ndarray:
+    config = _config(N, T)
+    return series_gen.generate_time_series(N, T, current_price=config.return_function_params['current_price']
+                                           , return_func=series_gen.return_functions(config.return_function)
+                                           , params=config.return_function_params)
+
+
+def _portfolio_paths(N: int, T: int) -> np.ndarray:
+    config = _config(N, T, **_options_params())
+    return executor.run_one_asset_rebalance_portfolio_v1(time_series=_price_paths(N, T)
+                                                         , strategy_params=utils.StrategyParams(**config.strategy_function_params)
+                                                         , config=config)
+
+
+def _case_generate(return_function: str, innovations: str = 'pseudo'):
+    def factory(N: int, T: int) -> Callable:
+        config = _config(N, T, return_function=return_function)
+        #the bootstrap resamples a synthetic fat-tailed history instead of exchange data
+        config.return_function_params['history_returns'] = 0.03 * np.random.default_rng(0).standard_t(3, size=4 * 365)
+        return lambda: series_gen.generate_time_series(N, T, current_price=config.return_function_params['current_price']
+                                                       , return_func=series_gen.return_functions(return_function)
+                                                       , params=config.return_function_params
+                                                       , innovations=innovations)
+    return factory
+
+
+def _case_generate_weighted(return_function: str):
+    def factory(N: int, T: int) -> Callable:
+        config = _config(N, T, return_function=return_function)
+        return lambda: series_gen.generate_weighted_time_series(N, T, current_price=config.return_function_params['current_price']
+                                                                , return_func=series_gen.return_functions(return_function)
+                                                                , params=config.return_function_params)
+    return factory
+
+
+def _case_executor(strategy_params: Callable[[], dict]):
+    def factory(N: int, T: int) -> Callable:
+        config = _config(N, T, **strategy_params())
+        time_series = _price_paths(N, T)
+        params = utils.StrategyParams(**config.strategy_function_params)
+        return lambda: executor.run_one_asset_rebalance_portfolio_v1(time_series=time_series, strategy_params=params, config=config)
+    return factory
+
+
+def _case_stats(N: int, T: int) -> Callable:
+    allocated_capital = _portfolio_paths(N, T)
+    return lambda: (analysis.ReturnsCalculator(allocated_capital)
+                    .calculate_returns()
+                    .calculate_stats()
+                    .calculate_sample_stats())
+
+
+def _case_weighted_stats(N: int, T: int) -> Callable:
+    allocated_capital = _portfolio_paths(N, T)
+    weights = np.random.default_rng(0).lognormal(sigma=0.5, size=N)
+    return lambda: (analysis.ReturnsCalculator(allocated_capital, weights=weights)
+                    .calculate_returns()
+                    .calculate_stats())
+
+
+def _case_bands(estimator: str):
+    def factory(N: int, T: int) -> Callable:
+        ts = analysis.ReturnsCalculator(_portfolio_paths(N, T)).sim_portfolio
+        return lambda: analysis.SeriesBands.from_paths(ts, analysis.band_quantiles(0.975), estimator)
+    return factory
+
+
+def _plot_params() -> dict:
+    return dict(title='benchmark', plot=dict(alpha=0.5), ci=0.975, xlabel='Time, Days', ylabel='Value'
+                , ci_model_name='model', ci_benchmark_name='benchmark', starting_price=100.)
+
+
+def _case_plot(plot_function: str):
+    def factory(N: int, T: int) -> Callable:
+        ts = analysis.ReturnsCalculator(_portfolio_paths(N, T)).sim_portfolio
+        params = _plot_params()
+        cash_df = pd.DataFrame(np.array([series_gen.cash_investment(T, 0.04, 100., 1)
+                                         , series_gen.cash_investment(T, 0.04, 100., 179)]).T
+                               , columns=['Daily capitalization', 'Semi-annual capitalization'])
+        calls = {'plot_simulations': lambda: plotting.plot_simulations(ts, params=params, show_plot=False)
+                 , 'plot_simulations_ply': lambda: plotting.plot_simulations_ply(ts, params=params, show_plot=False)
+                 , 'plot_histogram': lambda: plotting.plot_histogram(ts, params=params, show_plot=False)
+                 , 'plot_comparison': lambda: plotting.plot_comparison(ts, ts, params=params, show_plot=False)
+                 , 'plot_comparison_ply': lambda: plotting.plot_comparison_ply(ts, ts, params=params, show_plot=False)
+                 , 'plot_cash_capitalization': lambda: plotting.plot_cash_capitalization(cash_df, params=params, show_plot=False)
+                 , 'plot_cash_capitalization_ply': lambda: plotting.plot_cash_capitalization_ply(cash_df, params=params, show_plot=False)
+                 }
+
+        def run():
+            calls[plot_function]()
+            plt.close('all')
+        return run
+    return factory
+
+
+def _case_engine(N: int, T: int, dtype: str = 'float64') -> Callable:
+    config = _config(N, T, **_options_params())
+    config.dtype = dtype
+
+    def run():
+        engine.MCSEngine(config).run()
+        plt.close('all')
+    return run
+
+
+def _case_wad_engine(rate_model: str):
+    def factory(N: int, T: int) -> Callable:
+        params = wad_engine.WadSimParams(N=N, T=T, rate_model=rate_model, mint_mean=1e4, burn_mean=5e3, seed=0)
+        return lambda: wad_engine.run_wad_simulation(params)
+    return factory
+
+
+def _case_multi_asset(N: int, T: int) -> Callable:
+    params = multi_asset.MultiAssetParams(N=N, T=T, correlation=[[1., .8, .5], [.8, 1., .4], [.5, .4, 1.]], seed=0
+                                          , strategy_function_params=dict(percent_allocated=0.5, rebalance_threshold_down=0.1
+                                                                          , rebalance_threshold_up=0.1, max_rebalances=10))
+    return lambda: multi_asset.run_multi_asset_simulation(params)
+
+
+def benchmark_cases() -> Dict[str, Callable[[int, int], Callable]]:
+    '''
+    Registry of benchmark cases. Each case is a factory `(N, T) -> callable`, setup is done in the factory
+    and only the returned callable is timed
+    '''
+    cases = {f'generate_time_series:{name}': _case_generate(name) for name in series_gen.RETURN_FUNCTIONS}
+    cases.update({f'generate_time_series:{name}:sobol': _case_generate(name, 'sobol') for name in series_gen.RETURN_FUNCTIONS})
+    cases.update({f'generate_weighted_time_series:{name}': _case_generate_weighted(name)
+                  for name, function in series_gen.RETURN_FUNCTIONS.items() if function in series_gen.WEIGHTED_PATHS})
+    cases['executor:no_options'] = _case_executor(_no_options_params)
+    cases['executor:options'] = _case_executor(_options_params)
+    cases['analysis:returns_stats'] = _case_stats
+    cases['weighted_stats'] = _case_weighted_stats
+    for estimator in analysis.BAND_ESTIMATORS:
+        cases[f'bands:{estimator}'] = _case_bands(estimator)
+    for plot_function in ['plot_simulations', 'plot_simulations_ply', 'plot_histogram', 'plot_comparison'
+                          , 'plot_comparison_ply', 'plot_cash_capitalization', 'plot_cash_capitalization_ply']:
+        cases[f'plotting:{plot_function}'] = _case_plot(plot_function)
+    cases['engine:run'] = _case_engine
+    cases['engine:run:float32'] = lambda N, T: _case_engine(N, T, dtype='float32')
+    for rate_model in wad_engine.RATE_MODELS:
+        cases[f'wad_engine:{rate_model}'] = _case_wad_engine(rate_model)
+    cases['multi_asset:run'] = _case_multi_asset
+    return cases
+
+
+def time_callable(func: Callable, repeat: int = 3) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def machine_metadata() -> dict:
+    return dict(timestamp=dt.datetime.now().isoformat()
+                , platform=platform.platform()
+                , processor=platform.processor()
+                , machine=platform.machine()
+                , cpu_count=os.cpu_count()
+                , python=platform.python_version()
+                , numpy=np.__version__
+                , git_commit=_git_commit()
+                )
+
+
+def run_benchmarks(sizes: List[Tuple[int, int]] = None, repeat: int = 3, cases: List[str] = None, verbose: bool = True) -> dict:
+    '''
+    Run the registered benchmark cases over the (N, T) grid.
+    `cases` filters the registry by substring of the case name
+    '''
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    registry = benchmark_cases()
+    selected = [name for name in registry if cases is None or any(c in name for c in cases)]
+
+    results = []
+    for N, T in sizes:
+        for name in selected:
+            #engine and progress bars are chatty, keep the benchmark output readable
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                timings = time_callable(registry[name](N, T), repeat=repeat)
+            result = BenchmarkResult(name=name, N=N, T=T, repeat=repeat
+                                     , min=min(timings), median=float(np.median(timings)), mean=float(np.mean(timings)))
+            results.append(result)
+            if verbose:
+                print(f'{result.key}: min={result.min:.4f}s median={result.median:.4f}s')
+
+    return dict(metadata=machine_metadata(), results=[r._asdict() for r in results])
+
+
+def save_results(results: dict, path: str) -> str:
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def load_results(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD, metric: str = 'min') -> List[BenchmarkComparison]:
+    '''
+    Compare two benchmark runs case by case; a case regresses when it is slower than `1 + threshold` times the baseline
+    '''
+    baseline_timings = {BenchmarkResult(**r).key: r[metric] for r in baseline['results']}
+    comparisons = []
+    for r in current['results']:
+        key = BenchmarkResult(**r).key
+        if key not in baseline_timings: continue
+        ratio = r[metric] / baseline_timings[key] if baseline_timings[key] > 0 else np.inf
+        comparisons.append(BenchmarkComparison(key=key, baseline=baseline_timings[key], current=r[metric]
+                                               , ratio=ratio, regression=ratio > 1 + threshold))
+    return comparisons
+
+
+def default_results_path() -> str:
+    return os.path.join(os.path.abspath('.'), 'data', 'benchmarks', dt.datetime.now().strftime('%Y%m%d%H%M%S') + '.json')
@@ -0,0 +1,126 @@
+import threading
+from functools import lru_cache
+from typing import Callable, Dict
+
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import gammaln, kve
+
+from . import data_source, series_gen
+
+#days per year of the annualized `sigma` (as `data_source.get_crypto_price_volatility`)
+ANNUALIZATION_DAYS = 365
+#`alpha` of the GH sampler: only `delta**2 / alpha` enters the distribution, so alpha is held fixed
+DEFAULT_GH_ALPHA = 0.2444
+
+
+def fit_lognormal(log_returns: np.ndarray) -> dict:
+    '''
+    Maximum likelihood (closed form) daily drift `mu` and annualized `sigma` of the lognormal walk
+    '''
+    r = np.asarray(log_returns, dtype=np.float64)
+    return dict(mu=r.mean(), sigma=r.std() * np.sqrt(ANNUALIZATION_DAYS))
+
+
+def gh_log_likelihood(x: np.ndarray, mu: float, beta: float, shape: float, scale: float) -> np.ndarray:
+    '''
+    Log density of the `series_gen.generalized_hyperbolic_return` step `x = mu + beta g + sqrt(g) z`,
+    `g ~ InvGamma(shape, scale)`, `z ~ N(0, 1)`, evaluated for all `x` at once:
+    `f(x) = s^a / G(a) / sqrt(2 pi) e^{beta y} 2 (A/B)^{nu/2} K_nu(2 sqrt(AB))`
+    with `y = x - mu`, `A = s + y^2/2`, `B = beta^2/2` and `nu = -a - 1/2`
+    '''
+    y = np.asarray(x, dtype=np.float64) - mu
+    A = scale + y ** 2 / 2
+    nu = -shape - 0.5
+    log_norm = shape * np.log(scale) - gammaln(shape) - 0.5 * np.log(2 * np.pi)
+    if abs(beta) < 1e-12:
+        #B -> 0 limit of the Bessel integral
+        return log_norm + gammaln(shape + 0.5) - (shape + 0.5) * np.log(A)
+    B = beta ** 2 / 2
+    z = 2 * np.sqrt(A * B)
+    return log_norm + beta * y + np.log(2) + nu / 2 * np.log(A / B) + np.log(kve(nu, z)) - z
+
+
+def fit_gh(log_returns: np.ndarray, alpha: float = DEFAULT_GH_ALPHA) -> dict:
+    '''
+    Maximum likelihood GH params (`mu`, `beta`, `delta`, `lambda_` at fixed `alpha`) of the daily simple returns
+    '''
+    x = np.expm1(np.asarray(log_returns, dtype=np.float64))
+    var = x.var()
+
+    def neg_log_likelihood(p):
+        mu, beta, log_shape, log_scale = p
+        value = -gh_log_likelihood(x, mu, beta, np.exp(log_shape), np.exp(log_scale)).sum()
+        return value if np.isfinite(value) else 1e10
+
+    shape0 = 3.
+    fit = minimize(neg_log_likelihood, [np.median(x), 0., np.log(shape0), np.log(var * (shape0 - 1))], method='Nelder-Mead')
+    mu, beta, log_shape, log_scale = fit.x
+    return dict(mu=mu, alpha=alpha, beta=beta, delta=np.sqrt(np.exp(log_scale) * alpha), lambda_=-np.exp(log_shape))
+
+
+def fit_garch(log_returns: np.ndarray) -> dict:
+    return series_gen.fit_garch(log_returns)
+
+
+def fit_regime_switching(log_returns: np.ndarray) -> dict:
+    return series_gen.fit_regime_switching(log_returns)
+
+
+#fitters by `series_gen.RETURN_FUNCTIONS` name
+FITTERS: Dict[str, Callable[[np.ndarray], dict]] = {'Lognormal Random Walk': fit_lognormal
+                                                     , 'Generalized Hyperbolic': fit_gh
+                                                     , 'GARCH(1,1)': fit_garch
+                                                     , 'Regime Switching': fit_regime_switching
+                                                     }
+
+
+def calibrate_returns(log_returns: np.ndarray, return_function: str) -> dict:
+    if return_function not in FITTERS:
+        raise ValueError(f'No calibration for {return_function}, expected one of: ' + ','.join(FITTERS))
+    return {k: float(v) for k, v in FITTERS[return_function](log_returns).items()}
+
+
+@lru_cache(maxsize=None)
+def _calibrate(symbol: str, return_function: str, lookback_days: int) -> tuple:
+    return tuple(calibrate_returns(data_source.load_log_returns(symbol, lookback_days=lookback_days), return_function).items())
+
+
+#fits computed so far by (symbol, model, window), looked up by callers that must not fetch or fit
+_fitted: Dict[tuple, tuple] = dict()
+
+
+def calibrate(symbol: str, return_function: str, lookback_days: int = 365) -> dict:
+    '''
+    `return_function` params fitted to the daily log returns of `symbol` over `lookback_days`,
+    memoized per (symbol, model, window) for the life of the process
+    '''
+    fit = _calibrate(symbol, return_function, lookback_days)
+    _fitted[(symbol, return_function, lookback_days)] = fit
+    return dict(fit)
+
+
+def cached_calibration(symbol: str, return_function: str, lookback_days: int = 365) -> dict:
+    '''
+    The fit of `calibrate` if it was already computed, otherwise None; never loads data or fits
+    '''
+    fit = _fitted.get((symbol, return_function, lookback_days))
+    return None if fit is None else dict(fit)
+
+
+def warm(symbols, return_functions, lookback_days: int = 365) -> threading.Thread:
+    '''
+    Fit every `return_functions` model to every symbol of `symbols` in a background daemon thread,
+    so `cached_calibration` finds them later. Symbols whose history cannot be loaded are skipped
+    '''
+    def run():
+        for symbol in symbols:
+            for return_function in return_functions:
+                try:
+                    calibrate(symbol, return_function, lookback_days)
+                except Exception as e:
+                    print(f'CANNOT CALIBRATE {symbol} ({return_function}):', e)
+
+    thread = threading.Thread(target=run, name='calibration-warm-up', daemon=True)
+    thread.start()
+    return thread
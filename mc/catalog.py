@@ -0,0 +1,140 @@
+import json
+import os
+import re
+import sqlite3
+from contextlib import closing
+from typing import Dict, List
+
+import pandas as pd
+
+from . import store
+
+CATALOG_FILE = 'catalog.sqlite'
+TABLE = 'runs'
+#columns every catalog has, the config and stats columns are added as runs bring them
+BASE_COLUMNS = {'run_id': 'TEXT PRIMARY KEY', 'folder': 'TEXT', 'created': 'TEXT', 'store': 'TEXT'}
+
+
+def default_runs_dir() -> str:
+    return os.path.join(os.path.abspath('.'), 'data', 'runs')
+
+
+def column_name(name: str) -> str:
+    '''
+    SQL friendly column name of a config key or a stat, e.g. `P(losing <30%)` -> `P_losing_30`
+    '''
+    return re.sub(r'\W+', '_', name).strip('_')
+
+
+def flatten_config(config: dict) -> Dict[str, object]:
+    '''
+    Nested config dict to leaf columns; a leaf whose name is already taken is prefixed with its parent key
+    '''
+    flat = dict()
+    for key, value in config.items():
+        if isinstance(value, dict):
+            for leaf, leaf_value in value.items():
+                name = column_name(leaf) if column_name(leaf) not in flat else column_name(f'{key}_{leaf}')
+                flat[name] = leaf_value
+        else:
+            flat[column_name(key)] = value
+    return flat
+
+
+def _sql_type(value) -> str:
+    #a column first seen empty gets no type affinity, so later numbers are not stored as text
+    if value is None: return ''
+    if isinstance(value, bool): return 'INTEGER'
+    if isinstance(value, (int, float)): return 'NUMERIC'
+    return 'TEXT'
+
+
+def _sql_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)): return value
+    if hasattr(value, 'item'): return value.item()
+    return json.dumps(value, default=str)
+
+
+class RunCatalog:
+    def __init__(self, path: str = None) -> None:
+        '''
+        SQLite index of the saved runs: one row per run with the flattened config and summary stats as columns.
+        New config keys and stats add columns on the fly
+        '''
+        self.path = path or os.path.join(default_runs_dir(), CATALOG_FILE)
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with closing(self._connect()) as conn, conn:
+            columns = ', '.join(f'"{name}" {sql_type}' for name, sql_type in BASE_COLUMNS.items())
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {TABLE} ({columns})')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    @property
+    def columns(self) -> List[str]:
+        with closing(self._connect()) as conn:
+            return [row[1] for row in conn.execute(f'PRAGMA table_info({TABLE})')]
+
+    def register(self, run_id: str, folder: str, config: dict = None, stats: dict = None, store_folder: str = None, created: str = None) -> dict:
+        '''
+        Insert or replace the row of a run, returns the row
+        '''
+        row = dict(run_id=run_id, folder=folder, created=created, store=store_folder)
+        row.update(flatten_config(config or dict()))
+        row.update({column_name(k): v for k, v in (stats or dict()).items()})
+        row = {k: _sql_value(v) for k, v in row.items()}
+
+        with closing(self._connect()) as conn, conn:
+            existing = {r[1] for r in conn.execute(f'PRAGMA table_info({TABLE})')}
+            for name, value in row.items():
+                if name not in existing:
+                    conn.execute(f'ALTER TABLE {TABLE} ADD COLUMN "{name}" {_sql_type(value)}')
+            names = ', '.join(f'"{name}"' for name in row)
+            placeholders = ', '.join('?' for _ in row)
+            conn.execute(f'INSERT OR REPLACE INTO {TABLE} ({names}) VALUES ({placeholders})', list(row.values()))
+        return row
+
+    def query(self, where: str = None, params: tuple = (), columns: List[str] = None, order_by: str = None, limit: int = None) -> pd.DataFrame:
+        '''
+        Runs matching the SQL `where` clause, e.g. `ticker_name = 'ETH' AND percent_allocated = 0.5 AND Sharpe > 1`
+        '''
+        select = '*' if not columns else ', '.join(f'"{c}"' for c in columns)
+        sql = f'SELECT {select} FROM {TABLE}'
+        if where: sql += f' WHERE {where}'
+        if order_by: sql += f' ORDER BY {order_by}'
+        if limit: sql += f' LIMIT {int(limit)}'
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def get(self, run_id: str) -> dict:
+        runs = self.query('run_id = ?', (run_id,))
+        if len(runs) == 0: raise KeyError(f'run {run_id} is not in the catalog')
+        return runs.iloc[0].to_dict()
+
+    def load(self, run_id: str) -> store.RunStore:
+        '''
+        Lazy reader of the arrays of a cataloged run
+        '''
+        run = self.get(run_id)
+        if not run.get('store'): raise KeyError(f'run {run_id} has no stored arrays')
+        return store.RunStore(run['store'])
+
+    def rebuild(self, runs_dir: str = None) -> int:
+        '''
+        Index the run folders already on disk (array manifests and `portfolio_summary.csv`), returns the number of runs
+        '''
+        runs_dir = runs_dir or os.path.dirname(self.path)
+        registered = 0
+        for run_id in sorted(os.listdir(runs_dir)):
+            folder = os.path.join(runs_dir, run_id)
+            store_folder = os.path.join(folder, 'arrays')
+            if not os.path.exists(os.path.join(store_folder, store.MANIFEST_FILE)): continue
+            run_store = store.RunStore(store_folder)
+            stats_csv = os.path.join(folder, 'portfolio_summary.csv')
+            stats = pd.read_csv(stats_csv, index_col=0)['value'].to_dict() if os.path.exists(stats_csv) else None
+            self.register(run_id, folder, config=run_store.config, stats=stats
+                          , store_folder=store_folder, created=run_store.manifest.get('created'))
+            registered += 1
+        return registered
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import Future, TimeoutError
+from dataclasses import asdict
+from typing import Callable, Dict
+
+from . import utils
+from .jobs import JobCancelled
+from .progress import ProgressCallback
+
+#how often attached callers relay the progress of the shared run, seconds
+FOLLOWER_POLL_INTERVAL = 0.1
+
+
+def config_key(config: utils.Config, **extra) -> str:
+    '''
+    Canonical hash of a run: the config (including its `seed`) serialized with sorted keys, plus `extra` options
+    that change the result, e.g. the response format
+    '''
+    payload = dict(config=asdict(config), extra=extra)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.future = Future()
+        self.state = None
+        self.followers = 0
+
+    def leader_progress(self, progress: ProgressCallback) -> ProgressCallback:
+        def callback(stage, fraction):
+            self.state = (stage, fraction)
+            if progress is not None: progress(stage, fraction)
+        return callback
+
+    def wait(self, progress: ProgressCallback):
+        '''
+        Block until the leader is done, replaying its progress on the follower's own callback (and thread),
+        so a cancelled follower detaches without affecting the shared run
+        '''
+        last_state = None
+        while True:
+            try:
+                return self.future.result(timeout=FOLLOWER_POLL_INTERVAL)
+            except JobCancelled:
+                raise _LeaderCancelled()
+            except TimeoutError:
+                state = self.state
+                if progress is not None and state is not None and state != last_state:
+                    last_state = state
+                    progress(*state)
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        '''
+        Coalesce concurrent identical runs: the first caller for a key executes the function,
+        callers arriving while it is in flight wait for and share its result (or exception).
+        If the leader is cancelled its followers start the run again. Results are not cached once the run is finished
+        '''
+        self._flights: Dict[str, _Flight] = dict()
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def run(self, key: str, func: Callable, *args, progress: ProgressCallback = None, **kwargs):
+        '''
+        `func(*args, progress=..., **kwargs)` once per in-flight `key`
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return flight.wait(progress)
+            except _LeaderCancelled:
+                return self.run(key, func, *args, progress=progress, **kwargs)
+
+        try:
+            result = func(*args, progress=flight.leader_progress(progress), **kwargs)
+        except BaseException as e:
+            self._land(key)
+            flight.future.set_exception(e)
+            raise
+        self._land(key)
+        flight.future.set_result(result)
+        return result
+
+    def _land(self, key: str) -> None:
+        #drop the flight before publishing the outcome, so retrying followers start a new one
+        with self._lock:
+            del self._flights[key]
@@ -1,5 +1,7 @@
 
+import numpy as np
 from .assets import *
+from . import pricing
 from .utils import StrategyParams , Config 
 from typing import List, Dict
 from collections.abc import Mapping
@@ -60,24 +62,74 @@ class OptionBook(AssetCollection):
         self._risk_free_rate = risk_free_rate
         self._options = []
         self._expired_options = []
+        #mark-to-market state: contract arrays are rebuilt only when the book changes
+        self._contracts = None
+        self._marks = dict()
 
-    def write(self,ticker:Symbols, type:OptionType,side: TransactionType, current_price: float, strike: float, amount: float, expiration: int) -> EuropeanNaiveOption:
+    def write(self,ticker:Symbols, type:OptionType,side: TransactionType, current_price: float, strike: float, amount: float, expiration: int, written_at:int=0) -> EuropeanNaiveOption:
         
         if type ==  OptionType.PUT:
             option = EuropeanNaivePutOption(ticker=ticker,volatility=self._volatility,risk_free_rate=self._risk_free_rate).write(current_price=current_price, strike=strike,
-                        amount=amount, expiration=expiration)
+                        amount=amount, expiration=expiration, written_at=written_at, side=side, use_premium_cache=True)
         
         elif type == OptionType.CALL:
             option = EuropeanNaiveCallOption(ticker=ticker
                                             ,volatility=self._volatility,risk_free_rate=self._risk_free_rate).write(current_price=current_price, strike=strike,
-                        amount=amount, expiration=expiration)
+                        amount=amount, expiration=expiration, written_at=written_at, side=side, use_premium_cache=True)
         
         self._options.append(option)
+        self._contracts = None
         return option.premium
 
     def clean_book(self,option:EuropeanNaiveOption) -> None:
         self._expired_options.append(option)
         self._options.remove(option)
+        self._contracts = None
+        if len(self.underlying_options(option.underlying)) == 0:
+            self._marks.pop(option.underlying, None)
+
+    def _contract_arrays(self,ticker:Symbols) -> Dict[str,np.ndarray]:
+        '''
+        Static contract data of the open options on `ticker` packed into arrays.
+        The arrays are cached until the next `write` or `clean_book`, so daily marking is a single vectorized call
+        '''
+        if self._contracts is None:
+            self._contracts = dict()
+        if ticker not in self._contracts:
+            options = self.underlying_options(ticker)
+            self._contracts[ticker] = dict(strike=np.array([o.strike for o in options],dtype=float)
+                                        ,expiration=np.array([o.expiration for o in options],dtype=float)
+                                        ,is_call=np.array([o.type == OptionType.CALL for o in options],dtype=bool)
+                                        ,position=np.array([-o.amount if o.is_short else o.amount for o in options],dtype=float)
+                                        )
+        return self._contracts[ticker]
+
+    def mark_to_market(self,t:int,ticker:Symbols,current_price:float) -> float:
+        '''
+        Revalue the open options on `ticker` at time step `t`.
+        Short positions are liabilities, so written options contribute a negative value to the book
+        '''
+        contracts = self._contract_arrays(ticker)
+        if len(contracts['strike']) == 0:
+            self._marks.pop(ticker, None)
+            return 0.0
+
+        prices = pricing.black_scholes_price(spot_price=current_price
+                                            ,strike=contracts['strike']
+                                            ,maturity=contracts['expiration'] - t
+                                            ,volatility=self._volatility
+                                            ,risk_free_rate=self._risk_free_rate
+                                            ,is_call=contracts['is_call']
+                                            )
+        self._marks[ticker] = float(np.dot(contracts['position'], prices))
+        return self._marks[ticker]
+
+    @property
+    def value(self):
+        '''
+        Last mark-to-market value of the open options
+        '''
+        return sum(self._marks.values())
 
     def expired_options(self) -> List[EuropeanNaiveOption]:
         return self._expired_options
@@ -134,7 +186,15 @@ class Portfolio:
 
     @property
     def value(self):
-        return self._cash.value + self._equity.value + self._options.value
+        #cash and equity held, the base the rebalancing targets are taken from
+        return self._cash.value + self._equity.value
+
+    @property
+    def marked_value(self):
+        '''
+        Net value with the open options marked to market (written options are liabilities)
+        '''
+        return self.value + self._options.value
     
     
     @property
@@ -1,22 +1,41 @@
 import ccxt
 import numpy as np
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta
 from typing import NamedTuple, DefaultDict
 from . import names
 from collections import defaultdict
 
+#history loaded for the rolling-origin backtest
+ROLLING_LOOKBACK_DAYS = 4 * 365
+DAY_MS = 86400000
+
 class TickerMarketData(NamedTuple):
     current_price:float=100.0
     volatility: float=0.25
 
 def get_crypto_price_series(exchange_id:str,symbol:str, lookback_days=365)-> np.array:
+    '''
+    Daily close prices of `symbol` over the last `lookback_days`. Exchanges cap the candles returned per call
+    (300 on coinbase), so the window is fetched page by page, each call starting after the last candle received
+    '''
     exchange_class = getattr(ccxt, exchange_id)
     exchange = exchange_class()
 
     timeframe = '1d'
     now = exchange.milliseconds()
-    historical_prices = exchange.fetch_ohlcv(symbol, timeframe, since=now - (86400000 * lookback_days))
-    return np.array([price[4] for price in historical_prices])
+    since = now - (DAY_MS * lookback_days)
+    closes = dict()
+    while since < now:
+        candles = exchange.fetch_ohlcv(symbol, timeframe, since=since)
+        if len(candles) == 0: break
+        closes.update((candle[0], candle[4]) for candle in candles)
+        last = max(candle[0] for candle in candles)
+        #no progress: the exchange has nothing after `since`
+        if last < since: break
+        since = last + DAY_MS
+    return np.array([closes[t] for t in sorted(closes)])
 
 def get_crypto_price_volatility(exchange_id:str,symbol:str, lookback_days=365)->TickerMarketData:
     exchange_class = getattr(ccxt, exchange_id)
@@ -45,6 +64,9 @@ def load_market_data(exchange='coinbasepro',lookback_days=365)->DefaultDict[str,
 
 
 def load_array_series(series,exchange='coinbasepro',lookback_days=365)->np.array:
+    '''
+    (K, L) close prices of the `series` symbols, trimmed to their common (most recent) length L
+    '''
     data_list = []
     for symbol in series:
         try:
@@ -55,4 +77,52 @@ def load_array_series(series,exchange='coinbasepro',lookback_days=365)->np.array
             )
         except:
             print(f'CANNOT LOAD {symbol.value} DATA')
-    return np.stack(data_list, axis=0 )
\ No newline at end of file
+    if len(data_list) == 0: raise ValueError('no price series could be loaded for: ' + ','.join(str(s.value) for s in series))
+    n = min(len(prices) for prices in data_list)
+    return np.stack([prices[-n:] for prices in data_list], axis=0 )
+
+
+def log_return_correlation(prices:np.array)->np.array:
+    '''
+    Correlation matrix of the daily log returns of (K, T) price series
+    '''
+    log_returns = np.diff(np.log(np.asarray(prices, dtype=np.float64)), axis=1)
+    return np.atleast_2d(np.corrcoef(log_returns))
+
+
+def load_correlation_matrix(series,exchange='coinbasepro',lookback_days=365)->np.array:
+    '''
+    Historical correlation of the `series` symbols over their common (most recent) history
+    '''
+    prices = [get_crypto_price_series(exchange,symbol=f'{symbol.value}/USDT',lookback_days=lookback_days) for symbol in series]
+    n = min(len(p) for p in prices)
+    return log_return_correlation(np.stack([p[-n:] for p in prices], axis=0))
+
+
+def rolling_windows(history:np.array, window:int, step:int=1, start_price:float=None)->np.array:
+    '''
+    Overlapping `window`-day paths starting every `step` days of a (L,) or (K, L) price history, as rows of a
+    (n_windows, window) array (the windows of each series one after the other).
+    Without `start_price` a 1d history gives a read-only strided view, nothing is copied;
+    with it every window is rescaled to start at `start_price`
+    '''
+    history = np.asarray(history)
+    if history.shape[-1] < window:
+        raise ValueError(f'history of {history.shape[-1]} days is shorter than the {window} days window, load a longer lookback or use a shorter T')
+    windows = sliding_window_view(history, window, axis=-1)[..., ::step, :]
+    if windows.ndim == 3:
+        windows = windows.reshape(-1, window)
+    if start_price is None:
+        return windows
+    return windows * (start_price / windows[:, :1])
+
+
+@lru_cache(maxsize=None)
+def load_log_returns(symbol:str,exchange='coinbasepro',lookback_days=365)->np.array:
+    '''
+    Daily log returns of `symbol` (e.g. `ETH`), fetched once per process and shared read-only
+    '''
+    prices = get_crypto_price_series(exchange,symbol=f'{symbol}/USDT',lookback_days=lookback_days)
+    log_returns = np.ascontiguousarray(np.diff(np.log(prices)))
+    log_returns.setflags(write=False)
+    return log_returns
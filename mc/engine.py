@@ -1,13 +1,17 @@
 
 from dataclasses import dataclass
+import time
 import numpy as np
 import pandas as pd
-from . import executor, series_gen ,data_source, utils , plotting , analysis , names
+from . import executor, series_gen ,data_source, utils , plotting , analysis , names , profiling , coalescing
+from .progress import ProgressCallback, report as report_progress
 
 @dataclass
 class ResultSeries:
     allocated_capital: np.array
     sim_res: np.array
+    #likelihood ratios of importance sampled paths
+    weights: np.array = None
 @dataclass
 class ResultPlots:
     baseline_only_plot_data:plotting.PlotData
@@ -25,6 +29,7 @@ class ResultPlots:
 @dataclass
 class ResultSummary:
     run_summary: analysis.ReturnsCalculator
+    baseline_summary: analysis.ReturnsCalculator = None
 
 
 @dataclass
@@ -32,77 +37,217 @@ class SimResults:
     series: ResultSeries
     plots: ResultPlots
     summary: ResultSummary
+    timings: profiling.StageTimings = None
+    #standard errors of the tracked stats of an adaptive run
+    precision: analysis.PrecisionTracker = None
 
 
 class MCSEngine:
     def __init__(self,config:utils.Config) -> None:
         self._config = config
     
-    def run(self)->SimResults:
+    def run(self,progress:ProgressCallback=None,render_plots:bool=True)->SimResults:
         '''
-        :param str data_mode: use `simulation` for simulated data or `backtest` for real data
+        :param str data_mode: use `simulation` for simulated data, `backtest` for real data
+                              or `rolling_backtest` for every T-day window of a longer history
+        :param progress: optional `callback(stage, fraction)` reporting the stage and its completed fraction
+        :param render_plots: build the figures; machine clients that only need the numbers can skip it
 
         :returns SimResults
         '''
+        timings = profiling.StageTimings(trace_memory=self._config.profile_memory)
+        dtype = utils.resolve_dtype(self._config.dtype)
+
+        #the return functions draw from a generator of this run only: concurrent runs in the process
+        #(job queue, web threads, coalesced callers) do not reseed or consume each other's stream
+        rng = np.random.default_rng(self._config.seed)
         
         #use historical data
         
-        #Generate asset time series  
-        if self._config.data_mode=='simulation':
-            sim_res = series_gen.generate_time_series(self._config.return_function_params['N']
-                                                , self._config.return_function_params['T']
-                                                ,current_price=self._config.return_function_params['current_price']
-                            , return_func = series_gen.return_functions(self._config.return_function)
-                            , params=self._config.return_function_params,)
-
-        elif self._config.data_mode == 'backtest':
-            series = [symbol for symbol in names.Symbols if symbol.value == self._config.strategy_function_params['ticker_name']  or self._config.strategy_function_params['all_series_backtest']]
-            sim_res = data_source.load_array_series(series)
-            self._config.return_function_params['current_price'] = sim_res[0][0]
-        else: raise ValueError(f'invalid data_mode run param: {self._config.data_mode}')
+        precision, weights = None, None
+        if self._config.adaptive is not None and self._config.data_mode=='simulation':
+            if self._config.importance_sampling is not None: raise ValueError('importance sampling does not support adaptive runs')
+            with timings.stage('adaptive_sampling'):
+                sim_res, allocated_capital, baseline_non_allocated, precision = self._run_adaptive(dtype,rng,progress)
+        else:
+            #Generate asset time series  
+            with timings.stage('path_generation'):
+                if self._config.data_mode=='simulation' and self._config.importance_sampling is not None:
+                    sim_res, weights = self._simulate_weighted_paths(dtype,rng,progress)
 
-    
+                elif self._config.data_mode=='simulation':
+                    sim_res = self._simulate_paths(self._config.return_function_params['N'],dtype,self._config.seed,rng,progress)
+
+                elif self._config.data_mode == 'backtest':
+                    series = [symbol for symbol in names.Symbols if symbol.value == self._config.strategy_function_params['ticker_name']  or self._config.strategy_function_params['all_series_backtest']]
+                    sim_res = data_source.load_array_series(series).astype(dtype,copy=False)
+                    self._config.return_function_params['current_price'] = sim_res[0][0]
+                    report_progress(progress,'path_generation',1.0)
+
+                elif self._config.data_mode == 'rolling_backtest':
+                    #every T-day window of the history is one path: a read-only strided view of the history in its own dtype,
+                    #the executor scales the holdings of each path to the capital of the configured starting price
+                    series = [symbol for symbol in names.Symbols if symbol.value == self._config.strategy_function_params['ticker_name']  or self._config.strategy_function_params['all_series_backtest']]
+                    history = data_source.load_array_series(series,lookback_days=self._config.return_function_params.get('lookback_days',data_source.ROLLING_LOOKBACK_DAYS))
+                    sim_res = data_source.rolling_windows(history
+                                                        ,window=self._config.return_function_params['T']
+                                                        ,step=self._config.return_function_params.get('window_step',1)
+                                                        )
+                    self._config.return_function_params['N'] = sim_res.shape[0]
+                    report_progress(progress,'path_generation',1.0)
+                else: raise ValueError(f'invalid data_mode run param: {self._config.data_mode}')
+
+            #run the strategy
+            with timings.stage('strategy_execution'):
+                allocated_capital = self._run_strategy(sim_res,progress)
+
+            #baseline strategy
+            with timings.stage('baseline_execution'):
+                baseline_non_allocated = self._run_baseline(sim_res,progress)
+        
+        with timings.stage('stats'):
+            report_progress(progress,'stats',0.0)
+            #cash investemnt comparison
+            cash_start = allocated_capital[0,0,utils.ASSET_INDEX['cash']]
+            daily_appreceation = series_gen.cash_investment(n=self._config.return_function_params['T']
+                                                            ,initial_amount=cash_start
+                                                            ,rate=self._config.strategy_function_params['cash_interest']
+                                                            ,capitalization_period=1
+                                                            )
+            mo6_appreceation = series_gen.cash_investment(n=self._config.return_function_params['T']
+                                                            ,initial_amount=cash_start
+                                                            ,rate=self._config.strategy_function_params['cash_interest']
+                                                            ,capitalization_period=179
+                                                            )
+            cash_interest_comp = pd.DataFrame(np.array([daily_appreceation, mo6_appreceation]).T,columns=['Daily capitalization','Semi-annual capitalization'])
+
+
+            #calculate summary statistics
+            run_summary =  (analysis.ReturnsCalculator(allocated_capital,risk_free_rate=self._config.strategy_function_params['cash_interest'],weights=weights)
+                            .calculate_returns()
+                            .calculate_stats()
+                            .calculate_sample_stats()
+                            )
+            baseline_returns =  (analysis.ReturnsCalculator(baseline_non_allocated,weights=weights)
+                            .calculate_returns()
+                            .calculate_stats()
+                            )
+            print('simulation stats:\n',run_summary.stats_str)
+
+        with timings.stage('plotting'):
+            report_progress(progress,'plotting',0.0)
+            plots = self.plot(sim_res,run_summary,baseline_returns,cash_interest_comp,weights=weights) if render_plots else None
+
+        report_progress(progress,'done',1.0)
+        return SimResults(series=ResultSeries(sim_res=sim_res
+                                            ,allocated_capital=allocated_capital
+                                            ,weights=weights)
+                        ,summary=ResultSummary(run_summary=run_summary,baseline_summary=baseline_returns)
+                        ,plots=plots
+                        ,timings=timings
+                        ,precision=precision
+                        )
+
+    def _simulate_paths(self,N:int,dtype:np.dtype,seed,rng:np.random.Generator,progress:ProgressCallback=None)->np.ndarray:
+        return series_gen.generate_time_series(N
+                                            , self._config.return_function_params['T']
+                                            ,current_price=self._config.return_function_params['current_price']
+                        , return_func = series_gen.return_functions(self._config.return_function)
+                        , params={'ticker_name':self._config.strategy_function_params['ticker_name'],**self._config.return_function_params}
+                        , progress=progress
+                        , dtype=dtype
+                        , innovations=self._config.innovations
+                        , seed=seed
+                        , rng=rng)
+
+    def _simulate_weighted_paths(self,dtype:np.dtype,rng:np.random.Generator,progress:ProgressCallback=None):
+        '''
+        Importance sampled paths (innovations tilted toward losses) and their likelihood ratio weights
+        '''
+        importance = utils.ImportanceParams(**self._config.importance_sampling)
+        return series_gen.generate_weighted_time_series(self._config.return_function_params['N']
+                                            , self._config.return_function_params['T']
+                                            ,current_price=self._config.return_function_params['current_price']
+                        , return_func = series_gen.return_functions(self._config.return_function)
+                        , params=self._config.return_function_params
+                        , tilt=importance.tilt
+                        , target_loss=importance.target_loss
+                        , progress=progress
+                        , dtype=dtype
+                        , innovations=self._config.innovations
+                        , seed=self._config.seed
+                        , rng=rng)
 
-        #run the strategy
-        one_asset_strategy_params = utils.StrategyParams(**self._config.strategy_function_params)
-        allocated_capital= executor.run_one_asset_rebalance_portfolio_v1(time_series=sim_res
+    def _amount_multiple(self,sim_res:np.ndarray):
+        '''
+        Configured amount multiple; rolling backtest windows keep their market prices, so every path
+        starts with the capital of `current_price` through a per path multiple
+        '''
+        amount_multiple = self._config.strategy_function_params['amount_multiple']
+        if self._config.data_mode != 'rolling_backtest': return amount_multiple
+        return amount_multiple * self._config.return_function_params['current_price'] / sim_res[:,0].astype(np.float64)
+
+    def _run_strategy(self,sim_res:np.ndarray,progress:ProgressCallback=None)->np.ndarray:
+        one_asset_strategy_params = utils.StrategyParams(**{**self._config.strategy_function_params,'amount_multiple':self._amount_multiple(sim_res)})
+        return executor.run_one_asset_rebalance_portfolio_v1(time_series=sim_res
                                             ,strategy_params=one_asset_strategy_params
                                             ,config = self._config
+                                            ,progress=progress
+                                            ,stage='strategy_execution'
                             )
 
-        #baseline strategy
-        baseline_functio_params = utils.StrategyParams(amount_multiple=self._config.strategy_function_params['amount_multiple'])
-        baseline_non_allocated= executor.run_one_asset_rebalance_portfolio_v1(time_series=sim_res
+    def _run_baseline(self,sim_res:np.ndarray,progress:ProgressCallback=None)->np.ndarray:
+        baseline_functio_params = utils.StrategyParams(amount_multiple=self._amount_multiple(sim_res))
+        return executor.run_one_asset_rebalance_portfolio_v1(time_series=sim_res
                                             ,strategy_params=baseline_functio_params
                                             ,config = self._config
+                                            ,progress=progress
+                                            ,stage='baseline_execution'
                             )
-        
-        #cash investemnt comparison
-        cash_start = allocated_capital[0,0,utils.ASSET_INDEX['cash']]
-        daily_appreceation = series_gen.cash_investment(n=self._config.return_function_params['T']
-                                                        ,initial_amount=cash_start
-                                                        ,rate=self._config.strategy_function_params['cash_interest']
-                                                        ,capitalization_period=1
-                                                        )
-        mo6_appreceation = series_gen.cash_investment(n=self._config.return_function_params['T']
-                                                        ,initial_amount=cash_start
-                                                        ,rate=self._config.strategy_function_params['cash_interest']
-                                                        ,capitalization_period=179
-                                                        )
-        cash_interest_comp = pd.DataFrame(np.array([daily_appreceation, mo6_appreceation]).T,columns=['Daily capitalization','Semi-annual capitalization'])
 
+    def _run_adaptive(self,dtype:np.dtype,rng:np.random.Generator,progress:ProgressCallback=None):
+        '''
+        Simulate and run the strategy batch by batch until the standard errors of the tracked stats reach the tolerance,
+        `max_paths` are simulated or the time budget is spent; N is set to the number of paths simulated
 
-        #calculate summary statistics
-        run_summary =  (analysis.ReturnsCalculator(allocated_capital,risk_free_rate=self._config.strategy_function_params['cash_interest'])
-                        .calculate_returns()
-                        .calculate_stats()
-                        .calculate_sample_stats()
-                        )
-        baseline_returns =  (analysis.ReturnsCalculator(baseline_non_allocated)
-                        .calculate_returns()
-                        .calculate_stats()
-                        )
-        print('simulation stats:\n',run_summary.stats_str)
+        :returns paths, strategy and baseline capital of all the batches and the achieved `analysis.PrecisionTracker`
+        '''
+        adaptive = utils.AdaptiveParams(**self._config.adaptive)
+        batch_paths = adaptive.batch_paths or self._config.return_function_params['N']
+        tracker = analysis.PrecisionTracker(metrics=adaptive.metrics,tolerance=adaptive.tolerance)
+        batches = []
+        start = time.perf_counter()
+        report_progress(progress,'adaptive_sampling',0.0)
+        while True:
+            N = min(batch_paths,adaptive.max_paths-tracker.n_paths)
+            #every batch of sobol points is scrambled from its own seed
+            seed = None if self._config.seed is None else [self._config.seed,len(batches)]
+            sim_res = self._simulate_paths(N,dtype,seed,rng)
+            allocated_capital = self._run_strategy(sim_res)
+            batches.append((sim_res,allocated_capital,self._run_baseline(sim_res)))
+            tracker.update(analysis.ReturnsCalculator(allocated_capital).calculate_returns())
+            report_progress(progress,'adaptive_sampling',tracker.n_paths/adaptive.max_paths)
+
+            if tracker.converged: tracker.stop_reason = 'tolerance'
+            elif tracker.n_paths >= adaptive.max_paths: tracker.stop_reason = 'max_paths'
+            elif adaptive.time_budget is not None and time.perf_counter()-start >= adaptive.time_budget: tracker.stop_reason = 'time_budget'
+            if tracker.stop_reason is not None: break
+
+        print('adaptive sampling stopped on',tracker.stop_reason,'after',tracker.n_paths,'paths:',tracker.standard_errors)
+        self._config.return_function_params['N'] = tracker.n_paths
+        sim_res, allocated_capital, baseline_non_allocated = (np.concatenate(arrays) for arrays in zip(*batches))
+        return sim_res, allocated_capital, baseline_non_allocated, tracker
+
+    def plot(self,sim_res:np.ndarray,run_summary:analysis.ReturnsCalculator,baseline_returns:analysis.ReturnsCalculator,cash_interest_comp:pd.DataFrame,weights:np.ndarray=None)->ResultPlots:
+        '''
+        Render all the run figures, the bands of importance sampled paths weighted by their likelihood ratios
+        '''
+        #band summaries are computed once per series and shared by every figure
+        quantiles = analysis.band_quantiles(self._config.plot_params['ci'])
+        estimator = self._config.plot_params.get('band_estimator', analysis.DEFAULT_BAND_ESTIMATOR)
+        prices_bands = analysis.SeriesBands.from_paths(sim_res, quantiles, estimator, weights=weights)
+        portfolio_bands = run_summary.bands(quantiles, estimator)
+        baseline_bands = baseline_returns.bands(quantiles, estimator)
 
         # plot data
         prices_plot = plotting.plot_simulations(sim_res
@@ -113,6 +258,7 @@ class MCSEngine:
                                     ,ylabel ='Price'
                                     )
                                     ,show_plot=self._config.plot_params['show_plot']
+                                    ,bands=prices_bands
                                     )
         
         portfolio_plot_params =dict(title= 'Trajectories Confidence Interval'
@@ -125,6 +271,7 @@ class MCSEngine:
         prices_plot_ply = plotting.plot_simulations_ply(sim_res
                         ,params = portfolio_plot_params
                                     ,show_plot=self._config.plot_params['show_plot']
+                                    ,bands=prices_bands
                                     )
 
         try:
@@ -141,6 +288,7 @@ class MCSEngine:
         portfolio_plot = plotting.plot_simulations(run_summary.sim_portfolio
                         ,params = portfolio_plot_params
                                     ,show_plot=self._config.plot_params['show_plot']
+                                        ,bands=portfolio_bands
                                     )
         
         
@@ -148,6 +296,7 @@ class MCSEngine:
         portfolio_plot_ply = plotting.plot_simulations_ply(run_summary.sim_portfolio
                         ,params = portfolio_plot_params
                                     ,show_plot=self._config.plot_params['show_plot']
+                                        ,bands=portfolio_bands
                                     )
 
         #plot single portfolio simulation
@@ -210,6 +359,8 @@ class MCSEngine:
                                 ,param_box_message= text_box_message.render_param_str()
                                 ,stats_box_message= text_box_message.render_stats_str()
                                                             ,show_plot=self._config.plot_params['show_plot']
+                                ,bands_baseline=baseline_bands
+                                ,bands=portfolio_bands
                                                         )
         
         
@@ -217,6 +368,8 @@ class MCSEngine:
         comparison_plot_data_ply = plotting.plot_comparison_ply(baseline_returns.sim_portfolio,run_summary.sim_portfolio
                                 ,params = comp_plot_parmas
                                 ,show_plot=self._config.plot_params['show_plot']
+                                ,bands_baseline=baseline_bands
+                                ,bands=portfolio_bands
                                                         )
         
         
@@ -229,27 +382,37 @@ class MCSEngine:
                                 ,param_box_message= text_box_message.render_param_str()
                                 ,stats_box_message= text_box_message.render_stats_str()
                                                             ,show_plot=self._config.plot_params['show_plot']
+                                ,bands_baseline=baseline_bands
                                                         )
 
+        return ResultPlots(baseline_only_plot_data=baseline_only_plot_data
+                            ,comparison_plot_data= comparison_plot_data
+                            ,comparison_plot_data_ply =comparison_plot_data_ply
+                            ,cash_appreciation_plot = cash_appreciation_plot
+                            ,cash_appreciation_plot_ply = cash_appreciation_plot_ply
+                            ,portfolio_plot= portfolio_plot
+                            ,portfolio_plot_ply=portfolio_plot_ply
+                            ,single_portfolio_ts_plot_ply=single_portfolio_ts_plot_ply
+                            ,histigrams_plot= histigrams_plot
+                            ,prices_plot = prices_plot
+                            ,prices_plot_ply=prices_plot_ply
+                            )
 
 
-        return SimResults(series=ResultSeries(sim_res=sim_res
-                                            ,allocated_capital=allocated_capital)
-                        ,summary=ResultSummary(run_summary=run_summary)
-                        ,plots=ResultPlots(baseline_only_plot_data=baseline_only_plot_data
-                                            ,comparison_plot_data= comparison_plot_data
-                                            ,comparison_plot_data_ply =comparison_plot_data_ply
-                                            ,cash_appreciation_plot = cash_appreciation_plot
-                                            ,cash_appreciation_plot_ply = cash_appreciation_plot_ply
-                                            ,portfolio_plot= portfolio_plot
-                                            ,portfolio_plot_ply=portfolio_plot_ply
-                                            ,single_portfolio_ts_plot_ply=single_portfolio_ts_plot_ply
-                                            ,histigrams_plot= histigrams_plot
-                                            ,prices_plot = prices_plot
-                                            ,prices_plot_ply=prices_plot_ply
-                                            )
-                        ,                                            
-                        )
-
-
+#concurrent runs of the same config and seed in this process share one run. The registry is per process
+#(the GUI and each API worker have their own), runs are not coalesced across processes
+simulation_flights = coalescing.SingleFlight()
 
+def run_coalesced(config:utils.Config,progress:ProgressCallback=None,render_plots:bool=True,show_legend:bool=True)->SimResults:
+    '''
+    `MCSEngine(config).run`, attaching to an identical run already in flight instead of starting a new one.
+    The figures are shared by the attached callers: render options such as `show_legend` are applied
+    inside the shared run and are part of its key, callers must not modify the figures
+    '''
+    key = coalescing.config_key(config,render_plots=render_plots,show_legend=show_legend)
+    def run(progress):
+        sim_results = MCSEngine(config).run(progress=progress,render_plots=render_plots)
+        if render_plots and not show_legend:
+            sim_results.plots.comparison_plot_data_ply.fig.update_layout(showlegend=False)
+        return sim_results
+    return simulation_flights.run(key,run,progress=progress)
@@ -8,6 +8,7 @@ from . import constants
 from .collections import *
 from .assets import *
 from .utils import StrategyParams , Config 
+from .progress import ProgressCallback, ProgressReporter
 from typing import List
 import traceback
 
@@ -90,7 +91,7 @@ class Trader:
         '''
         Print a quick summary of the portfolio report
         '''
-        return f'Value:{self._portfolio.value}(asset({self._portfolio.equity.value}) +cash({self._portfolio._cash.value})); Balance:{self._portfolio.share_balance};'
+        return f'Value:{self._portfolio.value}(asset({self._portfolio.equity.value}) +cash({self._portfolio._cash.value})); Marked value:{self._portfolio.marked_value}(+options({self._portfolio.option_book.value})); Balance:{self._portfolio.share_balance};'
     def rebalance(self,asset: Asset,target_share:float) -> None:
         '''
         rebalance cash and asset.
@@ -109,7 +110,7 @@ class Trader:
             self.execute_trade(asset, amout_diff * -1.0,TransactionType.SELL)
             
 
-    def write_strangle(self,symbol:Symbols,pct_from_strike:float,t,price:float,amount:float) -> None:
+    def write_strangle(self,symbol:Symbols,pct_from_strike:float,t,price:float,amount:float,written_at:int=0) -> None:
 
         #update option status and add cash
         call_strike = price * (1+ pct_from_strike)
@@ -120,7 +121,8 @@ class Trader:
                                         ,current_price=price
                                         ,strike=call_strike
                                         ,amount=amount
-                                        ,expiration=t)
+                                        ,expiration=t
+                                        ,written_at=written_at)
 
         put_strike = price * (1-pct_from_strike)
         premium+= self.portfolio.option_book.write(ticker=symbol
@@ -130,6 +132,7 @@ class Trader:
                                         ,strike=put_strike
                                         ,amount=amount
                                         ,expiration=t
+                                        ,written_at=written_at
                                         )
 
         return premium
@@ -183,20 +186,23 @@ class SimulationTracker:
         self._t = t
 
         self._rebalancing_count = np.zeros((n,)) # to keep track of how many times rebalancing has been done
-        self._last_rebalanced_price = np.copy(time_series[:,0]) # to keep track of the last rebalanced price
+        self._last_rebalanced_price = time_series[:,0].astype(np.float64) # to keep track of the last rebalanced price
 
         self._ASSET_INDEX = utils.ASSET_INDEX
         capital_in_asset = time_series[:,0] * strategy_params.percent_allocated * strategy_params.amount_multiple
         capital_in_cash = time_series[:,0] * (1-strategy_params.percent_allocated)* strategy_params.amount_multiple
+        capital_in_options = np.zeros_like(capital_in_asset)
 
         self.strategy_params = strategy_params
         self._allocated_capital = np.stack(( capital_in_asset[:,np.newaxis]
                                     ,capital_in_cash[:,np.newaxis]
+                                    ,capital_in_options[:,np.newaxis]
                                     ),axis=2
                                     )
 
-        self._allocated_capital = np.repeat(self._allocated_capital,t,axis=1)
-        self._allocated_capital[:,1:,:] = (np.nan,np.nan)
+        #logged in the dtype of the price paths
+        self._allocated_capital = np.repeat(self._allocated_capital.astype(time_series.dtype,copy=False),t,axis=1)
+        self._allocated_capital[:,1:,:] = np.nan
         self.logger = utils.create_logger()
     def _is_new_month(self,i):
         return i % 31 == 0
@@ -205,7 +211,8 @@ class SimulationTracker:
         return self._rebalancing_count[i] < self.strategy_params.max_rebalances
 
     def _get_price(self,i:int,j:int):
-        return self._ts[i,j]
+        #python float: the portfolio accounting stays in double precision whatever the dtype of the paths
+        return float(self._ts[i,j])
     
     def _capitalize_cash(self,i:int,j:int):
         asset_idx = self._ASSET_INDEX['cash']
@@ -243,9 +250,21 @@ class SimulationTracker:
         self._allocated_capital[i,j,asset_idx]  = self._traders[i].portfolio.cash.value
 
 
+    def _log_options_value(self,i:int,j:int):
+        asset_idx = self._ASSET_INDEX['options']
+        self._allocated_capital[i,j,asset_idx]  = self._traders[i].portfolio.option_book.value
+
+    def _mark_options_to_market(self,i:int,j:int,symbol:Symbols,price:float):
+        '''
+        Revalue written options so the portfolio value accounts for the open liabilities
+        '''
+        self._traders[i].portfolio.option_book.mark_to_market(j,symbol,price)
+        self._log_options_value(i,j)
+
     def log_state_change(self,i:int,j:int):
         self._log_cash_value(i,j)
         self._log_equity_value(i,j)
+        self._log_options_value(i,j)
     
     def _rebalance_portfolio(self,i,j,symbol:Symbols,price):
         asset = self._traders[i].portfolio.equity.get_asset(symbol)
@@ -289,7 +308,8 @@ class SimulationTracker:
                                         ,pct_from_strike = self.strategy_params.option_straddle_pct_from_strike
                                         , t= self.strategy_params.option_duration + t
                                         ,price=price
-                                        ,amount=amount)
+                                        ,amount=amount
+                                        ,written_at=t)
         
             self._traders[i].add_cash(premium_collected)
             self.logger.info(f'{t}:Premium collected:'+ str(premium_collected))
@@ -304,11 +324,12 @@ class SimulationTracker:
     def _end_of_day_report(self,i,t):
         self.logger.info(f'{t}:End-Of-Day Report:'+ self._traders[i].portfolio_state_report)
 
-    def run_simulations(self,logs_dir=None):
+    def run_simulations(self,logs_dir=None,progress:ProgressCallback=None,stage:str='strategy_execution'):
         '''
         Runner finction that exectute strategy for each price prajectory
+        `progress` is an optional `callback(stage, fraction)` called per chunk of trajectories
         '''
-
+        reporter = ProgressReporter(progress,stage,self._n).start()
         for i in tqdm(range(self._n)):
             log_file = os.path.join(logs_dir,f'simulation_{i}.log') if logs_dir is not None else None
             self.logger = utils.create_logger(log_file)
@@ -338,6 +359,9 @@ class SimulationTracker:
                     #check derivative contract execution
                     self._validate_derivatives(i,j,symbol_,new_price)
 
+                    #revalue open options before any rebalancing decision
+                    self._mark_options_to_market(i,j,symbol_,new_price)
+
                     #rebalance if needec
                     self._rebalance_portfolio(i,j,symbol_,new_price)
 
@@ -347,6 +371,7 @@ class SimulationTracker:
                     
                     self.logger.error(f'{j}:Exception during simulation:'+str(e)+'\n'+traceback.format_exc())
                     break
+            reporter.update(i+1)
         return self
 
     @property
@@ -362,19 +387,23 @@ def asset_return(asset:Asset,price:float):
     return asset.pct_return()
 
 
-def initialize_executors(n,return_function_params:dict,strategy_params: StrategyParams) -> List[Trader]:
+def initialize_executors(n,return_function_params:dict,strategy_params: StrategyParams,initial_prices:np.ndarray=None) -> List[Trader]:
     '''
     Return a list of portfolios for each simulation
+    `initial_prices` are the (n,) starting prices of the paths (`current_price` by default),
+    `strategy_params.amount_multiple` may be a (n,) array of per path multiples
     '''
 
     sim_portfolios = []
-    initial_price = return_function_params['current_price']
+    initial_prices = np.broadcast_to(return_function_params['current_price'] if initial_prices is None else initial_prices,(n,))
+    amount_multiples = np.broadcast_to(strategy_params.amount_multiple,(n,))
     volatility = return_function_params['sigma']
     for i in range(n):
+        initial_price, amount_multiple = float(initial_prices[i]), float(amount_multiples[i])
         portfolio = Portfolio()
-        cash_ = Cash(amount =  strategy_params.amount_multiple * (1-strategy_params.percent_allocated) * initial_price )
+        cash_ = Cash(amount =  amount_multiple * (1-strategy_params.percent_allocated) * initial_price )
         ticker = Symbols[strategy_params.ticker_name]
-        asset = Equity(ticker=ticker,amount= strategy_params.amount_multiple * strategy_params.percent_allocated
+        asset = Equity(ticker=ticker,amount= amount_multiple * strategy_params.percent_allocated
                                 ,initial_price=initial_price)
 
         equity_ = EquityPortfolio().add_asset(asset)
@@ -395,8 +424,9 @@ def initialize_executors(n,return_function_params:dict,strategy_params: Strategy
 
 def run_one_asset_rebalance_portfolio_v1(time_series: np.ndarray, 
                         strategy_params: StrategyParams,
-                        config: Config
-
+                        config: Config,
+                        progress:ProgressCallback=None,
+                        stage:str='strategy_execution'
                         ) -> np.ndarray:
 
     n, t = time_series.shape
@@ -404,14 +434,68 @@ def run_one_asset_rebalance_portfolio_v1(time_series: np.ndarray,
     sim_portfolios = initialize_executors(n
                                             ,return_function_params = config.return_function_params
                                             ,strategy_params=strategy_params
+                                            ,initial_prices=time_series[:,0]
                                             )
     
     #walk throught time series 
     sim_tracker = (SimulationTracker(time_series,sim_portfolios,strategy_params)
-                        .run_simulations(logs_dir=config.logs_dir)
+                        .run_simulations(logs_dir=config.logs_dir,progress=progress,stage=stage)
                         )
     return sim_tracker.allocated_capital
 
+def run_multi_asset_rebalance_portfolio(time_series: np.ndarray,
+                        weights,
+                        strategy_params: StrategyParams,
+                        progress:ProgressCallback=None,
+                        stage:str='strategy_execution'
+                        ) -> np.ndarray:
+    '''
+    Threshold rebalancing of a basket of K assets plus cash over (N, T, K) price paths, all paths at once.
+    The portfolio starts with `amount_multiple` baskets (`weights` per asset), `percent_allocated` of it in the assets
+    and the rest in cash. When any asset moves past `rebalance_threshold_down`/`_up` since the last rebalancing
+    (at most `max_rebalances` times) the whole portfolio is reset to the target weights.
+    Cash and staked coins accrue daily interest. Options are not written.
+    Returns the allocated capital (N, T, K+1): the K asset values followed by cash
+    '''
+    n, t, k = time_series.shape
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape != (k,): raise ValueError(f'{weights.shape[0]} weights for {k} assets')
+    weights = weights / weights.sum()
+    allocation = strategy_params.percent_allocated * weights
+
+    prices = time_series[:, 0].astype(np.float64)
+    total = strategy_params.amount_multiple * prices @ weights
+    units = np.divide(total[:, None] * allocation, prices, out=np.zeros((n, k)), where=prices > 0)
+    cash = total * (1 - strategy_params.percent_allocated)
+    last_rebalanced_price = prices.copy()
+    rebalancing_count = np.zeros(n)
+    cash_rate = 1 + strategy_params.cash_interest / constants.AnnualTimeInterval.days.value
+    coin_rate = 1 + strategy_params.coin_interest / constants.AnnualTimeInterval.days.value
+
+    allocated_capital = np.empty((n, t, k + 1), dtype=time_series.dtype)
+    allocated_capital[:, 0, :k] = units * prices
+    allocated_capital[:, 0, k] = cash
+    reporter = ProgressReporter(progress, stage, t).start()
+    for j in range(1, t):
+        prices = time_series[:, j].astype(np.float64)
+        cash = cash * cash_rate
+        units = units * coin_rate
+
+        move = np.divide(prices, last_rebalanced_price, out=np.ones((n, k)), where=last_rebalanced_price > 0)
+        triggered = (((move < 1 - strategy_params.rebalance_threshold_down) | (move > 1 + strategy_params.rebalance_threshold_up)).any(axis=1)
+                     & (rebalancing_count < strategy_params.max_rebalances))
+        if triggered.any():
+            value = (units[triggered] * prices[triggered]).sum(axis=1) + cash[triggered]
+            units[triggered] = np.divide(value[:, None] * allocation, prices[triggered], out=np.zeros((value.shape[0], k)), where=prices[triggered] > 0)
+            cash[triggered] = value * (1 - strategy_params.percent_allocated)
+            last_rebalanced_price[triggered] = prices[triggered]
+            rebalancing_count[triggered] += 1
+
+        allocated_capital[:, j, :k] = units * prices
+        allocated_capital[:, j, k] = cash
+        reporter.update(j + 1)
+    return allocated_capital
+
 def run_one_asset_rebalance_portfolio_v0(time_series: np.ndarray, 
                         strategy_params: StrategyParams
                         ) -> np.ndarray:
@@ -0,0 +1,176 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future
+from enum import Enum
+from typing import Callable, Dict
+
+
+class JobStatus(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    def __init__(self, message='Job was cancelled', *args: object) -> None:
+        super().__init__(message, *args)
+
+
+class QueueFull(Exception):
+    def __init__(self, message='Job queue is full, try again later', *args: object) -> None:
+        super().__init__(message, *args)
+
+
+class JobNotFound(Exception):
+    def __init__(self, message='Job not found', *args: object) -> None:
+        super().__init__(message, *args)
+
+
+class Job:
+    def __init__(self, name: str) -> None:
+        '''
+        A unit of work executed by `JobQueue`. The job function receives the `Job` as first argument,
+        can report progress and should call `check_cancelled` at safe points
+        '''
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = JobStatus.QUEUED
+        self.stage = None
+        self.progress = 0.0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.trace = None
+        self.result = None
+        self._future: Future = None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    def check_cancelled(self) -> None:
+        if self.cancel_requested: raise JobCancelled()
+
+    def report(self, stage: str, fraction: float) -> None:
+        self.stage = stage
+        self.progress = fraction
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done_event.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return dict(job_id=self.id
+                    , name=self.name
+                    , status=self.status.value
+                    , stage=self.stage
+                    , progress=self.progress
+                    , created=self.created
+                    , started=self.started
+                    , finished=self.finished
+                    , error=self.error
+                    )
+
+    def __repr__(self) -> str:
+        return f'Job(id={self.id},name={self.name},status={self.status.value},progress={self.progress})'
+
+
+class JobQueue:
+    def __init__(self, max_workers: int = 2, max_queue_depth: int = 16, result_ttl: float = 3600.) -> None:
+        '''
+        In-process job queue backed by a bounded thread pool.
+        `max_queue_depth` caps the number of jobs waiting for a worker, finished jobs are kept for `result_ttl` seconds
+        '''
+        self._max_workers = max_workers
+        self._max_queue_depth = max_queue_depth
+        self._result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mcs-job')
+        self._jobs: Dict[str, Job] = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return len([job for job in list(self._jobs.values()) if job.status == JobStatus.QUEUED])
+
+    @property
+    def running(self) -> int:
+        return len([job for job in list(self._jobs.values()) if job.status == JobStatus.RUNNING])
+
+    def submit(self, func: Callable, *args, name: str = None, **kwargs) -> Job:
+        '''
+        Queue `func(job, *args, **kwargs)`; raises `QueueFull` when `max_queue_depth` jobs are already waiting
+        '''
+        with self._lock:
+            self._evict_expired()
+            if self.queue_depth >= self._max_queue_depth: raise QueueFull()
+            job = Job(name=name or getattr(func, '__name__', 'job'))
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job: Job, func: Callable, args, kwargs) -> None:
+        if job.cancel_requested:
+            self._finish(job, JobStatus.CANCELLED)
+            return
+        job.status = JobStatus.RUNNING
+        job.started = time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+            self._finish(job, JobStatus.DONE)
+        except JobCancelled:
+            self._finish(job, JobStatus.CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            job.trace = traceback.format_exc()
+            self._finish(job, JobStatus.FAILED)
+
+    def _finish(self, job: Job, status: JobStatus) -> None:
+        job.status = status
+        job.finished = time.time()
+        if status == JobStatus.DONE:
+            job.progress = 1.0
+        job._done_event.set()
+
+    def get(self, job_id: str) -> Job:
+        if job_id not in self._jobs: raise JobNotFound()
+        return self._jobs[job_id]
+
+    def cancel(self, job_id: str) -> Job:
+        '''
+        Queued jobs are dropped right away, running jobs stop at their next `check_cancelled`
+        '''
+        job = self.get(job_id)
+        if job.is_finished: return job
+        job._cancel_event.set()
+        if job._future is not None and job._future.cancel():
+            self._finish(job, JobStatus.CANCELLED)
+        return job
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in list(self._jobs.items()) if job.is_finished and now - job.finished > self._result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        return dict(workers=self._max_workers
+                    , max_queue_depth=self._max_queue_depth
+                    , queued=self.queue_depth
+                    , running=self.running
+                    , jobs=len(self._jobs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        for job in list(self._jobs.values()):
+            if not job.is_finished:
+                self.cancel(job.id)
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,81 @@
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+
+from . import analysis, data_source, executor, names, series_gen, utils
+from .progress import ProgressCallback
+
+
+@dataclass
+class MultiAssetParams:
+    N: int = 1000
+    T: int = 365
+    tickers: List[str] = field(default_factory=lambda: ['ETH', 'BTC', 'DOT'])
+    #basket weights, equal when not set
+    weights: List[float] = None
+    current_prices: List[float] = None
+    #annualized volatilities, one per ticker or a single value for all
+    sigmas: List[float] = 0.8
+    mu: float = 0.
+    #(K, K) correlation matrix, `historical` to estimate it from the exchange prices, independent assets when not set
+    correlation: object = None
+    lookback_days: int = 365
+    strategy_function_params: dict = field(default_factory=dict)
+    seed: int = None
+    dtype: str = 'float64'
+    confidence_level: int = 5
+
+
+@dataclass
+class MultiAssetResults:
+    params: MultiAssetParams
+    correlation: np.ndarray
+    paths: np.ndarray
+    allocated_capital: np.ndarray
+    baseline_capital: np.ndarray
+    summary: analysis.ReturnsCalculator = field(repr=False)
+    baseline_summary: analysis.ReturnsCalculator = field(repr=False)
+
+
+def resolve_correlation(params: MultiAssetParams) -> np.ndarray:
+    K = len(params.tickers)
+    if params.correlation is None:
+        return np.eye(K)
+    if isinstance(params.correlation, str):
+        if params.correlation != 'historical':
+            raise ValueError(f'Unknown correlation {params.correlation}, expected a matrix or `historical`')
+        return data_source.load_correlation_matrix([names.Symbols[t] for t in params.tickers], lookback_days=params.lookback_days)
+    return np.asarray(params.correlation, dtype=np.float64)
+
+
+def run_multi_asset_simulation(params: MultiAssetParams, progress: ProgressCallback = None) -> MultiAssetResults:
+    '''
+    Monte Carlo of a basket of coins plus cash: correlated lognormal (N, T, K) paths and the threshold rebalancing
+    strategy of `params.strategy_function_params` run over all the assets at once, next to a buy-and-hold basket
+    '''
+    unknown = [t for t in params.tickers if t not in names.market_symbols()]
+    if len(unknown) > 0: raise ValueError('Unknown tickers: ' + ','.join(unknown))
+    K = len(params.tickers)
+    weights = np.ones(K) if params.weights is None else params.weights
+    current_prices = np.full(K, 100.) if params.current_prices is None else params.current_prices
+    correlation = resolve_correlation(params)
+
+    rng = np.random.default_rng(params.seed)
+    paths = series_gen.correlated_log_normal_paths(params.N, params.T, current_prices, params.sigmas, correlation, mu=params.mu
+                                                   , rng=rng, progress=progress, dtype=utils.resolve_dtype(params.dtype))
+
+    strategy_params = utils.StrategyParams(**params.strategy_function_params)
+    allocated_capital = executor.run_multi_asset_rebalance_portfolio(paths, weights, strategy_params, progress=progress)
+    baseline_params = utils.StrategyParams(amount_multiple=strategy_params.amount_multiple)
+    baseline_capital = executor.run_multi_asset_rebalance_portfolio(paths, weights, baseline_params, progress=progress, stage='baseline_execution')
+
+    summary = (analysis.ReturnsCalculator(allocated_capital, confidence_level=params.confidence_level, risk_free_rate=strategy_params.cash_interest)
+               .calculate_returns()
+               .calculate_stats()
+               .calculate_sample_stats())
+    baseline_summary = (analysis.ReturnsCalculator(baseline_capital, confidence_level=params.confidence_level)
+                        .calculate_returns()
+                        .calculate_stats())
+    return MultiAssetResults(params=params, correlation=correlation, paths=paths, allocated_capital=allocated_capital
+                             , baseline_capital=baseline_capital, summary=summary, baseline_summary=baseline_summary)
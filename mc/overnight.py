@@ -1,3 +1,38 @@
+import numpy as np
+
 
 def wad_coin_variant3(P_t,AMOUNT_BLOCKED,AMT_TOMINT,N_TO_BURN,r,NUMBER_OF_WADS):
-    return  ((AMOUNT_BLOCKED + AMT_TOMINT) * (1+r) - N_TO_BURN * P_t) / (NUMBER_OF_WADS)
\ No newline at end of file
+    return  ((AMOUNT_BLOCKED + AMT_TOMINT) * (1+r) - N_TO_BURN * P_t) / (NUMBER_OF_WADS)
+
+
+def wad_coin_batch(P_t,AMOUNT_BLOCKED,AMT_TOMINT,N_TO_BURN,r,NUMBER_OF_WADS):
+    '''
+    `wad_coin_variant3` over arrays of scenarios; inputs are broadcast against each other
+    '''
+    args = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (P_t,AMOUNT_BLOCKED,AMT_TOMINT,N_TO_BURN,r,NUMBER_OF_WADS)])
+    return wad_coin_variant3(*args)
+
+
+def wad_coin_projection(P_0,AMOUNT_BLOCKED,AMT_TOMINT,N_TO_BURN,r_path,NUMBER_OF_WADS):
+    '''
+    Forward projection of the wad coin price over a path of overnight rates, vectorized over N scenarios.
+    `P_0` and `AMOUNT_BLOCKED` are scalars or (N,) arrays, N also follows per scenario schedules; `r_path`, mint, burn and number of wads broadcast to (N, T):
+    scalars, per day (T,), per scenario (N, 1) or full (N, T) schedules.
+    The reserve is carried forward: the amount blocked on day t+1 is the value of the wads outstanding on day t,
+    `P_{t+1} * NUMBER_OF_WADS_t`. Returns prices of shape (N, T+1), the first column being `P_0`
+    '''
+    P_0, AMOUNT_BLOCKED = [np.atleast_1d(np.asarray(a, dtype=np.float64)) for a in (P_0, AMOUNT_BLOCKED)]
+    r_path, mint, burn, wads = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (r_path,AMT_TOMINT,N_TO_BURN,NUMBER_OF_WADS)])
+    #scenarios come from the starting state and from the leading axis of (N, T) or (N, 1) schedules
+    N = np.broadcast_shapes(P_0.shape, AMOUNT_BLOCKED.shape, r_path.shape[:1] if r_path.ndim == 2 else (1,))[0]
+    T = r_path.shape[-1]
+    P_0, AMOUNT_BLOCKED = np.broadcast_to(P_0, (N,)), np.broadcast_to(AMOUNT_BLOCKED, (N,))
+    r_path, mint, burn, wads = [np.broadcast_to(a, (N, T)) for a in (r_path, mint, burn, wads)]
+
+    prices = np.empty((N, T + 1))
+    prices[:, 0] = P_0
+    blocked = AMOUNT_BLOCKED
+    for t in range(T):
+        prices[:, t + 1] = wad_coin_variant3(prices[:, t], blocked, mint[:, t], burn[:, t], r_path[:, t], wads[:, t])
+        blocked = prices[:, t + 1] * wads[:, t]
+    return prices
@@ -0,0 +1,74 @@
+import io
+from typing import Dict
+
+import numpy as np
+
+from .analysis import SeriesBands, band_quantiles, DEFAULT_BAND_ESTIMATOR
+
+#response formats of the simulation endpoints
+PAYLOAD_FORMATS = ('json', 'npz')
+NPZ_MIMETYPE = 'application/x-npz'
+#number of raw trajectories shipped with the bands
+DEFAULT_SAMPLE_PATHS = 10
+
+
+def _bands(prefix: str, bands: SeriesBands, ci: float) -> Dict[str, np.ndarray]:
+    lower_bound, upper_bound = bands.interval(ci)
+    arrays = {f'{prefix}_lower': lower_bound
+              , f'{prefix}_upper': upper_bound
+              , f'{prefix}_mean': bands.mean
+              }
+    if bands.quantiles:
+        arrays[f'{prefix}_median'] = bands.quantile(0.5)
+    return arrays
+
+
+def _stats(prefix: str, stats: dict) -> Dict[str, np.ndarray]:
+    return {f'{prefix}_names': np.array(list(stats.keys()), dtype=str)
+            , f'{prefix}_values': np.array(list(stats.values()), dtype=np.float64)
+            }
+
+
+def simulation_arrays(sim_results, ci: float, sample_paths: int = DEFAULT_SAMPLE_PATHS, dtype=np.float32
+                      , band_estimator: str = DEFAULT_BAND_ESTIMATOR) -> Dict[str, np.ndarray]:
+    '''
+    Columnar view of a run: quantile bands (estimated with `band_estimator`) and sample trajectories of prices,
+    strategy and baseline portfolios, plus stats as parallel `*_names` / `*_values` arrays.
+    Series are cast to `dtype` (float32 by default) to keep the payload compact
+    '''
+    run_summary = sim_results.summary.run_summary
+    quantiles = band_quantiles(ci)
+    series = dict(prices=(sim_results.series.sim_res, SeriesBands.from_paths(sim_results.series.sim_res, quantiles, band_estimator, weights=sim_results.series.weights))
+                  , portfolio=(run_summary.sim_portfolio, run_summary.bands(quantiles, band_estimator)))
+    baseline_summary = sim_results.summary.baseline_summary
+    if baseline_summary is not None:
+        series['baseline'] = (baseline_summary.sim_portfolio, baseline_summary.bands(quantiles, band_estimator))
+
+    arrays = dict()
+    for name, (ts, bands) in series.items():
+        arrays.update(_bands(name, bands, ci))
+        arrays[f'{name}_sample_paths'] = ts[:sample_paths]
+    arrays = {k: v.astype(dtype, copy=False) for k, v in arrays.items()}
+
+    arrays.update(_stats('stats', run_summary.stats))
+    arrays.update(_stats('sample_stats', run_summary.sample_stats))
+    if sim_results.timings is not None:
+        arrays.update(_stats('timings', sim_results.timings.to_stats()))
+    if sim_results.precision is not None:
+        arrays.update(_stats('precision', sim_results.precision.to_stats()))
+    return arrays
+
+
+def to_npz(arrays: Dict[str, np.ndarray], compress: bool = True) -> bytes:
+    buffer = io.BytesIO()
+    (np.savez_compressed if compress else np.savez)(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def from_npz(payload: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+        return {k: data[k] for k in data.files}
+
+
+def stats_from_arrays(arrays: Dict[str, np.ndarray], prefix: str = 'stats') -> dict:
+    return dict(zip(arrays[f'{prefix}_names'].tolist(), arrays[f'{prefix}_values'].tolist()))
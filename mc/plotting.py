@@ -10,6 +10,7 @@ from typing import NamedTuple
 from enum import Enum
 import plotly.io as pio
 from typing import List, Optional
+from .analysis import SeriesBands, DEFAULT_BAND_ESTIMATOR, band_quantiles
 
 class PlottingEngine(Enum):
     MATPLOTLIB='MATPLOTLIB'
@@ -49,6 +50,16 @@ def get_confidence_interval(ts,p):
     lower_bound = np.clip(mean - z * std,a_min=0.,a_max=np.inf)
     return lower_bound, upper_bound
 
+def band_interval(ts, params:dict, bands:SeriesBands=None):
+    '''
+    `params['ci']` band of `ts` from the precomputed `bands` summary, otherwise estimated from the paths
+    with `params['band_estimator']` (normal|empirical|sketch)
+    '''
+    if bands is None:
+        estimator = params.get('band_estimator', DEFAULT_BAND_ESTIMATOR)
+        bands = SeriesBands.from_paths(ts, band_quantiles(params['ci'], ()), estimator)
+    return bands.interval(params['ci'])
+
 def save_plot(plot_data:PlotData,file_name):    
     if plot_data.engine == PlottingEngine.MATPLOTLIB:
         if plot_data.objects is not None:
@@ -65,14 +76,14 @@ def save_plot(plot_data:PlotData,file_name):
     elif plot_data.engine == PlottingEngine.PLOTLY:
         pio.write_image(plot_data.fig,file_name, scale=PLOTLY_FIG_SCALE)
 
-def plot_simulations(ts:np.array,params,fill_between=True,zero_line=True,show_plot=True):
+def plot_simulations(ts:np.array,params,fill_between=True,zero_line=True,show_plot=True,bands:SeriesBands=None):
     fig, ax = plt.subplots()
     for i in range(ts.shape[0]):
-        plt.plot(ts[i,:],alpha = params['plot']['alpha'],zorder =1
+        ax.plot(ts[i,:],alpha = params['plot']['alpha'],zorder =1
         ,linewidth=0.3
         )
     if fill_between:
-        lower_bound, upper_bound = get_confidence_interval(ts,p=params['ci'])
+        lower_bound, upper_bound = band_interval(ts, params, bands)
 
         ax.fill_between(np.arange(ts.shape[1]), lower_bound, upper_bound, color='gray', alpha=0.7,zorder=2)
     if zero_line:
@@ -137,7 +148,8 @@ def plot_histogram(ts,params,show_plot=True):
 
     return PlotData(fig,engine=PlottingEngine.MATPLOTLIB)
 
-def plot_comparison(ts_baseline,ts=None,params:dict=None,param_box_message:str='',stats_box_message:str='',show_plot=True) -> PlotData:
+def plot_comparison(ts_baseline,ts=None,params:dict=None,param_box_message:str='',stats_box_message:str='',show_plot=True
+                    ,bands_baseline:SeriesBands=None,bands:SeriesBands=None) -> PlotData:
     # plt.figure()
     fig, ax = plt.subplots(figsize= (8,5)
     )
@@ -150,13 +162,13 @@ def plot_comparison(ts_baseline,ts=None,params:dict=None,param_box_message:str='
     
 
     #plot benchmark
-    lower_bound_bs, upper_bound_bs = get_confidence_interval(ts_baseline,p=params['ci'])
+    lower_bound_bs, upper_bound_bs = band_interval(ts_baseline, params, bands_baseline)
     ax.fill_between(np.arange( ts_n), lower_bound_bs, upper_bound_bs, color='gray', alpha=0.5,zorder=1,label=params['ci_benchmark_name'])
     
     
     #plot strategy
     if ts is not None:
-        lower_bound, upper_bound = get_confidence_interval(ts,p=params['ci'])
+        lower_bound, upper_bound = band_interval(ts, params, bands)
         ax.fill_between(np.arange(ts.shape[1]), lower_bound, upper_bound, color='darkcyan', alpha=0.8,zorder=2,label=params['ci_model_name'])
             
 
@@ -247,7 +259,7 @@ def plot_cash_capitalization_ply(cash_df:pd.DataFrame,params,show_plot=True):
         fig.show(config=PLOTLY_FIG_CONFIG)
     return PlotData(fig,engine=PlottingEngine.PLOTLY)
 
-def plot_simulations_ply(ts, params, show_plot=True):
+def plot_simulations_ply(ts, params, show_plot=True, bands:SeriesBands=None):
     fig = go.Figure()
 
     for i in range(ts.shape[0]):
@@ -268,7 +280,7 @@ def plot_simulations_ply(ts, params, show_plot=True):
         )
 
     if params['ci'] >0:
-        lower_bound, upper_bound = get_confidence_interval(ts, p=params['ci'])
+        lower_bound, upper_bound = band_interval(ts, params, bands)
 
         # Combine the lower and upper bounds into a single trace with a fill color
         combined_bound = np.concatenate((lower_bound, upper_bound[::-1]), axis=0)
@@ -324,7 +336,8 @@ def plot_simulations_ply(ts, params, show_plot=True):
 
 
 
-def plot_comparison_ply(ts_baseline, ts=None, params:dict=None, show_plot=True) -> PlotData:
+def plot_comparison_ply(ts_baseline, ts=None, params:dict=None, show_plot=True
+                        , bands_baseline:SeriesBands=None, bands:SeriesBands=None) -> PlotData:
     fig = go.Figure()
     
     ts_n = ts_baseline.shape[1]
@@ -332,7 +345,7 @@ def plot_comparison_ply(ts_baseline, ts=None, params:dict=None, show_plot=True)
     x_offset = 0.20
 
     #plot benchmark
-    lower_bound_bs, upper_bound_bs = get_confidence_interval(ts_baseline, p=params['ci'])
+    lower_bound_bs, upper_bound_bs = band_interval(ts_baseline, params, bands_baseline)
     combined_bound_bs = np.concatenate((lower_bound_bs, upper_bound_bs[::-1]), axis=0)
     fig.add_trace(
         go.Scatter(
@@ -350,7 +363,7 @@ def plot_comparison_ply(ts_baseline, ts=None, params:dict=None, show_plot=True)
 
     #plot strategy
     if ts is not None:
-        lower_bound, upper_bound = get_confidence_interval(ts, p=params['ci'])
+        lower_bound, upper_bound = band_interval(ts, params, bands)
         combined_bound = np.concatenate((lower_bound, upper_bound[::-1]), axis=0)
         fig.add_trace(
             go.Scatter(
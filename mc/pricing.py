@@ -1,6 +1,20 @@
 import QuantLib as ql
+import numpy as np
+import threading
+from functools import lru_cache
+from scipy.special import ndtr
 from .names import *
 
+#day count basis used by `create_option` (Actual360)
+DAY_COUNT_BASIS = 360.
+
+#LRU bound of the premium lookup table, enough for parameter sweeps
+PREMIUM_CACHE_SIZE = 4096
+#LRU bound of the shared QuantLib market contexts, one per (volatility, rate, dividend) seen by the process
+PRICING_CONTEXT_CACHE_SIZE = 64
+#strikes are rebuilt as `price*(1+pct)`, round the moneyness so float noise does not miss the cache
+MONEYNESS_DECIMALS = 10
+
 
 
 def create_option(spot_price:float,strike:float, maturity:int, volatility:float,risk_free_rate:float, option_type:OptionType,dividend_rate:float=0.0) -> ql.VanillaOption:
@@ -129,4 +143,141 @@ class QlEuropeanOption:
         return self
 
     def NPV(self):
-        return self._option.NPV()
\ No newline at end of file
+        return self._option.NPV()
+
+
+def evaluation_date() -> int:
+    '''
+    Serial number of today's QuantLib date, part of the cache keys so contexts and premiums do not outlive their day
+    '''
+    return ql.Date.todaysDate().serialNumber()
+
+
+class PricingContext:
+    def __init__(self,volatility:float,risk_free_rate:float,dividend_rate:float=0.0,eval_date:int=None) -> None:
+        '''
+        QuantLib market data shared by all options of a run.
+        Curves, volatility surface, BSM process and engine are built once behind `SimpleQuote` handles;
+        pricing a contract only updates the spot quote and builds the payoff/exercise.
+        Uses the same TARGET calendar and Actual360 day count as `create_option`.
+        `eval_date` is a QuantLib date serial number, today by default
+        '''
+        self._eval_date = ql.Date.todaysDate() if eval_date is None else ql.Date(eval_date)
+        ql.Settings.instance().evaluationDate = self._eval_date
+
+        self._spot_price = ql.SimpleQuote(1.0)
+        self._risk_free_rate = ql.SimpleQuote(risk_free_rate)
+        self._volatility = ql.SimpleQuote(volatility)
+        self._dividend_rate = ql.SimpleQuote(dividend_rate)
+
+        self._risk_free_curve = ql.FlatForward(0, ql.TARGET(), ql.QuoteHandle(self._risk_free_rate), ql.Actual360())
+        self._dividend_yield = ql.FlatForward(0, ql.TARGET(), ql.QuoteHandle(self._dividend_rate), ql.Actual360())
+        self._volatility_ts = ql.BlackConstantVol(0, ql.TARGET(), ql.QuoteHandle(self._volatility), ql.Actual360())
+
+        self._process = ql.BlackScholesMertonProcess(ql.QuoteHandle(self._spot_price)
+                                            ,ql.YieldTermStructureHandle(self._dividend_yield)
+                                            ,ql.YieldTermStructureHandle(self._risk_free_curve)
+                                            ,ql.BlackVolTermStructureHandle(self._volatility_ts)
+                                            )
+        self._engine = ql.AnalyticEuropeanEngine(self._process)
+        #the spot quote is shared, so concurrent runs must not interleave set/NPV
+        self._lock = threading.Lock()
+
+    @property
+    def eval_date(self) -> ql.Date:
+        return self._eval_date
+
+    def _sync_eval_date(self) -> None:
+        '''
+        Restore the context evaluation date only if someone else (e.g. `QlEuropeanOption.decay`) moved it
+        '''
+        settings = ql.Settings.instance()
+        if settings.evaluationDate != self._eval_date:
+            settings.evaluationDate = self._eval_date
+
+    def create_option(self,strike:float,maturity:int,option_type:OptionType) -> ql.VanillaOption:
+        option_type_ql = ql.Option.Call if option_type == OptionType.CALL else ql.Option.Put
+        payoff = ql.PlainVanillaPayoff(option_type_ql, strike)
+        exercise = ql.EuropeanExercise(self._eval_date + ql.Period(int(maturity), ql.Days))
+
+        option = ql.VanillaOption(payoff, exercise)
+        option.setPricingEngine(self._engine)
+        return option
+
+    def price(self,spot_price:float,strike:float,maturity:int,option_type:OptionType) -> float:
+        '''
+        NPV of a single european option with `maturity` days to expiration
+        '''
+        option = self.create_option(strike,maturity,option_type)
+        with self._lock:
+            self._sync_eval_date()
+            self._spot_price.setValue(spot_price)
+            return option.NPV()
+
+    def __repr__(self) -> str:
+        return f'PricingContext(volatility={self._volatility.value()},risk_free_rate={self._risk_free_rate.value()},dividend_rate={self._dividend_rate.value()})'
+
+
+@lru_cache(maxsize=PRICING_CONTEXT_CACHE_SIZE)
+def _pricing_context(volatility:float,risk_free_rate:float,dividend_rate:float,eval_date:int) -> PricingContext:
+    return PricingContext(volatility,risk_free_rate,dividend_rate,eval_date)
+
+
+def pricing_context(volatility:float,risk_free_rate:float,dividend_rate:float=0.0,eval_date:int=None) -> PricingContext:
+    '''
+    Return the shared `PricingContext` for the given market parameters and evaluation date serial (today by default),
+    created on the first call of the day
+    '''
+    return _pricing_context(volatility,risk_free_rate,dividend_rate,evaluation_date() if eval_date is None else eval_date)
+
+
+@lru_cache(maxsize=PREMIUM_CACHE_SIZE)
+def premium_per_notional(option_type:OptionType,moneyness:float,maturity:int,volatility:float,risk_free_rate:float,dividend_rate:float,eval_date:int) -> float:
+    '''
+    BSM premium per unit of spot for an option struck at `moneyness * spot`, valued on the `eval_date` serial.
+    The BSM price is homogeneous in (spot, strike), so fixed-moneyness writes reuse one QuantLib valuation
+    '''
+    return pricing_context(volatility,risk_free_rate,dividend_rate,eval_date).price(spot_price=1.0
+                                                                        ,strike=moneyness
+                                                                        ,maturity=maturity
+                                                                        ,option_type=option_type
+                                                                        )
+
+
+def option_premium(spot_price:float,strike:float,maturity:int,volatility:float,risk_free_rate:float,option_type:OptionType,dividend_rate:float=0.0) -> float:
+    '''
+    Premium of a single option from the `premium_per_notional` lookup table
+    '''
+    moneyness = round(strike / spot_price, MONEYNESS_DECIMALS)
+    return spot_price * premium_per_notional(option_type,moneyness,int(maturity),volatility,risk_free_rate,dividend_rate,evaluation_date())
+
+
+def black_scholes_price(spot_price, strike, maturity, volatility:float, risk_free_rate:float, is_call, dividend_rate:float=0.0) -> np.ndarray:
+    '''
+    Vectorized Black-Scholes-Merton price for a batch of european options.
+    `spot_price`, `strike`, `maturity` (days to expiration) and `is_call` broadcast against each other,
+    so a whole option book can be priced in one call.
+    Uses the same Actual360 convention as `create_option`; expired contracts (or non-positive volatility)
+    are valued at the discounted intrinsic value.
+    '''
+    spot_price = np.asarray(spot_price, dtype=float)
+    strike = np.asarray(strike, dtype=float)
+    tau = np.maximum(np.asarray(maturity, dtype=float), 0.) / DAY_COUNT_BASIS
+
+    fwd_spot = spot_price * np.exp(-dividend_rate * tau)
+    disc_strike = strike * np.exp(-risk_free_rate * tau)
+    vol_sqrt_t = volatility * np.sqrt(tau)
+
+    alive = vol_sqrt_t > 0.
+    vol_sqrt_t = np.where(alive, vol_sqrt_t, 1.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = np.log(fwd_spot / disc_strike) / vol_sqrt_t + 0.5 * vol_sqrt_t
+    d2 = d1 - vol_sqrt_t
+
+    call = np.where(alive
+                    ,fwd_spot * ndtr(d1) - disc_strike * ndtr(d2)
+                    ,np.maximum(fwd_spot - disc_strike, 0.)
+                    )
+    #put-call parity
+    put = call - fwd_spot + disc_strike
+    return np.where(is_call, call, put)
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+def _peak_rss_mb() -> float:
+    '''
+    Process peak resident memory so far (`ru_maxrss` is in KB on linux and in bytes on macOS)
+    '''
+    if resource is None: return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024. ** 2 if os.uname().sysname == 'Darwin' else peak / 1024.
+
+
+class StageTiming(NamedTuple):
+    name: str
+    start: float
+    wall: float
+    cpu: float
+    #memory the stage peaked at above what was in use when it started
+    peak_memory_added_mb: float
+
+
+class StageTimings:
+    def __init__(self, trace_memory: bool = False) -> None:
+        '''
+        Wall time, CPU time and memory added at the peak of the engine stages.
+        With `trace_memory` it is the python/numpy allocation peak within the stage above the allocations at its start
+        (`tracemalloc`, slower); otherwise it is how much the stage raised the process peak RSS, 0 when the stage stays
+        below the high-water mark of an earlier stage
+        '''
+        self._trace_memory = trace_memory
+        self._stages: List[StageTiming] = []
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._tid = threading.get_ident()
+
+    @contextmanager
+    def stage(self, name: str):
+        started_tracing = False
+        if self._trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        start_memory_mb = tracemalloc.get_traced_memory()[0] / 1024. ** 2 if self._trace_memory else _peak_rss_mb()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024. ** 2 if self._trace_memory else _peak_rss_mb()
+            if started_tracing:
+                tracemalloc.stop()
+            self._stages.append(StageTiming(name=name, start=start_wall - self._origin, wall=wall, cpu=cpu
+                                            , peak_memory_added_mb=max(peak_memory_mb - start_memory_mb, 0.)))
+
+    @property
+    def stages(self) -> List[StageTiming]:
+        return self._stages
+
+    @property
+    def total_wall(self) -> float:
+        return sum(s.wall for s in self._stages)
+
+    def to_dict(self) -> Dict[str, dict]:
+        return {s.name: dict(wall_s=s.wall, cpu_s=s.cpu, peak_memory_added_mb=s.peak_memory_added_mb) for s in self._stages}
+
+    def to_stats(self) -> Dict[str, float]:
+        '''
+        Flat `metric -> value` view, same layout as `ReturnsCalculator.stats`
+        '''
+        stats = {}
+        for s in self._stages:
+            stats[f'{s.name} wall time, s'] = s.wall
+            stats[f'{s.name} cpu time, s'] = s.cpu
+            stats[f'{s.name} peak memory added, MB'] = s.peak_memory_added_mb
+        return stats
+
+    def to_chrome_trace(self) -> dict:
+        '''
+        Trace in the Chrome `about:tracing` / Perfetto / speedscope event format
+        '''
+        events = [dict(name=s.name, cat='stage', ph='X'
+                       , ts=s.start * 1e6, dur=s.wall * 1e6
+                       , pid=self._pid, tid=self._tid
+                       , args=dict(cpu_s=s.cpu, peak_memory_added_mb=s.peak_memory_added_mb))
+                  for s in self._stages]
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def save_chrome_trace(self, path: str) -> str:
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+    def __str__(self) -> str:
+        return '\n'.join(f'{s.name}: wall={s.wall:.3f}s cpu={s.cpu:.3f}s peak+={s.peak_memory_added_mb:.1f}MB' for s in self._stages)
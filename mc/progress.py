@@ -0,0 +1,33 @@
+from typing import Callable, Optional
+
+#progress callback: `callback(stage, fraction)` with the fraction of the stage completed in [0, 1]
+ProgressCallback = Callable[[str, float], None]
+
+#number of progress updates per stage
+DEFAULT_CHUNKS = 50
+
+
+def report(callback: Optional[ProgressCallback], stage: str, fraction: float) -> None:
+    if callback is not None:
+        callback(stage, fraction)
+
+
+class ProgressReporter:
+    def __init__(self, callback: Optional[ProgressCallback], stage: str, total: int, chunks: int = DEFAULT_CHUNKS) -> None:
+        '''
+        Forward loop progress to `callback` at chunk granularity: at most `chunks` calls per stage,
+        so the callback cost does not scale with the loop length
+        '''
+        self._callback = callback
+        self._stage = stage
+        self._total = max(int(total), 1)
+        self._every = max(1, self._total // max(chunks, 1))
+
+    def start(self) -> 'ProgressReporter':
+        report(self._callback, self._stage, 0.0)
+        return self
+
+    def update(self, done: int) -> None:
+        if self._callback is None: return
+        if done % self._every == 0 or done >= self._total:
+            self._callback(self._stage, min(done / self._total, 1.0))
@@ -4,25 +4,54 @@ from nqdm import nqdm
 from typing import List
 import math
 from datetime import datetime, timedelta
-from scipy.stats import norm, invgamma
+from scipy.stats import norm, invgamma, qmc
+from scipy.optimize import minimize
+from scipy.signal import lfilter
+from functools import lru_cache, partial
+import warnings
+from .progress import ProgressCallback, ProgressReporter
+from . import data_source
+
+#where the random draws of the path generators come from
+INNOVATION_SOURCES = ('pseudo', 'sobol')
+#uniforms are kept away from 0 and 1 before the inverse CDFs
+UNIFORM_EPS = 1e-12
+
+#mean block length (stationary) or block length (circular) of the bootstrap, in days
+DEFAULT_BLOCK_SIZE = 20
+BOOTSTRAP_METHODS = ('stationary', 'circular')
+#default GARCH(1,1) persistence and regime switching (low, high volatility) parameters, per step
+DEFAULT_GARCH_ALPHA = 0.08
+DEFAULT_GARCH_BETA = 0.90
+DEFAULT_REGIME_VOL_MULTIPLES = (0.7, 1.8)
+DEFAULT_REGIME_STAY = (0.98, 0.95)
+#importance sampling: terminal loss the tilted paths are centred on, and the largest tilt of a whole path,
+#in standard deviations of its innovations
+DEFAULT_TARGET_LOSS = 0.5
+MAX_TILT_SHIFT = 2.
 
 # def random_return(price, t, params):
 #     return price * (1+ random.gauss(params['mu'], params['sigma']))
 
 
-def random_return(price, t,T, params):
+def _generator(rng: np.random.Generator = None):
+    #draws of the step functions: the run generator, or the global numpy one when not given
+    return np.random if rng is None else rng
+
+
+def random_return(price, t,T, params, rng: np.random.Generator = None):
     r = params.get("r", 0)
     sigma = params.get("sigma", 1) 
-    return price * (1+ r/T + sigma/(T**0.5) * random.gauss(0, 1))
+    return price * (1+ r/T + sigma/(T**0.5) * (random.gauss(0, 1) if rng is None else rng.normal()))
 
-def log_normal_return(price, t, T,params):
+def log_normal_return(price, t, T,params, rng: np.random.Generator = None):
     mu = params.get("mu", 0)
     sigma = params.get("sigma", 1)
     # dt = params.get("dt", 1)
-    return price * (np.exp(mu + np.random.normal(0, sigma / np.sqrt(T))) )
+    return price * (np.exp(mu + _generator(rng).normal(0, sigma / np.sqrt(T))) )
 
 
-def generalized_hyperbolic_return(price, t, T, params):
+def generalized_hyperbolic_return(price, t, T, params, rng: np.random.Generator = None):
     # Extract GH distribution parameters from params
     mu = params.get("mu", 0)
     alpha = params.get("alpha", 1)
@@ -31,10 +60,10 @@ def generalized_hyperbolic_return(price, t, T, params):
     lambda_ = params.get("lambda_", -0.5)
 
     # Step 1: Generate a random variable from the inverse gamma distribution
-    gamma_var = invgamma.rvs(a=-lambda_, scale=delta**2/alpha, size=1)[0]
+    gamma_var = invgamma.rvs(a=-lambda_, scale=delta**2/alpha, size=1, random_state=rng)[0]
 
     # Step 2: Generate a random variable from the normal distribution
-    z = norm.rvs(loc=0, scale=np.sqrt(gamma_var), size=1)[0]
+    z = norm.rvs(loc=0, scale=np.sqrt(gamma_var), size=1, random_state=rng)[0]
 
     # Step 3: Adjust the random variable for the GH distribution
     gh_var = mu + beta * gamma_var + z
@@ -42,11 +71,457 @@ def generalized_hyperbolic_return(price, t, T, params):
     # Apply the GH distributed random variable to the price
     return price * (1 + gh_var)
 
+class PseudoRandomSource:
+    def __init__(self, rng: np.random.Generator = None) -> None:
+        '''
+        Innovations from `rng` (the run generator of the engine), or the global numpy generator when not given
+        '''
+        self._rng = rng
+
+    def uniforms(self, N: int, D: int) -> np.ndarray:
+        return np.random.random_sample((N, D)) if self._rng is None else self._rng.random((N, D))
+
+    def normals(self, N: int, D: int, bridge: bool = False) -> np.ndarray:
+        #independent increments: the bridge ordering only matters for low discrepancy points
+        return _generator(self._rng).standard_normal((N, D))
+
+
+class SobolSource:
+    def __init__(self, seed: int = None, bridge: bool = True) -> None:
+        '''
+        Scrambled Sobol points, one D dimensional point per path. Every draw is its own scrambled point set.
+        With `bridge` the normals used as Brownian increments are laid out by a Brownian bridge, so the first
+        (best distributed) dimensions set the coarse shape of the paths
+        '''
+        self._seeds = np.random.SeedSequence(seed)
+        self.bridge = bridge
+
+    def uniforms(self, N: int, D: int) -> np.ndarray:
+        engine = qmc.Sobol(d=D, scramble=True, seed=np.random.default_rng(self._seeds.spawn(1)[0]))
+        with warnings.catch_warnings():
+            #balance properties hold for powers of 2 paths, other N still beat pseudo-random points
+            warnings.simplefilter('ignore')
+            points = engine.random(N)
+        return np.clip(points, UNIFORM_EPS, 1 - UNIFORM_EPS)
+
+    def normals(self, N: int, D: int, bridge: bool = False) -> np.ndarray:
+        z = norm.ppf(self.uniforms(N, D))
+        return brownian_bridge_increments(z) if (bridge and self.bridge) else z
+
+
+def innovation_source(innovations: str = 'pseudo', seed: int = None, rng: np.random.Generator = None):
+    if innovations not in INNOVATION_SOURCES:
+        raise ValueError(f'Unknown innovations {innovations}, expected one of: ' + ','.join(INNOVATION_SOURCES))
+    return SobolSource(seed) if innovations == 'sobol' else PseudoRandomSource(rng)
+
+
+@lru_cache(maxsize=None)
+def _bridge_schedule(D: int) -> tuple:
+    #(point, left, right) of W_0..W_D in the order they are filled: the end point, then midpoints breadth first
+    schedule = [(D, 0, None)]
+    intervals = [(0, D)]
+    while intervals:
+        next_intervals = []
+        for left, right in intervals:
+            if right - left < 2: continue
+            middle = (left + right) // 2
+            schedule.append((middle, left, right))
+            next_intervals += [(left, middle), (middle, right)]
+        intervals = next_intervals
+    return tuple(schedule)
+
+
+def brownian_bridge_increments(z: np.ndarray) -> np.ndarray:
+    '''
+    Unit variance Brownian increments (N, D) built from normals `z` by a Brownian bridge:
+    `z[:, 0]` sets the end point, the next columns the midpoints of ever finer intervals
+    '''
+    N, D = z.shape
+    W = np.zeros((N, D + 1))
+    for k, (point, left, right) in enumerate(_bridge_schedule(D)):
+        if right is None:
+            W[:, point] = np.sqrt(point - left) * z[:, k]
+            continue
+        span = right - left
+        W[:, point] = ((right - point) * W[:, left] + (point - left) * W[:, right]) / span \
+                      + np.sqrt((point - left) * (right - point) / span) * z[:, k]
+    return np.diff(W, axis=1)
+
+
+def tilted_normals(source, N: int, D: int, tilt: float, bridge: bool = False):
+    '''
+    (N, D) unit variance normals of `source` shifted by `tilt`, and per row the likelihood ratio of the
+    untilted over the tilted density, `exp(-tilt sum(z) + D tilt^2 / 2)`
+    '''
+    z = source.normals(N, D, bridge=bridge)
+    if tilt == 0.: return z, np.ones(N)
+    z += tilt
+    return z, np.exp(-tilt * z.sum(axis=1) + D * tilt ** 2 / 2)
+
+
+def weighted_log_normal_paths(N: int, T: int, current_price: float, params, tilt: float = 0., source=None
+                              , progress:ProgressCallback=None, dtype=np.float64):
+    '''
+    (N, T) paths of `log_normal_return` with the normal steps shifted by `tilt` standard deviations,
+    and the (N,) likelihood ratio weights that make averages over them unbiased
+    '''
+    source = source or PseudoRandomSource()
+    reporter = ProgressReporter(progress,'path_generation',1).start()
+    z, weights = tilted_normals(source, N, T - 1, tilt, bridge=True)
+    time_series = _compound(params.get("mu", 0) + _step_sigma(params, T) * z, current_price, dtype)
+    reporter.update(1)
+    return time_series, weights
+
+
+def log_normal_paths(N: int, T: int, current_price: float, params, source=None, progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T) paths of `log_normal_return` from one (N, T-1) draw of `source` normals
+    '''
+    return weighted_log_normal_paths(N, T, current_price, params, source=source, progress=progress, dtype=dtype)[0]
+
+
+def _absorb_at_zero(factors: np.ndarray, current_price: float, dtype) -> np.ndarray:
+    #compounded simple returns, a path stays at 0 once a step takes it below 0 (as `generate_time_series`)
+    time_series = np.empty((factors.shape[0], factors.shape[1] + 1), dtype=dtype)
+    time_series[:, 0] = current_price
+    time_series[:, 1:] = current_price * np.cumprod(factors, axis=1)
+    time_series[:, 1:][np.logical_or.accumulate(factors < 0, axis=1)] = 0.
+    return time_series
+
+
+def random_paths(N: int, T: int, current_price: float, params, source=None, progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T) paths of `random_return` from one (N, T-1) draw of `source` normals
+    '''
+    source = source or PseudoRandomSource()
+    reporter = ProgressReporter(progress,'path_generation',1).start()
+    z = source.normals(N, T - 1, bridge=True)
+    time_series = _absorb_at_zero(1 + params.get("r", 0) / T + _step_sigma(params, T) * z, current_price, dtype)
+    reporter.update(1)
+    return time_series
+
+
+def weighted_generalized_hyperbolic_paths(N: int, T: int, current_price: float, params, tilt: float = 0., source=None
+                                          , progress:ProgressCallback=None, dtype=np.float64):
+    '''
+    (N, T) paths of `generalized_hyperbolic_return`: each step maps two uniforms of one (N, 2(T-1)) draw
+    through the inverse CDFs of the inverse gamma mixing variable and of the normal. The normal is shifted by `tilt`
+    (the mixing variable is left alone), the (N,) likelihood ratio weights are returned with the paths
+    '''
+    source = source or PseudoRandomSource()
+    mu = params.get("mu", 0)
+    alpha = params.get("alpha", 1)
+    beta = params.get("beta", 0)
+    delta = params.get("delta", 1)
+    lambda_ = params.get("lambda_", -0.5)
+    reporter = ProgressReporter(progress,'path_generation',1).start()
+    u = source.uniforms(N, 2 * (T - 1))
+    gamma_var = invgamma.ppf(u[:, :T - 1], a=-lambda_, scale=delta**2/alpha)
+    n = norm.ppf(u[:, T - 1:]) + tilt
+    weights = np.exp(-tilt * n.sum(axis=1) + (T - 1) * tilt ** 2 / 2) if tilt != 0. else np.ones(N)
+    time_series = _absorb_at_zero(1 + mu + beta * gamma_var + np.sqrt(gamma_var) * n, current_price, dtype)
+    reporter.update(1)
+    return time_series, weights
+
+
+def generalized_hyperbolic_paths(N: int, T: int, current_price: float, params, source=None, progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T) paths of `generalized_hyperbolic_return`, see `weighted_generalized_hyperbolic_paths`
+    '''
+    return weighted_generalized_hyperbolic_paths(N, T, current_price, params, source=source, progress=progress, dtype=dtype)[0]
+
+
+def bootstrap_history(params) -> np.ndarray:
+    '''
+    Log returns resampled by the bootstrap: `params['history_returns']` when given, otherwise the cached
+    exchange history of `params['ticker_name']`
+    '''
+    if params.get('history_returns') is not None:
+        return np.ascontiguousarray(params['history_returns'], dtype=np.float64)
+    return data_source.load_log_returns(params.get('ticker_name', 'ETH'), lookback_days=params.get('lookback_days', 365))
+
+
+def bootstrap_indices(N: int, T: int, L: int, block_size: float, method: str = 'stationary', source=None) -> np.ndarray:
+    '''
+    (N, T) positions in a history of L returns, drawn at once: each block starts at a uniform position and
+    walks forward, wrapping around the end. `stationary` blocks have geometric lengths of mean `block_size`,
+    `circular` blocks all have length `block_size`
+    '''
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f'Unknown bootstrap method {method}, expected one of: ' + ','.join(BOOTSTRAP_METHODS))
+    source = source or PseudoRandomSource()
+    steps = np.arange(T)
+    if method == 'stationary':
+        new_block = source.uniforms(N, T) < 1. / block_size
+    else:
+        new_block = np.broadcast_to(steps % max(int(block_size), 1) == 0, (N, T)).copy()
+    new_block[:, 0] = True
+    starts = np.minimum((source.uniforms(N, T) * L).astype(np.int64), L - 1)
+    block_start = np.maximum.accumulate(np.where(new_block, steps, 0), axis=1)
+    return (np.take_along_axis(starts, block_start, axis=1) + steps - block_start) % L
+
+
+def block_bootstrap_paths(N: int, T: int, current_price: float, params, source=None, progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T) paths compounding historical log-return blocks (`block_size`, `bootstrap_method` in `params`),
+    all indices drawn in one batch and gathered from the contiguous return history
+    '''
+    history = bootstrap_history(params)
+    reporter = ProgressReporter(progress,'path_generation',1).start()
+    index = bootstrap_indices(N, T - 1, history.shape[0], params.get('block_size', DEFAULT_BLOCK_SIZE), params.get('bootstrap_method', 'stationary'), source)
+    time_series = np.empty((N, T), dtype=dtype)
+    time_series[:, 0] = current_price
+    time_series[:, 1:] = current_price * np.exp(np.cumsum(history[index], axis=1))
+    reporter.update(1)
+    return time_series
+
+
+def block_bootstrap_return(price, t, T, params, rng: np.random.Generator = None):
+    '''
+    Single step of the bootstrap (a random historical return); `generate_time_series` draws whole blocks
+    with `block_bootstrap_paths` instead
+    '''
+    history = bootstrap_history(params)
+    return price * np.exp(history[min(int(_generator(rng).random() * history.shape[0]), history.shape[0] - 1)])
+
+def _step_sigma(params, T: int) -> float:
+    #per step volatility of the constant volatility models
+    return params.get("sigma", 1) / np.sqrt(T)
+
+
+def _compound(log_returns: np.ndarray, current_price: float, dtype) -> np.ndarray:
+    N = log_returns.shape[0]
+    time_series = np.empty((N, log_returns.shape[1] + 1), dtype=dtype)
+    time_series[:, 0] = current_price
+    time_series[:, 1:] = current_price * np.exp(np.cumsum(log_returns, axis=1))
+    return time_series
+
+
+def garch_variance(residuals: np.ndarray, omega: float, alpha: float, beta: float, h0: float) -> np.ndarray:
+    '''
+    Conditional variances `h_t = omega + alpha e_{t-1}^2 + beta h_{t-1}` of a residual series, as one linear filter
+    '''
+    drive = np.empty_like(residuals, dtype=np.float64)
+    drive[0] = h0
+    drive[1:] = omega + alpha * residuals[:-1] ** 2
+    return lfilter([1.], [1., -beta], drive)
+
+
+def fit_garch(log_returns: np.ndarray) -> dict:
+    '''
+    Gaussian maximum likelihood GARCH(1,1) of daily log returns, as `garch_*` params
+    '''
+    r = np.asarray(log_returns, dtype=np.float64)
+    mu, var = r.mean(), r.var()
+    e = r - mu
+
+    def neg_log_likelihood(x):
+        omega, alpha, beta = x
+        if alpha + beta >= 0.999: return 1e10
+        h = np.maximum(garch_variance(e, omega, alpha, beta, var), 1e-12)
+        return 0.5 * np.sum(np.log(h) + e ** 2 / h)
+
+    x0 = [var * (1 - DEFAULT_GARCH_ALPHA - DEFAULT_GARCH_BETA), DEFAULT_GARCH_ALPHA, DEFAULT_GARCH_BETA]
+    fit = minimize(neg_log_likelihood, x0, method='L-BFGS-B', bounds=[(1e-12, 10 * var), (0., 1.), (0., 1.)])
+    omega, alpha, beta = fit.x
+    return dict(mu=mu, garch_omega=omega, garch_alpha=alpha, garch_beta=beta)
+
+
+def _calibrated(params, return_function: str, fitter) -> dict:
+    #exchange history fits are memoized per ticker and window by `calibration`
+    if params.get('history_returns') is not None: return fitter(bootstrap_history(params))
+    from . import calibration
+    return calibration.calibrate(params.get('ticker_name', 'ETH'), return_function, params.get('lookback_days', 365))
+
+
+def garch_params(params, T: int) -> dict:
+    '''
+    GARCH params from `params`: fitted to the history with `calibrate`, otherwise `garch_*` keys with the
+    long run variance of `sigma` by default
+    '''
+    if params.get('calibrate'): return _calibrated(params, 'GARCH(1,1)', fit_garch)
+    alpha = params.get('garch_alpha', DEFAULT_GARCH_ALPHA)
+    beta = params.get('garch_beta', DEFAULT_GARCH_BETA)
+    omega = params.get('garch_omega', _step_sigma(params, T) ** 2 * (1 - alpha - beta))
+    return dict(mu=params.get('mu', 0), garch_omega=omega, garch_alpha=alpha, garch_beta=beta)
+
+
+def garch_paths(N: int, T: int, current_price: float, params, source=None, progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T) GARCH(1,1) log price paths, the variance recursion runs over all paths at once
+    '''
+    fitted = garch_params(params, T)
+    omega, alpha, beta = fitted['garch_omega'], fitted['garch_alpha'], fitted['garch_beta']
+    z = (source or PseudoRandomSource()).normals(N, T - 1)
+    log_returns = np.empty((N, T - 1))
+    h = np.full(N, omega / max(1 - alpha - beta, 1e-6))
+    reporter = ProgressReporter(progress,'path_generation',T - 1).start()
+    for t in range(T - 1):
+        e = np.sqrt(h) * z[:, t]
+        log_returns[:, t] = e
+        h = omega + alpha * e ** 2 + beta * h
+        reporter.update(t + 1)
+    return _compound(fitted['mu'] + log_returns, current_price, dtype)
+
+
+def garch_return(price, t, T, params, rng: np.random.Generator = None):
+    '''
+    Single step at the long run GARCH variance; `generate_time_series` runs the variance recursion with `garch_paths`
+    '''
+    fitted = garch_params(params, T)
+    long_run = fitted['garch_omega'] / max(1 - fitted['garch_alpha'] - fitted['garch_beta'], 1e-6)
+    return price * np.exp(fitted['mu'] + np.sqrt(long_run) * _generator(rng).normal())
+
+
+def fit_regime_switching(log_returns: np.ndarray, iterations: int = 100, tol: float = 1e-8) -> dict:
+    '''
+    Two state gaussian Markov switching model of daily log returns by EM (Hamilton filter, Kim smoother),
+    as `regime_*` params with state 0 the low volatility regime
+    '''
+    r = np.asarray(log_returns, dtype=np.float64)
+    L = r.shape[0]
+    mu = np.array([r.mean(), r.mean()])
+    sigma = r.std() * np.array(DEFAULT_REGIME_VOL_MULTIPLES)
+    P = np.array([[DEFAULT_REGIME_STAY[0], 1 - DEFAULT_REGIME_STAY[0]], [1 - DEFAULT_REGIME_STAY[1], DEFAULT_REGIME_STAY[1]]])
+    previous = -np.inf
+    for _ in range(iterations):
+        density = norm.pdf(r[:, None], mu, sigma) + 1e-300
+        filtered = np.empty((L, 2))
+        predicted = np.full(2, 0.5)
+        log_likelihood = 0.
+        for t in range(L):
+            joint = predicted * density[t]
+            total = joint.sum()
+            filtered[t] = joint / total
+            log_likelihood += np.log(total)
+            predicted = filtered[t] @ P
+        smoothed = np.empty((L, 2))
+        smoothed[-1] = filtered[-1]
+        transitions = np.zeros((2, 2))
+        for t in range(L - 2, -1, -1):
+            ahead = np.maximum(filtered[t] @ P, 1e-300)
+            pair = filtered[t][:, None] * P * (smoothed[t + 1] / ahead)[None, :]
+            transitions += pair
+            smoothed[t] = pair.sum(axis=1)
+        weights = smoothed.sum(axis=0)
+        mu = smoothed.T @ r / weights
+        sigma = np.sqrt(np.maximum((smoothed * (r[:, None] - mu) ** 2).sum(axis=0) / weights, 1e-16))
+        P = transitions / transitions.sum(axis=1, keepdims=True)
+        if abs(log_likelihood - previous) < tol: break
+        previous = log_likelihood
+    low, high = np.argsort(sigma)
+    return dict(regime_mu_low=mu[low], regime_mu_high=mu[high]
+                , regime_sigma_low=sigma[low], regime_sigma_high=sigma[high]
+                , regime_stay_low=P[low, low], regime_stay_high=P[high, high])
+
+
+def regime_params(params, T: int) -> dict:
+    '''
+    Regime switching params from `params`: fitted to the history with `calibrate`, otherwise `regime_*` keys
+    with volatilities set around `sigma` by default
+    '''
+    if params.get('calibrate'): return _calibrated(params, 'Regime Switching', fit_regime_switching)
+    step_sigma = _step_sigma(params, T)
+    mu = params.get('mu', 0)
+    return dict(regime_mu_low=params.get('regime_mu_low', mu), regime_mu_high=params.get('regime_mu_high', mu)
+                , regime_sigma_low=params.get('regime_sigma_low', step_sigma * DEFAULT_REGIME_VOL_MULTIPLES[0])
+                , regime_sigma_high=params.get('regime_sigma_high', step_sigma * DEFAULT_REGIME_VOL_MULTIPLES[1])
+                , regime_stay_low=params.get('regime_stay_low', DEFAULT_REGIME_STAY[0])
+                , regime_stay_high=params.get('regime_stay_high', DEFAULT_REGIME_STAY[1]))
+
+
+def _regime_arrays(fitted: dict):
+    mu = np.array([fitted['regime_mu_low'], fitted['regime_mu_high']])
+    sigma = np.array([fitted['regime_sigma_low'], fitted['regime_sigma_high']])
+    stay = np.array([fitted['regime_stay_low'], fitted['regime_stay_high']])
+    #stationary probability of the high volatility regime
+    stationary_high = (1 - stay[0]) / max(2 - stay[0] - stay[1], 1e-12)
+    return mu, sigma, stay, stationary_high
+
+
+def regime_switching_paths(N: int, T: int, current_price: float, params, source=None, progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T) two state Markov regime switching log price paths, the regime chain advances over all paths at once
+    starting from its stationary distribution
+    '''
+    source = source or PseudoRandomSource()
+    mu, sigma, stay, stationary_high = _regime_arrays(regime_params(params, T))
+    z = source.normals(N, T - 1)
+    u = source.uniforms(N, T)
+    state = (u[:, 0] < stationary_high).astype(np.int64)
+    log_returns = np.empty((N, T - 1))
+    reporter = ProgressReporter(progress,'path_generation',T - 1).start()
+    for t in range(T - 1):
+        log_returns[:, t] = mu[state] + sigma[state] * z[:, t]
+        state = np.where(u[:, t + 1] < stay[state], state, 1 - state)
+        reporter.update(t + 1)
+    return _compound(log_returns, current_price, dtype)
+
+
+def regime_switching_return(price, t, T, params, rng: np.random.Generator = None):
+    '''
+    Single step from a regime drawn from the stationary distribution; `generate_time_series` runs the regime
+    chain with `regime_switching_paths`
+    '''
+    mu, sigma, _, stationary_high = _regime_arrays(regime_params(params, T))
+    state = int(_generator(rng).random() < stationary_high)
+    return price * np.exp(mu[state] + sigma[state] * _generator(rng).normal())
+
 RETURN_FUNCTIONS = {'Lognormal Random Walk':log_normal_return
                         ,'Normal Random Walk':random_return
                         ,"Generalized Hyperbolic":  generalized_hyperbolic_return
+                        ,'Block Bootstrap': block_bootstrap_return
+                        ,'GARCH(1,1)': garch_return
+                        ,'Regime Switching': regime_switching_return
                         }
 
+#return functions whose paths are generated all at once rather than step by step
+VECTORIZED_PATHS = {block_bootstrap_return: block_bootstrap_paths
+                    ,garch_return: garch_paths
+                    ,regime_switching_return: regime_switching_paths
+                    }
+#whole path counterparts of the step by step return functions, used with low discrepancy innovations
+INNOVATION_PATHS = {log_normal_return: log_normal_paths
+                    ,random_return: random_paths
+                    ,generalized_hyperbolic_return: generalized_hyperbolic_paths
+                    ,**VECTORIZED_PATHS
+                    }
+
+
+#tilted whole path generators returning (paths, likelihood ratio weights), used for importance sampling
+WEIGHTED_PATHS = {log_normal_return: weighted_log_normal_paths
+                  ,generalized_hyperbolic_return: weighted_generalized_hyperbolic_paths
+                  }
+
+
+def loss_tilt(return_func, params, T: int, target_loss: float = DEFAULT_TARGET_LOSS) -> float:
+    '''
+    Per step shift of the normal innovations (in standard deviations) that moves the typical path of `return_func`
+    to a `target_loss` fraction of its starting price, capped so that the whole path moves by at most
+    `MAX_TILT_SHIFT` standard deviations (the likelihood ratio weights degenerate beyond)
+    '''
+    if return_func not in WEIGHTED_PATHS: raise ValueError(f'importance sampling is not supported by {return_func.__name__}')
+    drift, scale = params.get("mu", 0), _step_sigma(params, T)
+    if return_func is generalized_hyperbolic_return:
+        #typical step: the median of the inverse gamma mixing variable
+        gamma_var = invgamma.median(a=-params.get("lambda_", -0.5), scale=params.get("delta", 1)**2/params.get("alpha", 1))
+        drift, scale = drift + params.get("beta", 0) * gamma_var, np.sqrt(gamma_var)
+    tilt = (np.log(1 - target_loss) / (T - 1) - drift) / scale
+    max_tilt = MAX_TILT_SHIFT / np.sqrt(T - 1)
+    return float(np.clip(tilt, -max_tilt, max_tilt))
+
+
+def generate_weighted_time_series(N: int, T: int, current_price: float, return_func, params, tilt: float = None
+                                  , target_loss: float = DEFAULT_TARGET_LOSS, progress:ProgressCallback=None, dtype=np.float64
+                                  , innovations:str='pseudo', seed:int=None, rng: np.random.Generator = None):
+    '''
+    Importance sampling counterpart of `generate_time_series`: paths drawn with the innovations tilted toward losses
+    (by `tilt`, or the `loss_tilt` of `target_loss` when not set) and their (N,) likelihood ratio weights
+    '''
+    if return_func not in WEIGHTED_PATHS: raise ValueError(f'importance sampling is not supported by {return_func.__name__}')
+    if tilt is None: tilt = loss_tilt(return_func, params, T, target_loss)
+    return WEIGHTED_PATHS[return_func](N, T, current_price, params, tilt=tilt, source=innovation_source(innovations, seed, rng)
+                                       , progress=progress, dtype=dtype)
 
 
 def return_functions(function_name):
@@ -55,7 +530,8 @@ def return_functions(function_name):
 
 
 
-def generate_time_series(N: int, T: int, current_price:float,return_func, params, ):
+def generate_time_series(N: int, T: int, current_price:float,return_func, params, progress:ProgressCallback=None, dtype=np.float64
+                         , innovations:str='pseudo', seed:int=None, rng: np.random.Generator = None):
     """
     Generates N time series using the return function provided and saves them to file_path if provided.
     :param N: number of time series to generate
@@ -65,23 +541,76 @@ def generate_time_series(N: int, T: int, current_price:float,return_func, params
                     2) time step
                     and return the return for the next step
     :param params: parameter for the return function
+    :param progress: optional `callback(stage, fraction)` called per chunk of paths
+    :param dtype: storage dtype of the paths, each step is computed in double precision from the stored price
+    :param innovations: `pseudo` (`rng`, the global numpy generator when not given) or `sobol` (scrambled Sobol points seeded with `seed`)
+    :param rng: generator of the pseudo-random draws, the engine passes one per run so concurrent runs do not share a stream
     :return: generated time series
     """
-    time_series = np.zeros((N, T))
+    source = innovation_source(innovations, seed, rng)
+    step = return_func if rng is None else partial(return_func, rng=rng)
+    if innovations != 'pseudo':
+        if return_func not in INNOVATION_PATHS: raise ValueError(f'{innovations} innovations are not supported by {return_func.__name__}')
+        return INNOVATION_PATHS[return_func](N, T, current_price, params, source=source, progress=progress, dtype=dtype)
+    if return_func in VECTORIZED_PATHS:
+        return VECTORIZED_PATHS[return_func](N, T, current_price, params, source=source, progress=progress, dtype=dtype)
+    time_series = np.zeros((N, T), dtype=dtype)
     time_series[:,0] = current_price
     print('simulating prices..')
+    reporter = ProgressReporter(progress,'path_generation',N).start()
     for i in nqdm(range(N)):
         for j in range(1,T):
-            time_series[i,j] = return_func(time_series[i,(j-1)], j,T, params)
+            time_series[i,j] = step(float(time_series[i,(j-1)]), j,T, params)
             if time_series[i,j] < 0.:
                 time_series[i,j] = 0.
                 break
+        reporter.update(i+1)
     return time_series
 
 
 
 
 
+def cholesky_factor(correlation) -> np.ndarray:
+    '''
+    Lower triangular `L` with `L @ L.T == correlation`; the matrix must be a symmetric positive definite correlation matrix
+    '''
+    correlation = np.atleast_2d(np.asarray(correlation, dtype=np.float64))
+    if correlation.shape[0] != correlation.shape[1] or not np.allclose(correlation, correlation.T):
+        raise ValueError('correlation must be a symmetric square matrix')
+    if not np.allclose(np.diag(correlation), 1.):
+        raise ValueError('correlation must have a unit diagonal')
+    try:
+        return np.linalg.cholesky(correlation)
+    except np.linalg.LinAlgError:
+        raise ValueError('correlation must be positive definite')
+
+
+def correlated_log_normal_paths(N: int, T: int, current_prices, sigmas, correlation, mu=0., rng: np.random.Generator=None
+                                , progress:ProgressCallback=None, dtype=np.float64) -> np.ndarray:
+    '''
+    (N, T, K) lognormal random walks of K assets, the multi-asset counterpart of `log_normal_return`:
+    `S_t = S_{t-1} exp(mu + sigma/sqrt(T) * e_t)` with `e_t = L z_t`, `L` the Cholesky factor of `correlation`.
+    All innovations are drawn as one (N, T-1, K) batch, from `rng` or the global numpy generator
+    '''
+    current_prices = np.asarray(current_prices, dtype=np.float64)
+    K = current_prices.shape[0]
+    sigmas = np.broadcast_to(np.asarray(sigmas, dtype=np.float64), (K,))
+    mu = np.broadcast_to(np.asarray(mu, dtype=np.float64), (K,))
+    L = cholesky_factor(correlation)
+    if L.shape[0] != K: raise ValueError(f'correlation is {L.shape[0]}x{L.shape[0]} for {K} assets')
+
+    reporter = ProgressReporter(progress,'path_generation',1).start()
+    z = rng.standard_normal((N, T - 1, K)) if rng is not None else np.random.standard_normal((N, T - 1, K))
+    log_returns = mu + (z @ L.T) * (sigmas / np.sqrt(T))
+
+    time_series = np.empty((N, T, K), dtype=dtype)
+    time_series[:, 0] = current_prices
+    time_series[:, 1:] = current_prices * np.exp(np.cumsum(log_returns, axis=1))
+    reporter.update(1)
+    return time_series
+
+
 from typing import List
 import math
 
@@ -0,0 +1,182 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+from . import pricing, utils
+from .names import OptionType
+from .jobs import JobCancelled
+from .progress import ProgressCallback
+
+#production serving defaults, overridable with the `WEB_WORKERS` and `SIM_WORKERS` env vars.
+#background jobs live in the memory of the web worker that accepted them, so one web worker serves the job API
+#and simulation throughput scales with the simulation pool processes
+DEFAULT_WEB_WORKERS = 1
+DEFAULT_WEB_THREADS = 8
+DEFAULT_SIM_WORKERS = 4
+DEFAULT_TIMEOUT = 600
+#how often the caller relays progress from a simulation worker, seconds
+PROGRESS_POLL_INTERVAL = 0.1
+#annualized volatility the premium table is warmed at when neither the config nor market data give one (the GUI default)
+DEFAULT_WARM_VOLATILITY = 0.24
+
+
+def warm_pricing(config: utils.Config, volatilities=None) -> int:
+    '''
+    Fill the premium lookup table for the strangle strikes and maturities of `config` at each of `volatilities`
+    (the config sigma, or `DEFAULT_WARM_VOLATILITY` when the config only holds a placeholder), returns the number of entries
+    '''
+    strategy_params = config.strategy_function_params
+    pct = strategy_params['option_straddle_pct_from_strike']
+    if volatilities is None:
+        sigma = config.return_function_params.get('sigma', -1)
+        volatilities = [sigma if sigma > 0 else DEFAULT_WARM_VOLATILITY]
+    eval_date = pricing.evaluation_date()
+    for volatility in volatilities:
+        if not volatility > 0: continue
+        for maturity in range(1, int(strategy_params['option_duration']) + 1):
+            #same positional key as `pricing.option_premium`, so the executor lookups hit these entries (until midnight)
+            pricing.premium_per_notional(OptionType.CALL, round(1 + pct, pricing.MONEYNESS_DECIMALS), maturity, volatility, strategy_params['cash_interest'], 0.0, eval_date)
+            pricing.premium_per_notional(OptionType.PUT, round(1 - pct, pricing.MONEYNESS_DECIMALS), maturity, volatility, strategy_params['cash_interest'], 0.0, eval_date)
+    return pricing.premium_per_notional.cache_info().currsize
+
+
+def warm_up(config_file: str = 'default_config.json', market_data: bool = False) -> dict:
+    '''
+    Import and exercise the compute core once: QuantLib, scipy and the plotting backends are loaded,
+    the premium table is filled for the default strategy and a tiny engine run touches every stage.
+    Called in the server master before forking, so workers share the warm pages copy-on-write
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from . import engine, data_source
+
+    started = time.perf_counter()
+    config = utils.read_config(config_file)
+    loaded = dict()
+    if market_data:
+        loaded = data_source.load_market_data(lookback_days=30)
+    sigma = config.return_function_params.get('sigma', -1)
+    premiums = warm_pricing(config, [sigma if sigma > 0 else DEFAULT_WARM_VOLATILITY] + [m.volatility for m in loaded.values()])
+
+    config.data_mode = 'simulation'
+    config.return_function = 'Lognormal Random Walk'
+    config.return_function_params.update(dict(N=2, T=30, mu=0., sigma=0.5))
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        engine.MCSEngine(config).run(render_plots=True)
+    plt.close('all')
+
+    return dict(premium_table=premiums, market_data=len(loaded), seconds=time.perf_counter() - started)
+
+
+def _run_in_worker(func: Callable, args, kwargs, events, cancel) -> object:
+    def progress(stage, fraction):
+        events.put((stage, fraction))
+        if cancel.is_set(): raise JobCancelled()
+    return func(*args, progress=progress, **kwargs)
+
+
+class SimulationPool:
+    def __init__(self, max_workers: int = DEFAULT_SIM_WORKERS) -> None:
+        '''
+        Process pool for CPU bound simulations, so they do not hold the GIL of the web workers serving light endpoints.
+        The pool is created lazily in the process that first uses it, so it is safe to build before a server forks.
+        Functions run by the pool receive a `progress` callback relayed to the caller
+        '''
+        self._max_workers = max_workers
+        self._executor: ProcessPoolExecutor = None
+        self._manager = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid(): return
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers, mp_context=context, initializer=warm_up)
+            self._manager = context.Manager()
+            self._pid = os.getpid()
+
+    def run(self, func: Callable, *args, progress: ProgressCallback = None, **kwargs):
+        '''
+        Run `func(*args, progress=..., **kwargs)` in a worker process and wait for the result.
+        If the caller's `progress` raises `JobCancelled` the worker is asked to stop at its next progress report
+        '''
+        self._ensure_started()
+        events, cancel = self._manager.Queue(), self._manager.Event()
+        future = self._executor.submit(_run_in_worker, func, args, kwargs, events, cancel)
+        try:
+            while True:
+                done = future.done()
+                while True:
+                    try:
+                        stage, fraction = events.get_nowait()
+                    except queue.Empty:
+                        break
+                    if progress is not None: progress(stage, fraction)
+                if done: return future.result()
+                time.sleep(PROGRESS_POLL_INTERVAL)
+        except JobCancelled:
+            cancel.set()
+            raise
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=wait)
+            self._manager.shutdown()
+        self._executor = None
+
+
+def gunicorn_options(host: str = '0.0.0.0', port: int = 7861, workers: int = DEFAULT_WEB_WORKERS
+                     , threads: int = DEFAULT_WEB_THREADS, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    '''
+    gunicorn settings of `serve_production`, warns when more than one web worker would split the job registry
+    '''
+    if workers > 1:
+        warnings.warn(f'{workers} web workers: background jobs are only visible to the worker that accepted them, '
+                      'the job API needs sticky sessions. Scale simulations with the simulation workers instead')
+    return {'bind': f'{host}:{port}'
+            ,'workers': workers
+            ,'worker_class': 'gthread'
+            ,'threads': threads
+            ,'timeout': timeout
+            ,'preload_app': True
+            }
+
+
+def serve_production(app, host: str = '0.0.0.0', port: int = 7861, workers: int = DEFAULT_WEB_WORKERS
+                     , timeout: int = DEFAULT_TIMEOUT, warm: bool = True) -> None:
+    '''
+    Serve a WSGI `app` with gunicorn: `workers` pre-forked processes with threads for I/O bound endpoints,
+    the compute core warmed up once in the master before forking
+    '''
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError('production serving requires gunicorn: pip install gunicorn')
+
+    options = gunicorn_options(host, port, workers, timeout=timeout)
+    if warm:
+        print('warm up:', warm_up())
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
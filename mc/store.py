@@ -0,0 +1,167 @@
+import datetime as dt
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from . import analysis
+
+MANIFEST_FILE = 'manifest.json'
+STORE_VERSION = 1
+
+
+def _chunk_file(name: str, index: int, compress: bool) -> str:
+    return f'{name}.{index:05d}.npz' if compress else f'{name}.{index:05d}.npy'
+
+
+def save_arrays(folder: str, arrays: Dict[str, np.ndarray], config: dict = None, seed: int = None
+                , chunk_paths: int = None, compress: bool = False, **metadata) -> str:
+    '''
+    Persist `arrays` (path axis first) under `folder` with a JSON manifest (config, seed, shapes, dtypes, chunks).
+    Without chunking and compression every array is a single `.npy` file, memory-mapped when read back.
+    `chunk_paths` splits the arrays along the path axis, `compress` stores the chunks as deflated `.npz`.
+    Returns the manifest path
+    '''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    manifest = dict(version=STORE_VERSION
+                    , created=dt.datetime.now().isoformat()
+                    , config=config
+                    , seed=seed
+                    , metadata=metadata
+                    , arrays=dict())
+    for name, arr in arrays.items():
+        arr = np.asarray(arr)
+        N = arr.shape[0]
+        step = N if chunk_paths is None else max(int(chunk_paths), 1)
+        chunks = []
+        for index, start in enumerate(range(0, max(N, 1), step)):
+            stop = min(start + step, N)
+            file_name = _chunk_file(name, index, compress)
+            if compress:
+                np.savez_compressed(os.path.join(folder, file_name), data=arr[start:stop])
+            else:
+                np.save(os.path.join(folder, file_name), arr[start:stop])
+            chunks.append(dict(file=file_name, start=start, stop=stop))
+        manifest['arrays'][name] = dict(shape=list(arr.shape), dtype=str(arr.dtype), compressed=compress, chunks=chunks)
+
+    path = os.path.join(folder, MANIFEST_FILE)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return path
+
+
+def _as_slice(index) -> slice:
+    if index is None: return slice(None)
+    if isinstance(index, slice): return index
+    start, stop = index
+    return slice(start, stop)
+
+
+class RunStore:
+    def __init__(self, folder: str) -> None:
+        '''
+        Lazy reader of a folder written by `save_arrays`. Only the manifest is read up front;
+        `read` loads the chunks overlapping the requested path range
+        '''
+        self.folder = folder
+        with open(os.path.join(folder, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.manifest['arrays'])
+
+    @property
+    def config(self) -> dict:
+        return self.manifest['config']
+
+    @property
+    def seed(self) -> int:
+        return self.manifest['seed']
+
+    def shape(self, name: str) -> tuple:
+        return tuple(self.manifest['arrays'][name]['shape'])
+
+    def dtype(self, name: str) -> np.dtype:
+        return np.dtype(self.manifest['arrays'][name]['dtype'])
+
+    def _load_chunk(self, chunk: dict, compressed: bool) -> np.ndarray:
+        path = os.path.join(self.folder, chunk['file'])
+        if compressed:
+            with np.load(path, allow_pickle=False) as data:
+                return data['data']
+        return np.load(path, mmap_mode='r', allow_pickle=False)
+
+    def read(self, name: str, paths=None, times=None) -> np.ndarray:
+        '''
+        Paths `paths` and timestamps `times` (slices or `(start, stop)` tuples) of array `name`.
+        Uncompressed single-chunk arrays return a read-only memory-mapped view, nothing is copied;
+        otherwise only the chunks overlapping `paths` are loaded
+        '''
+        entry = self.manifest['arrays'][name]
+        paths, times = _as_slice(paths), _as_slice(times)
+        #per path arrays (e.g. `weights`) have no time axis
+        index = lambda rows: (rows,) if len(entry['shape']) == 1 else (rows, times)
+        if len(entry['chunks']) == 1 and not entry['compressed']:
+            return self._load_chunk(entry['chunks'][0], False)[index(paths)]
+
+        start, stop, step = paths.indices(entry['shape'][0])
+        if step != 1: raise ValueError('chunked arrays are read by contiguous path ranges')
+        parts = []
+        for chunk in entry['chunks']:
+            lo, hi = max(start, chunk['start']), min(stop, chunk['stop'])
+            if lo >= hi: continue
+            data = self._load_chunk(chunk, entry['compressed'])
+            parts.append(np.asarray(data[index(slice(lo - chunk['start'], hi - chunk['start']))]))
+        if not parts:
+            return np.asarray(self._load_chunk(entry['chunks'][0], entry['compressed'])[index(slice(0, 0))])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=0)
+
+    @property
+    def weighted(self) -> bool:
+        return 'weights' in self.manifest['arrays']
+
+    def weights(self, paths=None) -> np.ndarray:
+        '''
+        Importance sampling likelihood ratios of the paths, None for an unweighted run
+        '''
+        return self.read('weights', paths) if self.weighted else None
+
+    def bands(self, name: str, quantiles=None, estimator: str = 'sketch', chunk_paths: int = None):
+        '''
+        `analysis.SeriesBands` of array `name` (asset axis summed for (N, T, K) arrays). The `sketch` estimator
+        reads `chunk_paths` paths at a time, so runs larger than memory can be summarized.
+        Weighted runs are summarized with their weights, in one read (`empirical` instead of `sketch`)
+        '''
+        quantiles = analysis.DEFAULT_QUANTILES if quantiles is None else quantiles
+        chunk_paths = chunk_paths or analysis.SKETCH_CHUNK_PATHS
+        as_paths = lambda arr: np.nan_to_num(arr).sum(axis=2, dtype=np.float64) if arr.ndim == 3 else arr
+        if self.weighted:
+            return analysis.SeriesBands.from_paths(as_paths(self.read(name)), quantiles
+                                                   , 'empirical' if estimator == 'sketch' else estimator, weights=self.weights())
+        if estimator != 'sketch':
+            return analysis.SeriesBands.from_paths(as_paths(self.read(name)), quantiles, estimator)
+
+        N = self.shape(name)[0]
+        sketch = analysis.QuantileSketch(self.shape(name)[1])
+        for start in range(0, N, chunk_paths):
+            sketch.update(as_paths(self.read(name, paths=(start, min(start + chunk_paths, N)))))
+        return sketch.to_bands(quantiles)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.read(name)
+
+    def series(self, paths=None, times=None):
+        '''
+        `engine.ResultSeries` of the stored run, backed by the memory-mapped files when possible
+        '''
+        from .engine import ResultSeries
+        return ResultSeries(allocated_capital=self.read('allocated_capital', paths, times)
+                            , sim_res=self.read('sim_res', paths, times)
+                            , weights=self.weights(paths))
+
+    def __repr__(self) -> str:
+        arrays = ','.join(f'{name}{self.shape(name)}' for name in self.names)
+        return f'RunStore(folder={self.folder},arrays={arrays})'
@@ -4,11 +4,12 @@ import pandas as pd
 from typing import Tuple
 import datetime as dt
 import os
-from .analysis import ReturnsCalculator
+from .analysis import ReturnsCalculator, check_band_estimator, PRECISION_METRICS, DEFAULT_TOLERANCE
+from . import store , catalog
 import logging
 from dataclasses import dataclass , asdict
-import pickle
 import argparse
+import numpy as np
 
 
 TIME_INTERVAL_DICT = {'6mo':180, '1y':360, '5y':1800, '10y':3600}
@@ -17,16 +18,28 @@ AMOUNT_DICT = {'$1k':1000.,'$10k':10000.,'$100k':100000}
 OPTION_EXPIRATION = {'7d':7, '14d':14, '25d':25, '180d':180}
 
 
-ASSET_INDEX = {'equity':0,'cash':1}
-
-def save_to_pickle(arr, file_path: str = None):
-    with open(file_path, 'wb') as f:
-        pickle.dump(arr, f)
-
-
-def save_data(env,sim_res,allocated_capital):
-    save_to_pickle(sim_res,env.TS_SIMS)
-    save_to_pickle(allocated_capital,env.TS_PORTFLO_SIM)
+ASSET_INDEX = {'equity':0,'cash':1,'options':2}
+
+def save_data(env,sim_res,allocated_capital,config=None,chunk_paths:int=None,compress:bool=False,stats:dict=None,weights=None)->str:
+    '''
+    Save the run arrays as memory-mappable `.npy` files with a JSON manifest under `env.RUN_STORE`,
+    read them back with `store.RunStore`. The run is added to the catalog of its runs folder with `stats`.
+    The importance sampling `weights` of the paths are stored next to them
+    '''
+    config_dict = asdict(config) if config is not None else None
+    arrays = dict(sim_res=sim_res,allocated_capital=allocated_capital)
+    if weights is not None:
+        arrays['weights'] = weights
+    manifest = store.save_arrays(env.RUN_STORE
+                             ,arrays
+                             ,config=config_dict
+                             ,seed=config.seed if config is not None else None
+                             ,chunk_paths=chunk_paths
+                             ,compress=compress)
+    (catalog.RunCatalog(os.path.join(os.path.dirname(env.SIM_FOLDER),catalog.CATALOG_FILE))
+        .register(env.timestp_,env.SIM_FOLDER,config=config_dict,stats=stats,store_folder=env.RUN_STORE
+                  ,created=dt.datetime.now().isoformat()))
+    return manifest
 
 
 class ComparisonAnnotation:
@@ -80,6 +93,7 @@ def create_logger(log_file:str=None):
 
 @dataclass
 class StrategyParams:
+    #a float, or a (n,) array of per path multiples
     amount_multiple: float = 1.0
     percent_allocated:float= 1.0
     rebalance_threshold_down: float= 0.00
@@ -96,6 +110,24 @@ class StrategyParams:
     all_series_backtest:bool = True
     benchmark_strategy_name: str = 'Buy and Hold'
     
+@dataclass
+class AdaptiveParams:
+    #standard error every tracked metric must reach
+    tolerance: float = DEFAULT_TOLERANCE
+    #paths simulated per batch, the configured N when not set
+    batch_paths: int = None
+    max_paths: int = 100000
+    #seconds, no limit when not set
+    time_budget: float = None
+    metrics: Tuple[str, ...] = PRECISION_METRICS
+
+@dataclass
+class ImportanceParams:
+    #per step shift of the normal innovations in standard deviations, derived from `target_loss` when not set
+    tilt: float = None
+    #terminal loss the tilted price paths are centred on
+    target_loss: float = 0.5
+
 @dataclass
 class Config:
     data_mode:str
@@ -105,6 +137,16 @@ class Config:
     plot_params: dict
     save_logs:bool=False
     logs_dir:str = None
+    profile_memory:bool = False
+    seed:int = None
+    #storage dtype of the path and capital arrays: `float64` or `float32`
+    dtype:str = 'float64'
+    #random draws of the simulated paths: `pseudo` or `sobol` (scrambled quasi-random points)
+    innovations:str = 'pseudo'
+    #`AdaptiveParams` fields: simulate in batches until the stats reach a tolerance, max paths or time budget
+    adaptive:dict = None
+    #`ImportanceParams` fields: draw the simulated paths tilted toward losses and weight the stats by likelihood ratios
+    importance_sampling:dict = None
 
 def read_config(config_file: str) -> Config:
     with open(config_file, 'r') as f:
@@ -125,8 +167,7 @@ class Env:
         self.LOGS_FOLDER = os.path.join(self.SIM_FOLDER,'logs')
         self.TESTS_FOLDER = os.path.join(os.path.abspath('.'),'data','tests', self.timestp_)
         self.paths = {
-            'TS_SIMS': 'prices_sims.pkl',
-            'TS_PORTFLO_SIM': 'portfolio_sims.pkl',
+            'RUN_STORE': 'arrays',
             'PLOT_TS': 'prices_sims.png',
             'PLOT_TS_PLY':'prices_sims_ply.png',
 
@@ -143,6 +184,7 @@ class Env:
             'PLOT_HISTOGRAMS':'histograms.png',
             'STATS_CSV': 'portfolio_summary.csv',
             'CONFIG_CSV': 'simulation_params.csv',
+            'TIMINGS_TRACE': 'timings_trace.json',
             
 
         }
@@ -166,13 +208,41 @@ class Env:
 
 
 
-def save_stats_to_csv(return_calculator:ReturnsCalculator, path:str):
-    df = pd.DataFrame.from_dict(return_calculator.stats,orient='index',columns=['value'])
+def save_stats_to_csv(return_calculator:ReturnsCalculator, path:str, timings=None, precision=None):
+    '''
+    Save summary stats; `timings` (`profiling.StageTimings`) adds the per-stage run costs
+    and `precision` (`analysis.PrecisionTracker`) the standard errors of an adaptive run as extra rows
+    '''
+    stats = dict(return_calculator.stats)
+    if timings is not None:
+        stats.update(timings.to_stats())
+    if precision is not None:
+        stats.update(precision.to_stats())
+    df = pd.DataFrame.from_dict(stats,orient='index',columns=['value'])
     df.to_csv(path)
 
 
 def config_sanity_check(config):
     assert config.return_function_params['N']> 1, 'N must be > 1'
+    resolve_dtype(config.dtype)
+    if 'band_estimator' in config.plot_params: check_band_estimator(config.plot_params['band_estimator'])
+    assert config.innovations in ('pseudo','sobol'), f'innovations must be pseudo or sobol, got {config.innovations}'
+    if config.adaptive is not None:
+        adaptive = AdaptiveParams(**config.adaptive)
+        assert adaptive.tolerance > 0, 'adaptive tolerance must be > 0'
+        assert adaptive.batch_paths is None or adaptive.batch_paths > 1, 'adaptive batch_paths must be > 1'
+        assert adaptive.max_paths > 1, 'adaptive max_paths must be > 1'
+    if config.importance_sampling is not None:
+        importance = ImportanceParams(**config.importance_sampling)
+        assert 0. < importance.target_loss < 1., 'importance sampling target_loss must be in (0, 1)'
+        assert config.adaptive is None, 'importance sampling does not support adaptive runs'
+        assert config.plot_params.get('band_estimator') != 'sketch', 'importance sampling needs the normal or empirical band estimator'
+
+
+def resolve_dtype(name:str) -> np.dtype:
+    dtype = np.dtype(name)
+    if dtype not in (np.float32, np.float64): raise ValueError(f'unsupported dtype {name}, use float32 or float64')
+    return dtype
 
 
 
@@ -186,11 +256,16 @@ def parse_config(default='default_config.json') -> Config:
 
 
 
-def assemble_conifg(data_mode,return_function,return_function_params,strategy_function_params,config_name='default_config.json'):
+def assemble_conifg(data_mode,return_function,return_function_params,strategy_function_params,config_name='default_config.json',seed=None,plot_params=None,innovations=None,adaptive=None,importance_sampling=None):
     config =  parse_config(config_name)
     config.data_mode = data_mode
+    if seed is not None: config.seed = seed
+    if innovations is not None: config.innovations = innovations
+    if adaptive is not None: config.adaptive = adaptive
+    if importance_sampling is not None: config.importance_sampling = importance_sampling
     config.return_function = return_function
     config.return_function_params.update(return_function_params)
     config.strategy_function_params.update(strategy_function_params)    
+    if plot_params: config.plot_params.update(plot_params)
     
     return config
\ No newline at end of file
@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict
+
+import numpy as np
+
+from . import analysis, overnight
+from .progress import ProgressCallback, ProgressReporter
+
+#overnight accrual convention of `/overnight`
+DAYS_PER_YEAR = 365.25
+
+
+def vasicek_paths(N: int, T: int, r0: float, kappa: float, theta: float, sigma: float, rng: np.random.Generator, dt: float = 1 / DAYS_PER_YEAR) -> np.ndarray:
+    '''
+    Annualized short rate paths `dr = kappa (theta - r) dt + sigma dW`, exact gaussian transition
+    '''
+    rates = np.empty((N, T))
+    rates[:, 0] = r0
+    decay = np.exp(-kappa * dt)
+    std = sigma * np.sqrt((1 - decay ** 2) / (2 * kappa)) if kappa > 0 else sigma * np.sqrt(dt)
+    for t in range(1, T):
+        rates[:, t] = theta + (rates[:, t - 1] - theta) * decay + std * rng.standard_normal(N)
+    return rates
+
+
+def cir_paths(N: int, T: int, r0: float, kappa: float, theta: float, sigma: float, rng: np.random.Generator, dt: float = 1 / DAYS_PER_YEAR) -> np.ndarray:
+    '''
+    Annualized short rate paths `dr = kappa (theta - r) dt + sigma sqrt(r) dW`, full truncation Euler scheme
+    '''
+    rates = np.empty((N, T))
+    rates[:, 0] = r0
+    r = np.full(N, float(r0))
+    for t in range(1, T):
+        r_pos = np.maximum(r, 0.)
+        r = r + kappa * (theta - r_pos) * dt + sigma * np.sqrt(r_pos * dt) * rng.standard_normal(N)
+        rates[:, t] = np.maximum(r, 0.)
+    return rates
+
+
+RATE_MODELS: Dict[str, Callable] = {'Vasicek': vasicek_paths
+                                    , 'CIR': cir_paths
+                                    }
+
+
+def flow_paths(N: int, T: int, mean: float, volatility: float, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Non negative daily flows, lognormal around `mean`
+    '''
+    if mean <= 0: return np.zeros((N, T))
+    return mean * rng.lognormal(-volatility ** 2 / 2, volatility, size=(N, T))
+
+
+@dataclass
+class WadSimParams:
+    N: int = 1000
+    T: int = 365
+    rate_model: str = 'Vasicek'
+    r0: float = 0.05
+    kappa: float = 0.5
+    theta: float = 0.05
+    sigma: float = 0.01
+    current_price: float = 1.0
+    number_of_wads: float = 1e6
+    #daily minted amount (currency) and burned wads (count)
+    mint_mean: float = 0.
+    mint_volatility: float = 0.5
+    burn_mean: float = 0.
+    burn_volatility: float = 0.5
+    seed: int = None
+    confidence_level: int = 5
+
+
+@dataclass
+class WadSimResults:
+    params: WadSimParams
+    rates: np.ndarray
+    prices: np.ndarray
+    wads: np.ndarray
+    summary: analysis.ReturnsCalculator = field(repr=False)
+
+
+def propagate(rates: np.ndarray, mint: np.ndarray, burn: np.ndarray, current_price: float, number_of_wads: float, progress: ProgressCallback = None):
+    '''
+    Run `overnight.wad_coin_variant3` day by day over (N, T) rate and flow paths.
+    Minted amounts are issued at the previous close and burned wads are capped by the supply,
+    the reserve carried to the next day is the NAV of the outstanding wads.
+    Returns (prices, wads), both (N, T)
+    '''
+    N, T = rates.shape
+    prices = np.empty((N, T))
+    wads = np.empty((N, T))
+    prices[:, 0] = current_price
+    wads[:, 0] = number_of_wads
+    blocked = prices[:, 0] * wads[:, 0]
+    reporter = ProgressReporter(progress, 'wad_propagation', T).start()
+    for t in range(1, T):
+        p_t = prices[:, t - 1]
+        burned = np.minimum(burn[:, t], wads[:, t - 1])
+        wads[:, t] = wads[:, t - 1] + np.divide(mint[:, t], p_t, out=np.zeros(N), where=p_t > 0) - burned
+        prices[:, t] = np.divide(overnight.wad_coin_variant3(p_t, blocked, mint[:, t], burned, rates[:, t - 1] / DAYS_PER_YEAR, 1.)
+                                 , wads[:, t], out=np.zeros(N), where=wads[:, t] > 0)
+        blocked = prices[:, t] * wads[:, t]
+        reporter.update(t + 1)
+    return prices, wads
+
+
+def run_wad_simulation(params: WadSimParams, progress: ProgressCallback = None) -> WadSimResults:
+    '''
+    Monte Carlo of the wad coin NAV: short rate paths from `params.rate_model`, lognormal mint/burn flows,
+    the price recurrence propagated over N paths at once and NAV stats from `ReturnsCalculator`
+    '''
+    if params.rate_model not in RATE_MODELS:
+        raise ValueError(f'Unknown rate model {params.rate_model}, expected one of: ' + ','.join(RATE_MODELS))
+    rng = np.random.default_rng(params.seed)
+    N, T = params.N, params.T
+
+    rates = RATE_MODELS[params.rate_model](N, T, params.r0, params.kappa, params.theta, params.sigma, rng)
+    mint = flow_paths(N, T, params.mint_mean, params.mint_volatility, rng)
+    burn = flow_paths(N, T, params.burn_mean, params.burn_volatility, rng)
+    prices, wads = propagate(rates, mint, burn, params.current_price, params.number_of_wads, progress=progress)
+
+    summary = (analysis.ReturnsCalculator(prices[:, :, np.newaxis], confidence_level=params.confidence_level, risk_free_rate=params.r0)
+               .calculate_returns()
+               .calculate_stats()
+               .calculate_sample_stats())
+    return WadSimResults(params=params, rates=rates, prices=prices, wads=wads, summary=summary)
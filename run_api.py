@@ -1,21 +1,50 @@
-import sys
-from flask import Flask, request, jsonify
+import sys , os
+import matplotlib
+matplotlib.use('Agg')
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import traceback
 
 import json
 import base64
+import numpy as np
 
 import datetime as dt
-from mc import utils , engine , overnight
+from mc import utils , engine , overnight , jobs , payloads , wad_engine , serving , coalescing , analysis , multi_asset , series_gen
+from dataclasses import fields
 
 # Your API definition
 api_backend = Flask(__name__)
 CORS(api_backend)
+
+#background simulations, sized with `JOB_WORKERS` and `JOB_QUEUE_DEPTH`
+job_queue = jobs.JobQueue(max_workers=int(os.environ.get('JOB_WORKERS',2))
+                        ,max_queue_depth=int(os.environ.get('JOB_QUEUE_DEPTH',16))
+                        ,result_ttl=float(os.environ.get('JOB_RESULT_TTL',3600))
+                        )
+#how often the progress stream checks the job state, seconds
+SSE_POLL_INTERVAL = 0.25
+#with `SIM_WORKERS` > 0 simulations run in a separate process pool instead of the web worker
+simulation_pool = None
+
+def use_simulation_pool(max_workers:int):
+    global simulation_pool
+    simulation_pool = serving.SimulationPool(max_workers) if max_workers > 0 else None
+
+use_simulation_pool(int(os.environ.get('SIM_WORKERS',0)))
+#identical concurrent requests (config, seed and response options) share one run; one registry per process,
+#shared with `engine.run_coalesced` (keys differ by their options)
+simulation_flights = engine.simulation_flights
     
 class InvalidInputParameters(Exception):
     pass
 
+def json_stats(stats:dict) -> dict:
+    '''
+    `stats` with non-finite values (unbounded ratios, empty-sample moments) as null, strict json has no NaN/Infinity
+    '''
+    return {k: (None if isinstance(v, (float, np.floating)) and not np.isfinite(v) else v) for k,v in stats.items()}
+
 def img_to_base64(figure_object):
 
     # Convert the figure to a static PNG image
@@ -35,6 +64,23 @@ def validate_input(params_json):
     missing_params = list(set(requied_keys)  - set(provided_keys))
 
     if len(missing_params)>0: raise InvalidInputParameters('Invalid parameters. Missing keys:' + ','.join(missing_params))
+    if params_json.get('band_estimator', analysis.DEFAULT_BAND_ESTIMATOR) not in analysis.BAND_ESTIMATORS:
+        raise InvalidInputParameters('Invalid band_estimator, expected one of: ' + ','.join(analysis.BAND_ESTIMATORS))
+    if params_json.get('adaptive') is not None:
+        try:
+            adaptive = utils.AdaptiveParams(**params_json['adaptive'])
+        except TypeError as e:
+            raise InvalidInputParameters(f'Invalid adaptive params: {e}')
+        unknown = [m for m in adaptive.metrics if m not in analysis.PRECISION_METRICS]
+        if len(unknown)>0: raise InvalidInputParameters('Invalid adaptive metrics, expected some of: ' + ','.join(analysis.PRECISION_METRICS))
+    if params_json.get('importance_sampling') is not None:
+        try:
+            utils.ImportanceParams(**params_json['importance_sampling'])
+        except TypeError as e:
+            raise InvalidInputParameters(f'Invalid importance_sampling params: {e}')
+        weighted = [name for name, function in series_gen.RETURN_FUNCTIONS.items() if function in series_gen.WEIGHTED_PATHS]
+        if series_gen.RETURN_FUNCTIONS.get(params_json['return_function']) not in series_gen.WEIGHTED_PATHS:
+            raise InvalidInputParameters('importance_sampling supports the return functions: ' + ','.join(weighted))
 
 
 
@@ -73,7 +119,86 @@ def run_sofr_api():
             return jsonify({'trace': traceback.format_exc()})
         else:
             return jsonify({'error': str(e)})
-        
+
+
+@api_backend.route('/wadprice/batch', methods=['POST'])
+def run_wadprice_batch():
+    """
+    json body with scalars or arrays (broadcast against each other) of:
+    p_t, amount_blocked, amount_to_mint, n_to_burn, r_overnight, total_numer_wads
+    With `r_overnight_path` (T,) or (N,T) instead of `r_overnight`, the price is projected forward over the rate path:
+    mint, burn and number of wads are then per day schedules and the reserve is carried forward day to day
+    """
+    PARAMS = ['p_t','amount_blocked','amount_to_mint','n_to_burn','total_numer_wads']
+    try:
+        params_json = request.json
+        for arg_check in PARAMS:
+            assert arg_check in params_json, f'Missing {arg_check} argument'
+        now = dt.datetime.now()
+
+        if 'r_overnight_path' in params_json:
+            prices = overnight.wad_coin_projection(params_json['p_t'],params_json['amount_blocked']
+                                                   ,params_json['amount_to_mint'],params_json['n_to_burn']
+                                                   ,params_json['r_overnight_path'],params_json['total_numer_wads'])
+        else:
+            assert 'r_overnight' in params_json, 'Missing r_overnight argument'
+            prices = overnight.wad_coin_batch(params_json['p_t'],params_json['amount_blocked']
+                                              ,params_json['amount_to_mint'],params_json['n_to_burn']
+                                              ,params_json['r_overnight'],params_json['total_numer_wads'])
+
+        return jsonify({'engine_v': '3'
+                        ,'price': prices.tolist()
+                        ,'timestamp': dt.datetime.timestamp(now)
+                        ,'date':now.strftime('%Y-%m-%d')
+                        })
+    except Exception as e:
+        return error_response(e)
+
+
+@api_backend.route('/wadsim', methods=['POST'])
+def run_wad_simulation():
+    """
+    Wad coin NAV Monte Carlo, json body with `wad_engine.WadSimParams` fields (all optional)
+    """
+    try:
+        params_json = request.json or {}
+        known = {f.name for f in fields(wad_engine.WadSimParams)}
+        unknown = set(params_json) - known
+        if len(unknown)>0: raise InvalidInputParameters('Invalid parameters. Unknown keys:' + ','.join(unknown))
+
+        sim = wad_engine.run_wad_simulation(wad_engine.WadSimParams(**params_json))
+        terminal_nav = sim.prices[:,-1]
+        return jsonify({'summary': json_stats(sim.summary.stats)
+                        ,'sample_summary': json_stats(sim.summary.sample_stats)
+                        ,'terminal_nav_percentiles': dict(zip(['p1','p5','p50','p95','p99'],np.percentile(terminal_nav,[1,5,50,95,99]).tolist()))
+                        ,'terminal_nav_mean': float(terminal_nav.mean())
+                        })
+    except Exception as e:
+        return error_response(e)
+
+
+@api_backend.route('/multiasset', methods=['POST'])
+def run_multi_asset_simulation():
+    """
+    Correlated multi-coin basket Monte Carlo, json body with `multi_asset.MultiAssetParams` fields (all optional)
+    """
+    try:
+        params_json = request.json or {}
+        known = {f.name for f in fields(multi_asset.MultiAssetParams)}
+        unknown = set(params_json) - known
+        if len(unknown)>0: raise InvalidInputParameters('Invalid parameters. Unknown keys:' + ','.join(unknown))
+
+        sim = multi_asset.run_multi_asset_simulation(multi_asset.MultiAssetParams(**params_json))
+        terminal_value = sim.summary.sim_portfolio[:,-1]
+        return jsonify({'summary': json_stats(sim.summary.stats)
+                        ,'sample_summary': json_stats(sim.summary.sample_stats)
+                        ,'baseline_summary': json_stats(sim.baseline_summary.stats)
+                        ,'correlation': sim.correlation.tolist()
+                        ,'terminal_value_percentiles': dict(zip(['p1','p5','p50','p95','p99'],np.percentile(terminal_value,[1,5,50,95,99]).tolist()))
+                        })
+    except Exception as e:
+        return error_response(e)
+
 
 @api_backend.route('/overnight', methods=['GET'])
 def run_wad_coin_price():
@@ -96,32 +221,62 @@ def run_wad_coin_price():
         else:
             return jsonify({'error': str(e)})        
 
-@api_backend.route('/simulation', methods=['POST'])
-def run_simulation():
-    try:
-        print('recived params:',dict(request.args.items()))
-        params_json = request.json
-        validate_input(params_json)
-        config = utils.assemble_conifg(return_function=params_json['return_function']
+def build_simulation_config(params_json:dict) -> utils.Config:
+    validate_input(params_json)
+    return utils.assemble_conifg(data_mode=params_json.get('data_mode','simulation')
+                             ,return_function=params_json['return_function']
                              ,return_function_params = dict(sigma=params_json['sigma']
                             ,N=params_json['N']
                             ,T=params_json['T']
                             ,current_price = params_json['current_price']
+                            ,**{k: params_json[k] for k in ('lookback_days','window_step') if k in params_json}
                             ),
                             strategy_function_params=dict(ticker_name=params_json['ticker_name'],percent_allocated=params_json['percent_allocated']
                             ,rebalance_threshold_up= params_json['rebalance_threshold_up']
-                            ,rebalance_threshold_down= params_json['rebalance_threshold_up']
+                            ,rebalance_threshold_down= params_json['rebalance_threshold_down']
                             ,cash_interest=params_json['cash_interest']
                             ,coin_interest=params_json['coin_interest']
                             ,option_every_itervals=params_json['option_every_itervals']
                             ,option_duration=params_json['option_duration']
                             ,amount_multiple = params_json['amount_multiple']
-                            ))
-        
-        sim_results = (engine.MCSEngine(config)
-                    .run()
-                  )
-        
+                            )
+                            ,seed=params_json.get('seed')
+                            ,innovations=params_json.get('innovations')
+                            ,adaptive=params_json.get('adaptive')
+                            ,importance_sampling=params_json.get('importance_sampling')
+                            ,plot_params={k: params_json[k] for k in ('band_estimator',) if k in params_json})
+
+def response_options(args) -> dict:
+    '''
+    Response format query args: `format` (json|npz), `compress` (npz only, default true),
+    `render` (base64 plot images, default true for json and false for npz), `sample_paths`
+    '''
+    response_format = args.get('format','json')
+    if response_format not in payloads.PAYLOAD_FORMATS:
+        raise InvalidInputParameters(f'Unknown format {response_format}, expected one of: ' + ','.join(payloads.PAYLOAD_FORMATS))
+    flag = lambda name, default: args.get(name, str(default)).lower() in ('true','1','yes')
+    return dict(response_format=response_format
+                ,compress=flag('compress',True)
+                ,render=flag('render',response_format == 'json')
+                ,sample_paths=int(args.get('sample_paths',payloads.DEFAULT_SAMPLE_PATHS))
+                )
+
+def simulation_arrays_payload(sim_results:engine.SimResults, config:utils.Config, compress:bool=True, sample_paths:int=payloads.DEFAULT_SAMPLE_PATHS) -> bytes:
+    with sim_results.timings.stage('npz_encoding'):
+        arrays = payloads.simulation_arrays(sim_results, ci=config.plot_params['ci'], sample_paths=sample_paths
+                                            , band_estimator=config.plot_params.get('band_estimator', analysis.DEFAULT_BAND_ESTIMATOR))
+        return payloads.to_npz(arrays, compress=compress)
+
+def simulation_payload(sim_results:engine.SimResults) -> dict:
+    precision = {} if sim_results.precision is None else {'precision': sim_results.precision.to_dict()}
+    if sim_results.plots is None:
+        return {'summary':json_stats(sim_results.summary.run_summary.stats)
+                ,'sample_portfolio_summary': json_stats(sim_results.summary.run_summary.sample_stats)
+                ,'timings': sim_results.timings.to_dict()
+                ,**precision
+                }
+
+    with sim_results.timings.stage('png_encoding'):
         comparison_plot_base64 = img_to_base64(sim_results.plots.comparison_plot_data_ply.fig)
 
         cash_appreciation_plot_base64 = img_to_base64(sim_results.plots.cash_appreciation_plot_ply.fig)
@@ -130,26 +285,160 @@ def run_simulation():
 
         single_portfolio_ts_plot_base64 = img_to_base64(sim_results.plots.single_portfolio_ts_plot_ply.fig)
 
-        
+    statistics_dict = json_stats(sim_results.summary.run_summary.stats)
+
+    sample_statistics_dict = json_stats(sim_results.summary.run_summary.sample_stats)
+
+    return {'simulation_plot': str(comparison_plot_base64)
+            ,"cash_appreciation_plot" : str(cash_appreciation_plot_base64)
+            ,"prices_plot": str(prices_plot_base64)
+            ,'sample_portfolio_plot': str(single_portfolio_ts_plot_base64)
+            ,'summary':statistics_dict
+            ,'sample_portfolio_summary': sample_statistics_dict
+            ,'timings': sim_results.timings.to_dict()
+            ,**precision
+            }
+
+def render_simulation(config:utils.Config, response_format:str='json', compress:bool=True, render:bool=True
+                      , sample_paths:int=payloads.DEFAULT_SAMPLE_PATHS, progress=None):
+    '''
+    Run the engine and build the response body: a json-able dict or the npz bytes
+    '''
+    sim_results = engine.MCSEngine(config).run(progress=progress, render_plots=render)
+
+    if response_format == 'npz':
+        if progress is not None: progress('npz_encoding', 0.0)
+        return simulation_arrays_payload(sim_results, config, compress=compress, sample_paths=sample_paths)
+
+    if render and progress is not None: progress('png_encoding', 0.0)
+    return simulation_payload(sim_results)
+
+def execute_simulation(config:utils.Config, progress=None, **options):
+    '''
+    `render_simulation` in this process, or in the simulation pool when one is configured
+    '''
+    def run(progress):
+        if simulation_pool is None:
+            return render_simulation(config, progress=progress, **options)
+        return simulation_pool.run(render_simulation, config, progress=progress, **options)
+
+    return simulation_flights.run(coalescing.config_key(config, **options), run, progress=progress)
+
+def simulation_response(body):
+    if isinstance(body, bytes):
+        return Response(body, mimetype=payloads.NPZ_MIMETYPE)
+    return jsonify(body)
+
+def simulation_job(job:jobs.Job, params_json:dict, **options):
+    '''
+    Job queue entry point: run the engine and render the response payload
+    '''
+    def progress(stage, fraction):
+        job.report(stage, fraction)
+        job.check_cancelled()
+
+    progress('config', 0.0)
+    config = build_simulation_config(params_json)
+
+    return execute_simulation(config, progress=progress, **options)
+
+def error_response(e:Exception, status:int=200):
+    if 'debug' in request.args.keys() and request.args['debug']=='true':
+        return jsonify({'trace': traceback.format_exc()}), status
+    else:
+        return jsonify({'error': str(e)}), status
+
 
+@api_backend.route('/simulation', methods=['POST'])
+def run_simulation():
+    try:
+        print('recived params:',dict(request.args.items()))
+        options = response_options(request.args)
+        config = build_simulation_config(request.json)
 
-        statistics_dict = sim_results.summary.run_summary.stats
+        return simulation_response(execute_simulation(config, **options))
 
-        sample_statistics_dict = sim_results.summary.run_summary.sample_stats
+    except Exception as e:
+        return error_response(e)
 
-        return jsonify({'simulation_plot': str(comparison_plot_base64)
-                        ,"cash_appreciation_plot" : str(cash_appreciation_plot_base64)
-                        ,"prices_plot": str(prices_plot_base64)
-                        ,'sample_portfolio_plot': str(single_portfolio_ts_plot_base64)
-                       ,'summary':statistics_dict
-                       ,'sample_portfolio_summary': sample_statistics_dict
-                       })
 
+@api_backend.route('/jobs/simulation', methods=['POST'])
+def submit_simulation_job():
+    try:
+        params_json = request.json
+        validate_input(params_json)
+        options = response_options(request.args)
+        job = job_queue.submit(simulation_job, params_json, name='simulation', **options)
+        return jsonify(job.to_dict()), 202
+    except jobs.QueueFull as e:
+        return error_response(e, 429)
     except Exception as e:
-        if 'debug' in request.args.keys() and request.args['debug']=='true':
-            return jsonify({'trace': traceback.format_exc()})
-        else:
-            return jsonify({'error': str(e)})
+        return error_response(e, 400)
+
+
+@api_backend.route('/jobs', methods=['GET'])
+def job_queue_stats():
+    return jsonify(job_queue.stats())
+
+
+@api_backend.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    try:
+        return jsonify(job_queue.get(job_id).to_dict())
+    except jobs.JobNotFound as e:
+        return error_response(e, 404)
+
+
+@api_backend.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    '''
+    Server-Sent Events stream of the job stage and progress, closed when the job is finished
+    '''
+    try:
+        job = job_queue.get(job_id)
+    except jobs.JobNotFound as e:
+        return error_response(e, 404)
+
+    def stream():
+        last_state = None
+        while True:
+            state = job.to_dict()
+            if (state['status'],state['stage'],state['progress']) != last_state:
+                last_state = (state['status'],state['stage'],state['progress'])
+                yield f'event: progress\ndata: {json.dumps(state)}\n\n'
+            if job.is_finished:
+                break
+            job.wait(SSE_POLL_INTERVAL)
+        yield f'event: end\ndata: {json.dumps(job.to_dict())}\n\n'
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream'
+                    ,headers={'Cache-Control':'no-cache','X-Accel-Buffering':'no'})
+
+
+@api_backend.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    try:
+        job = job_queue.get(job_id)
+        if job.status == jobs.JobStatus.DONE:
+            return simulation_response(job.result)
+        elif job.status == jobs.JobStatus.FAILED:
+            if 'debug' in request.args.keys() and request.args['debug']=='true':
+                return jsonify({'trace': job.trace}), 500
+            return jsonify(job.to_dict()), 500
+        elif job.status == jobs.JobStatus.CANCELLED:
+            return jsonify(job.to_dict()), 410
+        #not ready yet
+        return jsonify(job.to_dict()), 409
+    except jobs.JobNotFound as e:
+        return error_response(e, 404)
+
+
+@api_backend.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    try:
+        return jsonify(job_queue.cancel(job_id).to_dict())
+    except jobs.JobNotFound as e:
+        return error_response(e, 404)
 
 
 if __name__ == '__main__':
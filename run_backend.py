@@ -1,13 +1,17 @@
 from run_gui import *
 from run_api import *
+from mc import serving
 from multiprocessing import Process
 import argparse
 def parse_args_port():
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", default=7861, help="port for the api_backend")
     parser.add_argument("--services", default='all', help="what services to run")
+    parser.add_argument("--serve", default='dev', choices=['dev','production'], help="flask development server or multi-worker gunicorn server")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_WORKERS',serving.DEFAULT_WEB_WORKERS)), help="api worker processes in production mode, background jobs need a single worker")
+    parser.add_argument("--sim-workers", type=int, default=int(os.environ.get('SIM_WORKERS',serving.DEFAULT_SIM_WORKERS)), help="simulation worker processes per api worker in production mode")
     args = parser.parse_known_args()
-    return args[0].port, args[0].services
+    return args[0]
 
 def run_gradio():
     with warnings.catch_warnings():
@@ -22,13 +26,19 @@ def run_gradio():
 def run_flask(port):
     api_backend.run(host="0.0.0.0",port=port, debug=False)
 
+def run_production(port, workers, sim_workers):
+    use_simulation_pool(sim_workers)
+    serving.serve_production(api_backend, port=int(port), workers=workers)
+
 if __name__ == "__main__":
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        flask_port , services = parse_args_port()
+        args = parse_args_port()
         
-        if services == 'all':
-            flask_process = Process(target=run_flask,args=(flask_port,))
+        if args.services == 'all' and args.serve == 'production':
+            flask_process = Process(target=run_production,args=(args.port,args.workers,args.sim_workers))
+        elif args.services == 'all':
+            flask_process = Process(target=run_flask,args=(args.port,))
         else:
             flask_process = None
 
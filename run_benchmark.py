@@ -0,0 +1,61 @@
+import matplotlib , warnings
+matplotlib.use('Agg')
+import argparse
+import sys
+from mc import benchmark
+
+
+def parse_sizes(sizes:str):
+    '''
+    parse `100x365,1000x365` into [(100,365),(1000,365)]
+    '''
+    return [tuple(int(v) for v in size.split('x')) for size in sizes.split(',')]
+
+def run(args):
+    results = benchmark.run_benchmarks(sizes=parse_sizes(args.sizes) if args.sizes else None
+                                    ,repeat=args.repeat
+                                    ,cases=args.cases.split(',') if args.cases else None
+                                    )
+    path = benchmark.save_results(results,args.output or benchmark.default_results_path())
+    print('benchmark results saved to ',path)
+
+def compare(args):
+    comparisons = benchmark.compare_results(benchmark.load_results(args.baseline)
+                                            ,benchmark.load_results(args.current)
+                                            ,threshold=args.threshold
+                                            ,metric=args.metric
+                                            )
+    for comparison in comparisons:
+        print(comparison)
+
+    regressions = [c for c in comparisons if c.regression]
+    if len(regressions)>0:
+        print(f'{len(regressions)} regression(s) above {100*args.threshold}%')
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command',required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark suite')
+    run_parser.add_argument("--sizes", default=None, help="comma separated NxT grid, e.g. 100x365,1000x365")
+    run_parser.add_argument("--repeat", default=3, type=int, help="number of timed repetitions per case")
+    run_parser.add_argument("--cases", default=None, help="comma separated substrings to filter case names")
+    run_parser.add_argument("--output", default=None, help="path of the results json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two benchmark results')
+    compare_parser.add_argument("baseline", help="baseline results json")
+    compare_parser.add_argument("current", help="current results json")
+    compare_parser.add_argument("--threshold", default=benchmark.DEFAULT_THRESHOLD, type=float, help="relative slowdown flagged as regression")
+    compare_parser.add_argument("--metric", default='min', choices=['min','median','mean'], help="timing statistic to compare")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        main()
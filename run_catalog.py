@@ -0,0 +1,43 @@
+from mc import catalog
+import argparse
+import pandas as pd
+
+
+def main():
+    parser = argparse.ArgumentParser(description='query the catalog of saved runs under data/runs')
+    parser.add_argument('--catalog', default=None, help='catalog file, default data/runs/catalog.sqlite')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = subparsers.add_parser('query', help='list the runs matching a SQL condition')
+    query_parser.add_argument('--where', default=None, help="e.g. \"ticker_name = 'ETH' AND percent_allocated = 0.5 AND Sharpe > 1\"")
+    query_parser.add_argument('--columns', default=None, help='comma separated columns to show')
+    query_parser.add_argument('--order-by', default=None, help='e.g. "Sharpe DESC"')
+    query_parser.add_argument('--limit', type=int, default=None)
+
+    subparsers.add_parser('columns', help='list the catalog columns')
+
+    show_parser = subparsers.add_parser('show', help='show a run and the arrays stored for it')
+    show_parser.add_argument('run_id')
+
+    rebuild_parser = subparsers.add_parser('rebuild', help='index the run folders already on disk')
+    rebuild_parser.add_argument('--runs-dir', default=None)
+
+    args = parser.parse_args()
+    run_catalog = catalog.RunCatalog(args.catalog)
+
+    if args.command == 'query':
+        columns = args.columns.split(',') if args.columns else None
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(run_catalog.query(args.where, columns=columns, order_by=args.order_by, limit=args.limit))
+    elif args.command == 'columns':
+        print('\n'.join(run_catalog.columns))
+    elif args.command == 'show':
+        for k, v in run_catalog.get(args.run_id).items():
+            print(f'{k}: {v}')
+        print(run_catalog.load(args.run_id))
+    elif args.command == 'rebuild':
+        print('runs indexed:', run_catalog.rebuild(args.runs_dir))
+
+
+if __name__ == '__main__':
+    main()
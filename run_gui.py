@@ -1,13 +1,22 @@
 from collections import namedtuple
+import pandas as pd
 from dataclasses import asdict
 from typing import List
 import matplotlib , warnings
 matplotlib.use('Agg')
 import gradio as gr
-from mc import utils , engine,series_gen , names , data_source
+from mc import utils , engine,series_gen , names , data_source , calibration
 import os
 
 market_data = data_source.load_market_data(lookback_days=30)
+#history the return model sliders are fitted to
+CALIBRATION_LOOKBACK_DAYS = 365
+#models fitted for every ticker in the background at startup, the ticker callback only looks the fits up
+CALIBRATED_MODELS = ('Lognormal Random Walk','Generalized Hyperbolic')
+calibration_warm_up = calibration.warm(names.market_symbols(),CALIBRATED_MODELS,CALIBRATION_LOOKBACK_DAYS)
+#adaptive runs: N is the batch size, sampling stops at the tolerance or these limits
+ADAPTIVE_MAX_PATHS = 10000
+ADAPTIVE_TIME_BUDGET = 60
 
 
 APP_VERSION = os.environ.get('APP_VERSION','no-version-provided')
@@ -17,6 +26,42 @@ def hide_plot():
     
     gr.DataFrame.update(visible=False)
     
+#(min, max) of the sliders the fitted return model params are written to
+PARAM_RANGES = dict(mu=(-0.01, 0.01)
+                    ,sigma=(0.01, 0.99)
+                    ,alpha=(0.01, 20.0)
+                    ,beta=(-1.0, 1.0)
+                    ,delta=(0.0001, 1.0)
+                    ,lambda_=(-10.0, 0.0))
+
+def fitted_value(symbol:str,name:str,value:float):
+    '''
+    Slider update of a fitted param, clipped to the slider range with a warning when the fit falls outside it
+    '''
+    low, high = PARAM_RANGES[name]
+    clipped = min(max(value,low),high)
+    if clipped != value:
+        print(f'{symbol}: fitted {name}={value} is outside the slider range, using {clipped}')
+        #toast in the page where the installed gradio supports it
+        if hasattr(gr,'Warning'): gr.Warning(f'{symbol}: fitted {name}={value:.4g} is outside [{low}, {high}], set to {clipped}')
+    return gr.update(value=clipped)
+
+def prefill_params(symbol:str):
+    '''
+    Drift, volatility and GH slider values fitted to the ticker history by the startup warm up (a cache lookup),
+    the market data volatility while the fits are not ready or when the history cannot be loaded
+    '''
+    lognormal, gh = [calibration.cached_calibration(symbol,model,CALIBRATION_LOOKBACK_DAYS) for model in CALIBRATED_MODELS]
+    if lognormal is None or gh is None:
+        print(f'{symbol}: calibration is not available yet, using the market data volatility')
+        return (gr.update(),fitted_value(symbol,'sigma',market_data[symbol].volatility)) + (gr.update(),)*4
+    return (fitted_value(symbol,'mu',lognormal['mu'])
+            ,fitted_value(symbol,'sigma',lognormal['sigma'])
+            ,fitted_value(symbol,'alpha',gh['alpha'])
+            ,fitted_value(symbol,'beta',gh['beta'])
+            ,fitted_value(symbol,'delta',gh['delta'])
+            ,fitted_value(symbol,'lambda_',gh['lambda_']))
+
 def run_mcs_engine(data_mode:str
                    ,ticker_name:str
                 ,return_function:str
@@ -37,6 +82,9 @@ def run_mcs_engine(data_mode:str
                 ,option_duration:int
                 ,all_series_backtest:bool
                 ,show_legend:bool
+                ,adaptive:bool
+                ,tolerance:float
+                ,progress=gr.Progress()
                 ):
     
     #lookup N
@@ -58,22 +106,24 @@ def run_mcs_engine(data_mode:str
                                                             ,option_duration=utils.OPTION_EXPIRATION[option_duration]
                                                             ,amount_multiple = utils.AMOUNT_DICT[investment_amount] /market_data[ticker_name].current_price
                                                             ,all_series_backtest=all_series_backtest
-                            ))
+                            )
+                            ,adaptive=dict(tolerance=tolerance,batch_paths=N,max_paths=ADAPTIVE_MAX_PATHS,time_budget=ADAPTIVE_TIME_BUDGET) if adaptive else None)
                           
     print('starting simulations...\nrun parameters:',asdict(config))
-    sim_results = (engine.MCSEngine(config)
-                    .run()
-                  )
+    #the figures may be shared with coalesced callers: the legend option is applied by the shared run
+    sim_results = engine.run_coalesced(config
+                                       ,progress=lambda stage, fraction: progress(fraction, desc=stage.replace('_',' '))
+                                       ,show_legend=show_legend)
     comparison_plot_data_fig = sim_results.plots.comparison_plot_data_ply.fig
     portfolio_plot_fig  = sim_results.plots.portfolio_plot_ply.fig
     cash_capitalization_plot_fig = sim_results.plots.cash_appreciation_plot_ply.fig
-    if not show_legend:
-        ax = comparison_plot_data_fig.gca()
-        ax.get_legend().remove()
+    stats_df = sim_results.summary.run_summary.stats_df
+    if sim_results.precision is not None:
+        stats_df = pd.concat([stats_df,sim_results.precision.stats_df],ignore_index=True)
     return (comparison_plot_data_fig
             , portfolio_plot_fig
             , cash_capitalization_plot_fig
-            , sim_results.summary.run_summary.stats_df)
+            , stats_df)
 
 with gr.Blocks(title='WAD Simulator') as front_page:
     gr.Markdown(
@@ -83,7 +133,7 @@ with gr.Blocks(title='WAD Simulator') as front_page:
     """)
     with gr.Row():
         with gr.Column():
-            data_mode = gr.Dropdown(['simulation','backtest'],value='simulation', label="Run Mode",info='Use `simulation` for forward-looking analysis or `backtest` for historical analysis')
+            data_mode = gr.Dropdown(['simulation','backtest','rolling_backtest'],value='simulation', label="Run Mode",info='Use `simulation` for forward-looking analysis, `backtest` for historical analysis or `rolling_backtest` for every T-day window of the history')
             all_series_backtest = gr.Checkbox(label="Backtest all Series",value=False)
             ticker_name = gr.Dropdown(names.market_symbols(), label="Ticker",info='Select ticker')
         with gr.Column():
@@ -96,16 +146,18 @@ with gr.Blocks(title='WAD Simulator') as front_page:
     with gr.Row():
         with gr.Column():
             return_function = gr.Dropdown(list(series_gen.RETURN_FUNCTIONS.keys()),value='Lognormal Random Walk', label="Return Function",info='What function to use to estimation price trajectories')
-            mu = gr.Slider(0.00, 0.99,value=0.0,step=0.001, label="Market Drift",info='How much drift (annualized) we expected in future')
-            sigma = gr.Slider(0.01, 0.99,value=0.24,step=0.001, label="Market Volatility",info='How much volatility (annualized) we expected in future')
+            mu = gr.Slider(*PARAM_RANGES['mu'],value=0.0,step=0.00001, label="Market Drift",info='How much drift (daily, per step) we expected in future')
+            sigma = gr.Slider(*PARAM_RANGES['sigma'],value=0.24,step=0.001, label="Market Volatility",info='How much volatility (annualized) we expected in future')
             
-            alpha = gr.Slider(0.01, 20.0,value=0.2444,step=0.0001, label="Alpha GHB",info='')
-            beta = gr.Slider(0.001, 1.0,value=0.053,step=0.001, label="Beta GHB",info='')
-            delta = gr.Slider(0.0001, 0.0,value=0.0003,step=0.0001, label="Delta GHB",info='')
-            lambda_ = gr.Slider(-2.01, 0.0,value=-0.52,step=0.001, label="Lambda GHB",info='')
+            alpha = gr.Slider(*PARAM_RANGES['alpha'],value=0.2444,step=0.0001, label="Alpha GHB",info='')
+            beta = gr.Slider(*PARAM_RANGES['beta'],value=0.053,step=0.001, label="Beta GHB",info='')
+            delta = gr.Slider(*PARAM_RANGES['delta'],value=0.0003,step=0.0001, label="Delta GHB",info='')
+            lambda_ = gr.Slider(*PARAM_RANGES['lambda_'],value=-0.52,step=0.001, label="Lambda GHB",info='')
             
             
             N = gr.Slider(2, 1000,value=50, label="Nunber of Simulations",info='Number of independent tragectories to to generate.')
+            adaptive = gr.Checkbox(label="Adaptive Number of Simulations",value=False,info='Simulate batches of N trajectories until the stats reach the tolerance')
+            tolerance = gr.Slider(0.0005, 0.05,value=0.005,step=0.0005, label="Tolerance",info='Standard error of E(R), Total VaR and P(losing <30%) to reach in adaptive runs')
             percent_allocated = gr.Slider(0.01, 0.99,value=0.5, label="Percent Allocated",info='Percent of cappital to allocate into the asset')
             # T = gr.Slider(365, 36500,value=365, label="T")
             T = gr.Radio(list(utils.TIME_INTERVAL_DICT.keys()),value='1y', label="Investment Horizon", info="The duration of the investment")
@@ -150,7 +202,7 @@ with gr.Blocks(title='WAD Simulator') as front_page:
             cash_capitalization_plot = gr.Plot(label="Cash Capitalization")
     
     dep = front_page.load(hide_plot, None,None)
-    ticker_name.change(fn=lambda symbol: gr.update(value=market_data[symbol].volatility), inputs=ticker_name, outputs=sigma)
+    ticker_name.change(fn=prefill_params, inputs=ticker_name, outputs=[mu,sigma,alpha,beta,delta,lambda_])
 
     run_button.click(
         run_mcs_engine,inputs=[data_mode,ticker_name,return_function,
@@ -170,7 +222,9 @@ with gr.Blocks(title='WAD Simulator') as front_page:
             option_every_itervals,
             option_duration,
             all_series_backtest,
-            show_legend
+            show_legend,
+            adaptive,
+            tolerance
             
             ]
             ,outputs=[res_plot,portfolio_plot,cash_capitalization_plot,summary_stat],
@@ -20,6 +20,9 @@ def assemble_input_params(config_name='config.json')->utils.Config:
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", default='config.json', help="config file name")
+    parser.add_argument("--trace", action='store_true', help="save per-stage timings as a chrome trace")
+    parser.add_argument("--chunk-paths", type=int, default=None, help="store the arrays in chunks of this many paths")
+    parser.add_argument("--compress", action='store_true', help="compress the stored arrays (not memory-mappable)")
     args = parser.parse_known_args()
     config,env = assemble_input_params(config_name=args[0].config)
 
@@ -30,29 +33,39 @@ def main():
     
 
     #save data
-    plotting.save_plot(sim_results.plots.prices_plot,file_name= env.PLOT_TS)
-    plotting.save_plot(sim_results.plots.prices_plot_ply,file_name= env.PLOT_TS_PLY)
-    plotting.save_plot(sim_results.plots.portfolio_plot,file_name= env.PLOT_PORTFOLIO)
+    with sim_results.timings.stage('png_encoding'):
+        plotting.save_plot(sim_results.plots.prices_plot,file_name= env.PLOT_TS)
+        plotting.save_plot(sim_results.plots.prices_plot_ply,file_name= env.PLOT_TS_PLY)
+        plotting.save_plot(sim_results.plots.portfolio_plot,file_name= env.PLOT_PORTFOLIO)
 
-    plotting.save_plot(sim_results.plots.single_portfolio_ts_plot_ply,file_name= env.PLOT_SINGLE_PORTFOLIO)
+        plotting.save_plot(sim_results.plots.single_portfolio_ts_plot_ply,file_name= env.PLOT_SINGLE_PORTFOLIO)
 
     
-    plotting.save_plot(sim_results.plots.comparison_plot_data,file_name= env.PLOT_COMPARISON)
-    plotting.save_plot(sim_results.plots.baseline_only_plot_data,file_name= env.PLOT_BASELINEONLY)
-    plotting.save_plot(sim_results.plots.histigrams_plot,file_name= env.PLOT_HISTOGRAMS)
+        plotting.save_plot(sim_results.plots.comparison_plot_data,file_name= env.PLOT_COMPARISON)
+        plotting.save_plot(sim_results.plots.baseline_only_plot_data,file_name= env.PLOT_BASELINEONLY)
+        plotting.save_plot(sim_results.plots.histigrams_plot,file_name= env.PLOT_HISTOGRAMS)
 
-    plotting.save_plot(sim_results.plots.cash_appreciation_plot,file_name= env.CASH_APPRECIATION)
+        plotting.save_plot(sim_results.plots.cash_appreciation_plot,file_name= env.CASH_APPRECIATION)
     
-    plotting.save_plot(sim_results.plots.comparison_plot_data_ply,file_name= env.PLOT_COMPARISON_PLY)
+        plotting.save_plot(sim_results.plots.comparison_plot_data_ply,file_name= env.PLOT_COMPARISON_PLY)
     
 
 
     utils.save_data(env,sim_results.series.sim_res
-                    ,sim_results.series.allocated_capital)
+                    ,sim_results.series.allocated_capital
+                    ,config=config
+                    ,chunk_paths=args[0].chunk_paths
+                    ,compress=args[0].compress
+                    ,stats=sim_results.summary.run_summary.stats
+                    ,weights=sim_results.series.weights)
 
-    utils.save_stats_to_csv(sim_results.summary.run_summary,env.STATS_CSV)
+    utils.save_stats_to_csv(sim_results.summary.run_summary,env.STATS_CSV,timings=sim_results.timings,precision=sim_results.precision)
     utils.save_config_to_csv(config,env.CONFIG_CSV)
 
+    print('run timings:\n',sim_results.timings)
+    if args[0].trace:
+        sim_results.timings.save_chrome_trace(env.TIMINGS_TRACE)
+
 
 
 if __name__ == "__main__":
@@ -3,7 +3,12 @@ import sys , os
 
 sys.path.append( os.path.abspath(os.path.curdir))
 import unittest
+import threading
+import warnings
+import time
+import json
 import numpy as np
+import ccxt
 
 import mc.executor as simulator
 import mc.analysis as analysis
@@ -13,7 +18,8 @@ from mc.assets import *
 from mc.pricing import *
 from mc.data_source import *
 from mc.series_gen import *
-from mc import constants
+from mc import constants, utils, benchmark, profiling, jobs, progress, engine, payloads, overnight, wad_engine, serving, coalescing, store, catalog, multi_asset, data_source, calibration, names
+import run_api
 
 env = Env().create_test_env()
 
@@ -59,6 +65,45 @@ class TestPricingClass(unittest.TestCase):
         
         self.assertTrue(initial_price<price_after_t)
 
+    def test_pricing_context(self):
+        volatility =0.25
+        risk_free_rate= 0.04
+        context = pricing_context(volatility,risk_free_rate)
+        self.assertIs(context, pricing_context(volatility,risk_free_rate))
+
+        for strike, option_type in [(110.,OptionType.CALL),(90.,OptionType.PUT)]:
+            expected = create_option(100.,strike, 31, volatility, risk_free_rate, option_type).NPV()
+            self.assertAlmostEqual(context.price(100.,strike,31,option_type), expected)
+
+        #evaluation date moved elsewhere is restored for the context
+        expected = create_option(100.,110., 31, volatility, risk_free_rate, OptionType.CALL).NPV()
+        ql.Settings.instance().evaluationDate = context.eval_date + ql.Period(10, ql.Days)
+        self.assertAlmostEqual(context.price(100.,110.,31,OptionType.CALL), expected)
+
+        #a new day gets its own context, the cached one does not pin the evaluation date to the day it was built
+        tomorrow = evaluation_date() + 1
+        next_day = pricing_context(volatility,risk_free_rate,eval_date=tomorrow)
+        self.assertIsNot(next_day, context)
+        self.assertEqual(next_day.eval_date, ql.Date(tomorrow))
+        next_day.price(100.,110.,31,OptionType.CALL)
+        self.assertEqual(ql.Settings.instance().evaluationDate, ql.Date(tomorrow))
+        self.assertIs(context, pricing_context(volatility,risk_free_rate))
+
+    def test_premium_per_notional_cache(self):
+        volatility =0.35
+        risk_free_rate= 0.03
+        premium_per_notional.cache_clear()
+        premiums = [option_premium(spot, spot * 1.07, 25, volatility, risk_free_rate, OptionType.CALL) for spot in [100.,250.,1234.5]]
+
+        cache_info = premium_per_notional.cache_info()
+        self.assertEqual(cache_info.misses,1)
+        self.assertEqual(cache_info.hits,2)
+        self.assertLessEqual(cache_info.currsize,PREMIUM_CACHE_SIZE)
+
+        expected = create_option(250.,250. * 1.07, 25, volatility, risk_free_rate, OptionType.CALL).NPV()
+        self.assertAlmostEqual(premiums[1], expected)
+        self.assertAlmostEqual(premiums[2] / premiums[0], 12.345)
+
     # def test_option_pricing_price_not_change(self):
     #     spot_price =110
     #     strike = 100
@@ -349,6 +394,16 @@ class TestPortfolioClass(unittest.TestCase):
 
         new_share = trader.portfolio.share_balance
         self.assertTrue( np.isclose(new_share.cash, new_share.equity))
+
+    def test_marked_value(self):
+        trader = initialize_executors(n=1,return_function_params=self.ts_params,strategy_params=self.split_params)[0]
+        value = trader.portfolio.value
+        trader.write_strangle(self.asset_ticker,pct_from_strike=0.1,t=30,price=self.initial_price,amount=0.2)
+        mark = trader.portfolio.option_book.mark_to_market(1,self.asset_ticker,self.initial_price)
+        #the written strangle is a liability of the marked value, the rebalancing base stays cash and equity
+        self.assertLess(mark,0.)
+        self.assertEqual(trader.portfolio.value,value)
+        self.assertAlmostEqual(trader.portfolio.marked_value,value+mark)
 class TestExecutorClass(unittest.TestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -378,6 +433,21 @@ class TestExecutorClass(unittest.TestCase):
 
         self.time_series_sudden_drop_and_bounce_back = np.array([[1.,1.10,1.2,1.22,0.49,0.25,0.24,0.28,0.95]])
 
+    def test_progress_reporting(self):
+        reports = []
+        portfolios = initialize_executors(n=4,return_function_params=self.ts_params,strategy_params=self.split_params)
+        time_series = np.repeat(self.time_series,4,axis=0)
+        (simulator
+            .SimulationTracker(time_series,portfolios,self.split_params)
+            .run_simulations(progress=lambda stage, fraction: reports.append((stage,fraction)),stage='strategy_execution')
+            )
+        self.assertEqual(reports,[('strategy_execution',f) for f in [0.0,0.25,0.5,0.75,1.0]])
+
+        reports = []
+        generate_time_series(200,5,1.0,log_normal_return,dict(mu=0.,sigma=0.1),progress=lambda stage, fraction: reports.append((stage,fraction)))
+        self.assertLessEqual(len(reports),progress.DEFAULT_CHUNKS+2)
+        self.assertEqual(reports[-1],('path_generation',1.0))
+
     def test_price_tracker_5050_no_rebalance(self):
         portfolios = initialize_executors(n=1,return_function_params=self.ts_params,strategy_params=self.split_params)
         sim_tracker = simulator.SimulationTracker(self.time_series,portfolios,self.split_params)
@@ -428,6 +498,24 @@ class TestExecutorClass(unittest.TestCase):
         
         cum_returns = calculator.sim_cum_retuns
         pass
+
+    def test_option_mark_to_market(self):
+        traders = initialize_executors(n=1,return_function_params=self.ts_params,strategy_params=self.options_params)
+        sim_tracker = (simulator
+                        .SimulationTracker(self.time_series_sudden_drop_and_bounce_back,traders,self.options_params)
+                        .run_simulations()
+                        )
+        options_value = sim_tracker.allocated_capital[0,:,utils.ASSET_INDEX['options']]
+
+        #strangle written at t=3 and assigned at t=5
+        self.assertLessEqual(options_value[3],0.0)
+        self.assertLess(options_value[4],0.0)
+        self.assertEqual(options_value[5],0.0)
+
+        #premium collected is offset by the written liability on the writing day
+        cash_idx = utils.ASSET_INDEX['cash']
+        premium = sim_tracker.allocated_capital[0,3,cash_idx] - sim_tracker.allocated_capital[0,2,cash_idx]
+        self.assertAlmostEqual(options_value[3], -premium, places=6)
 class TestDecigionLogic(unittest.TestCase):
     def test_threshold_below(self):
         
@@ -441,10 +529,28 @@ class TestDecigionLogic(unittest.TestCase):
 
 
 class TestBSMOptionPricer(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.spot_price = 100.
+        self.strikes = np.array([90.,100.,110.])
+        self.maturity = 31
+        self.volatility = 0.25
+        self.risk_free_rate = 0.04
+
+    def _ql_prices(self,option_type):
+        return np.array([create_option(self.spot_price,k, self.maturity, self.volatility, self.risk_free_rate, option_type).NPV() for k in self.strikes])
+
     def test_price_call(self):
-        pass
+        prices = black_scholes_price(self.spot_price,self.strikes,self.maturity,self.volatility,self.risk_free_rate,is_call=True)
+        self.assertTrue(np.allclose(prices,self._ql_prices(OptionType.CALL),rtol=1e-2))
+
     def test_price_put(self):
-        pass
+        prices = black_scholes_price(self.spot_price,self.strikes,self.maturity,self.volatility,self.risk_free_rate,is_call=False)
+        self.assertTrue(np.allclose(prices,self._ql_prices(OptionType.PUT),rtol=1e-2))
+
+    def test_price_expired(self):
+        prices = black_scholes_price(self.spot_price,self.strikes,0,self.volatility,self.risk_free_rate,is_call=np.array([True,True,False]))
+        self.assertTrue(np.allclose(prices,[10.,0.,10.]))
 
 
 class TestDataLoader(unittest.TestCase):
@@ -456,6 +562,719 @@ class TestDataLoader(unittest.TestCase):
 
 
 
+class TestBenchmark(unittest.TestCase):
+    def _results(self,timings):
+        return dict(metadata=benchmark.machine_metadata()
+                    ,results=[benchmark.BenchmarkResult(name=name,N=10,T=365,repeat=1,min=t,median=t,mean=t)._asdict() for name,t in timings.items()])
+
+    def test_compare_flags_regressions(self):
+        baseline = self._results({'engine:run':1.0,'executor:options':0.5,'analysis:returns_stats':0.1})
+        current = self._results({'engine:run':1.05,'executor:options':0.8})
+
+        comparisons = {c.key:c for c in benchmark.compare_results(baseline,current,threshold=0.1)}
+        self.assertEqual(len(comparisons),2)
+        self.assertFalse(comparisons['engine:run[N=10,T=365]'].regression)
+        self.assertTrue(comparisons['executor:options[N=10,T=365]'].regression)
+
+    def test_run_benchmarks(self):
+        results = benchmark.run_benchmarks(sizes=[(2,30)],repeat=1,cases=['analysis'],verbose=False)
+        self.assertEqual([r['name'] for r in results['results']],['analysis:returns_stats'])
+        self.assertIn('cpu_count',results['metadata'])
+
+
+class TestStageTimings(unittest.TestCase):
+    def test_stage_timings(self):
+        timings = profiling.StageTimings(trace_memory=True)
+        with timings.stage('path_generation'):
+            np.ones((1000,1000))
+        with timings.stage('stats'):
+            pass
+
+        self.assertEqual([s.name for s in timings.stages],['path_generation','stats'])
+        self.assertGreater(timings.stages[0].peak_memory_added_mb,7.0)
+        self.assertLess(timings.stages[1].peak_memory_added_mb,1.0)
+        self.assertIn('stats wall time, s',timings.to_stats())
+
+        trace = timings.to_chrome_trace()
+        self.assertEqual(len(trace['traceEvents']),2)
+        self.assertLessEqual(trace['traceEvents'][0]['ts']+trace['traceEvents'][0]['dur'],trace['traceEvents'][1]['ts'])
+
+        #untraced: the growth of the process high-water mark, not the mark itself
+        held = np.ones((4000,4000))
+        timings = profiling.StageTimings()
+        with timings.stage('stats'):
+            pass
+        self.assertLess(timings.stages[0].peak_memory_added_mb,held.nbytes/1024.**2)
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.queue = jobs.JobQueue(max_workers=1,max_queue_depth=1)
+        self.release = threading.Event()
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.queue.shutdown()
+        super().tearDown()
+
+    def _blocking_job(self,job):
+        while not self.release.wait(0.01):
+            job.check_cancelled()
+        return 'done'
+
+    def test_submit_and_result(self):
+        job = self.queue.submit(lambda job, x: x * 2, 21)
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.status,jobs.JobStatus.DONE)
+        self.assertEqual(job.result,42)
+
+    def test_failed_job(self):
+        job = self.queue.submit(lambda job: 1/0)
+        job.wait(5)
+        self.assertEqual(job.status,jobs.JobStatus.FAILED)
+        self.assertIn('division',job.error)
+
+    def test_queue_depth_and_cancel(self):
+        running = self.queue.submit(self._blocking_job)
+        while running.status != jobs.JobStatus.RUNNING: time.sleep(0.01)
+        queued = self.queue.submit(self._blocking_job)
+        with self.assertRaises(jobs.QueueFull):
+            self.queue.submit(self._blocking_job)
+
+        self.queue.cancel(queued.id)
+        self.assertEqual(queued.status,jobs.JobStatus.CANCELLED)
+
+        self.queue.cancel(running.id)
+        self.assertTrue(running.wait(5))
+        self.assertEqual(running.status,jobs.JobStatus.CANCELLED)
+
+        with self.assertRaises(jobs.JobNotFound):
+            self.queue.get('missing')
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_run(self):
+        flights = coalescing.SingleFlight()
+        release, calls, results = threading.Event(), [], []
+
+        def run(progress):
+            calls.append(1)
+            progress('path_generation',0.5)
+            release.wait(5)
+            return object()
+
+        threads = [threading.Thread(target=lambda: results.append(flights.run('key',run))) for _ in range(3)]
+        for t in threads: t.start()
+        while flights.coalesced < 2: time.sleep(0.01)
+        release.set()
+        for t in threads: t.join(5)
+
+        self.assertEqual(len(calls),1)
+        self.assertEqual(len(results),3)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(flights.in_flight,0)
+
+    def test_config_key(self):
+        config = benchmark._config(5,30)
+        self.assertEqual(coalescing.config_key(config),coalescing.config_key(benchmark._config(5,30)))
+        config.seed = 1
+        self.assertNotEqual(coalescing.config_key(config),coalescing.config_key(benchmark._config(5,30)))
+        self.assertNotEqual(coalescing.config_key(config,response_format='npz'),coalescing.config_key(config))
+
+    def test_seeded_engine_is_reproducible(self):
+        config = benchmark._config(4,30)
+        config.seed = 42
+        first = engine.MCSEngine(config).run(render_plots=False)
+        second = engine.MCSEngine(config).run(render_plots=False)
+        self.assertTrue(np.array_equal(first.series.sim_res,second.series.sim_res))
+
+    def test_render_options_are_keyed(self):
+        config = benchmark._config(4,30)
+        config.seed = 1
+        hidden = engine.run_coalesced(config,show_legend=False)
+        shown = engine.run_coalesced(config,show_legend=True)
+        self.assertFalse(hidden.plots.comparison_plot_data_ply.fig.layout.showlegend)
+        self.assertIsNot(shown.plots.comparison_plot_data_ply.fig.layout.showlegend,False)
+        self.assertNotEqual(coalescing.config_key(config,render_plots=True,show_legend=False)
+                            ,coalescing.config_key(config,render_plots=True,show_legend=True))
+
+    def test_seeded_runs_leave_global_state(self):
+        config = benchmark._config(4,30)
+        config.seed = 42
+        expected = engine.MCSEngine(config).run(render_plots=False).series.sim_res
+        np.random.seed(0)
+        engine.MCSEngine(benchmark._config(4,30)).run(render_plots=False)
+        unseeded = np.random.random()
+        np.random.seed(0)
+        self.assertEqual(np.random.random(),unseeded)
+
+        #concurrent seeded runs in threads draw from their own generators
+        results = []
+        def run():
+            seeded = benchmark._config(4,30)
+            seeded.seed = 42
+            results.append(engine.MCSEngine(seeded).run(render_plots=False).series.sim_res)
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for t in threads: t.start()
+        for t in threads: t.join(30)
+        self.assertEqual(len(results),3)
+        self.assertTrue(all(np.array_equal(r,expected) for r in results))
+
+
+class TestReducedPrecision(unittest.TestCase):
+    def test_float32_drift(self):
+        results = dict()
+        for dtype in ('float64','float32'):
+            config = benchmark._config(50,120,**benchmark._options_params())
+            config.seed, config.dtype = 11, dtype
+            results[dtype] = engine.MCSEngine(config).run(render_plots=False)
+
+        single = results['float32']
+        self.assertEqual(single.series.sim_res.dtype,np.float32)
+        self.assertEqual(single.series.allocated_capital.dtype,np.float32)
+        self.assertEqual(single.summary.run_summary.sim_cum_retuns.dtype,np.float32)
+
+        self.assertLess(np.max(np.abs(single.series.sim_res/results['float64'].series.sim_res-1)),1e-5)
+        expected = results['float64'].summary.run_summary.stats
+        for name,value in single.summary.run_summary.stats.items():
+            self.assertAlmostEqual(value,expected[name],delta=1e-4,msg=name)
+
+        with self.assertRaises(ValueError):
+            utils.resolve_dtype('int32')
+
+
+class TestSimulationPool(unittest.TestCase):
+    def test_run_relays_progress(self):
+        pool = serving.SimulationPool(max_workers=1)
+        try:
+            reports = []
+            time_series = pool.run(generate_time_series,20,10,1.0,log_normal_return,dict(mu=0.,sigma=0.1)
+                                   ,progress=lambda stage, fraction: reports.append((stage,fraction)))
+            self.assertEqual(time_series.shape,(20,10))
+            self.assertEqual(reports[-1],('path_generation',1.0))
+        finally:
+            pool.shutdown()
+
+
+    def test_warm_pricing(self):
+        config = utils.read_config('default_config.json')
+        config.return_function_params['sigma'] = 0.37
+        config.strategy_function_params.update(option_duration=5,option_straddle_pct_from_strike=0.1,cash_interest=0.04)
+        pricing.premium_per_notional.cache_clear()
+        self.assertEqual(serving.warm_pricing(config),10)
+        hits = pricing.premium_per_notional.cache_info().hits
+        option_premium(100.,110.,3,0.37,0.04,OptionType.CALL)
+        self.assertEqual(pricing.premium_per_notional.cache_info().hits,hits+1)
+        #placeholder sigma of the shipped configs: warmed at the default volatility
+        self.assertGreater(serving.warm_pricing(utils.read_config('default_config.json')),10)
+
+    def test_single_web_worker_by_default(self):
+        #jobs are registered in the accepting worker: one web worker, compute scaled with the pool
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            options = serving.gunicorn_options()
+        self.assertEqual(options['workers'],1)
+        self.assertGreater(serving.DEFAULT_SIM_WORKERS,1)
+        with self.assertWarns(UserWarning):
+            serving.gunicorn_options(workers=4)
+
+
+class TestRunStore(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.sim_res = np.random.rand(10,20)
+        self.allocated_capital = np.random.rand(10,20,3)
+
+    def _save(self,name,**kwargs):
+        folder = os.path.join(env.TESTS_FOLDER,name)
+        store.save_arrays(folder,dict(sim_res=self.sim_res,allocated_capital=self.allocated_capital),config=dict(N=10),seed=3,**kwargs)
+        return store.RunStore(folder)
+
+    def test_memory_mapped(self):
+        run = self._save('store_plain')
+        self.assertEqual(run.seed,3)
+        self.assertEqual(run.shape('allocated_capital'),(10,20,3))
+        series = run.series(paths=(2,5),times=(10,20))
+        self.assertIsInstance(series.sim_res,np.memmap)
+        self.assertTrue(np.array_equal(series.sim_res,self.sim_res[2:5,10:20]))
+        self.assertTrue(np.array_equal(series.allocated_capital,self.allocated_capital[2:5,10:20]))
+
+    def test_chunked_compressed(self):
+        for compress in (False,True):
+            run = self._save(f'store_chunked_{compress}',chunk_paths=4,compress=compress)
+            self.assertEqual(len(run.manifest['arrays']['sim_res']['chunks']),3)
+            self.assertTrue(np.array_equal(run.read('sim_res',paths=(3,9),times=(1,4)),self.sim_res[3:9,1:4]))
+            self.assertTrue(np.array_equal(run['allocated_capital'],self.allocated_capital))
+            self.assertEqual(run.read('sim_res',paths=(20,30)).shape,(0,20))
+
+
+class TestRunCatalog(unittest.TestCase):
+    def test_register_query_load(self):
+        folder = os.path.join(env.TESTS_FOLDER,'catalog')
+        run_catalog = catalog.RunCatalog(os.path.join(folder,catalog.CATALOG_FILE))
+        config = benchmark._config(5,30)
+        for run_id,allocation,sharpe in [('run_a',0.5,1.2),('run_b',0.5,0.3),('run_c',0.8,1.5)]:
+            config.strategy_function_params['percent_allocated'] = allocation
+            store_folder = os.path.join(folder,run_id,'arrays')
+            store.save_arrays(store_folder,dict(sim_res=np.ones((2,3))),config=utils.asdict(config))
+            run_catalog.register(run_id,os.path.join(folder,run_id),config=utils.asdict(config)
+                                 ,stats={'Sharpe':sharpe,'P(losing <30%)':0.9},store_folder=store_folder)
+        run_catalog.register('run_d',os.path.join(folder,'run_d'),stats={'Sortino':2.0})
+
+        runs = run_catalog.query("ticker_name = 'ETH' AND percent_allocated = 0.5 AND Sharpe > 1")
+        self.assertEqual(runs['run_id'].tolist(),['run_a'])
+        self.assertIn('P_losing_30',run_catalog.columns)
+        self.assertIn('Sortino',run_catalog.columns)
+        self.assertEqual(run_catalog.load('run_c')['sim_res'].shape,(2,3))
+        self.assertEqual(catalog.RunCatalog(run_catalog.path).rebuild(folder),3)
+
+
+class TestSeriesBands(unittest.TestCase):
+    def test_matches_numpy(self):
+        ts = np.random.lognormal(size=(101,30))
+        quantiles = analysis.band_quantiles(0.9)
+        self.assertIn(0.1,quantiles)
+        bands = analysis.SeriesBands.from_paths(ts,quantiles)
+        for q in quantiles:
+            self.assertTrue(np.allclose(bands.quantile(q),np.percentile(ts,100*q,axis=0)))
+        from mc import plotting
+        for expected,actual in zip(plotting.get_confidence_interval(ts,p=0.9),bands.normal_interval(0.9)):
+            self.assertTrue(np.allclose(expected,actual))
+        lower,upper = bands.empirical_interval(0.9)
+        self.assertTrue(np.all(lower <= upper))
+
+    def test_memoized(self):
+        returns = analysis.ReturnsCalculator(np.random.rand(20,10,2))
+        self.assertIs(returns.bands((0.5,0.05,0.95)),returns.bands((0.05,0.5,0.95)))
+        self.assertIsNot(returns.bands((0.5,)),returns.bands((0.05,0.5,0.95)))
+        self.assertIsNot(returns.bands((0.5,),'sketch'),returns.bands((0.5,)))
+
+    def test_sketch(self):
+        ts = np.random.lognormal(sigma=0.5,size=(4000,20))
+        exact = analysis.SeriesBands.from_paths(ts,(0.05,0.5,0.95))
+        sketched = analysis.SeriesBands.from_paths(ts,(0.05,0.5,0.95),estimator='sketch',chunk_paths=700)
+        for q in (0.05,0.5,0.95):
+            self.assertTrue(np.allclose(sketched.quantile(q),exact.quantile(q),rtol=0.02))
+        self.assertTrue(np.allclose(sketched.mean,exact.mean) and np.allclose(sketched.std,exact.std))
+
+        merged = analysis.QuantileSketch(20,lower=0.,upper=10.).update(ts[:1500])
+        merged.merge(analysis.QuantileSketch(20,lower=0.,upper=10.).update(ts[1500:]))
+        self.assertEqual(merged.n,4000)
+        self.assertTrue(np.allclose(merged.std,exact.std))
+        self.assertTrue(np.allclose(merged.quantile(0.5),exact.quantile(0.5),rtol=0.02))
+        with self.assertRaises(ValueError):
+            merged.merge(analysis.QuantileSketch(20,lower=0.,upper=5.).update(ts[:10]))
+
+    def test_estimator_interval(self):
+        ts = np.random.lognormal(sigma=1.,size=(500,10))
+        lower,upper = analysis.SeriesBands.from_paths(ts,analysis.band_quantiles(0.95,()),'empirical').interval(0.95)
+        self.assertTrue(np.allclose(lower,np.percentile(ts,5,axis=0)) and np.allclose(upper,np.percentile(ts,95,axis=0)))
+        self.assertEqual(analysis.SeriesBands.from_paths(ts,(),'normal').quantiles,dict())
+        with self.assertRaises(ValueError):
+            analysis.SeriesBands.from_paths(ts,(),'kde')
+
+    def test_run_store_sketch(self):
+        folder = os.path.join(env.TESTS_FOLDER,'store_bands')
+        allocated_capital = np.random.rand(300,15,2)
+        store.save_arrays(folder,dict(allocated_capital=allocated_capital),chunk_paths=100)
+        bands = store.RunStore(folder).bands('allocated_capital',(0.5,),chunk_paths=64)
+        self.assertEqual(bands.n_paths,300)
+        self.assertTrue(np.allclose(bands.mean,allocated_capital.sum(axis=2).mean(axis=0)))
+
+
+class TestPayloads(unittest.TestCase):
+    def test_npz_roundtrip(self):
+        config = benchmark._config(6,40)
+        sim_results = engine.MCSEngine(config).run(render_plots=False)
+        self.assertIsNone(sim_results.plots)
+
+        arrays = payloads.simulation_arrays(sim_results,ci=0.95,sample_paths=3)
+        for compress in (True,False):
+            decoded = payloads.from_npz(payloads.to_npz(arrays,compress=compress))
+            self.assertEqual(set(decoded),set(arrays))
+            self.assertEqual(decoded['portfolio_sample_paths'].shape,(3,40))
+            self.assertEqual(decoded['prices_mean'].dtype,np.float32)
+            self.assertTrue(np.all(decoded['baseline_lower'] <= decoded['baseline_upper']))
+            self.assertEqual(decoded['portfolio_median'].shape,(40,))
+
+        stats = payloads.stats_from_arrays(decoded)
+        self.assertEqual(list(stats),list(sim_results.summary.run_summary.stats))
+
+
+class TestWadCoin(unittest.TestCase):
+    def test_batch_matches_scalar(self):
+        p_t = np.array([1.0,1.05,0.98])
+        minted = np.array([0.,50.,10.])
+        prices = overnight.wad_coin_batch(p_t,1000.,minted,5.,0.0002,1000.)
+        expected = [overnight.wad_coin_variant3(p,1000.,m,5.,0.0002,1000.) for p,m in zip(p_t,minted)]
+        self.assertTrue(np.allclose(prices,expected))
+
+    def test_projection(self):
+        r_path = np.array([0.001,0.002,0.0005])
+        prices = overnight.wad_coin_projection([1.0,2.0],[100.,200.],0.,0.,r_path,100.)
+        self.assertEqual(prices.shape,(2,4))
+        self.assertTrue(np.allclose(prices[:,-1],np.array([1.0,2.0])*np.prod(1+r_path)))
+
+        #the first projected day is the single day model
+        prices = overnight.wad_coin_projection(1.0,100.,10.,3.,r_path,107.)
+        self.assertAlmostEqual(prices[0,1],overnight.wad_coin_variant3(1.0,100.,10.,3.,r_path[0],107.))
+
+        #scalar starting state with per scenario rate paths
+        r_paths = np.array([[0.001,0.002,0.0005],[0.,0.,0.]])
+        prices = overnight.wad_coin_projection(1.0,100.,0.,0.,r_paths,100.)
+        self.assertEqual(prices.shape,(2,4))
+        self.assertTrue(np.allclose(prices[:,-1],np.prod(1+r_paths,axis=1)))
+
+    def test_wad_simulation(self):
+        params = wad_engine.WadSimParams(N=50,T=30,rate_model='CIR',seed=7)
+        sim = wad_engine.run_wad_simulation(params)
+        self.assertEqual(sim.prices.shape,(50,30))
+        self.assertTrue(np.all(sim.rates >= 0))
+        #no flows: the NAV accrues the overnight rate
+        self.assertTrue(np.allclose(sim.prices[:,-1],np.prod(1+sim.rates[:,:-1]/wad_engine.DAYS_PER_YEAR,axis=1)))
+        self.assertIn('E(R)',sim.summary.stats)
+
+        params = wad_engine.WadSimParams(N=50,T=30,mint_mean=1e4,burn_mean=1e4,seed=7)
+        first, second = wad_engine.run_wad_simulation(params), wad_engine.run_wad_simulation(params)
+        self.assertTrue(np.array_equal(first.prices,second.prices))
+        self.assertFalse(np.allclose(first.wads[:,-1],params.number_of_wads))
+
+    def test_wad_simulation_api_is_strict_json(self):
+        #an accruing NAV has no down days, its unbounded Sortino ratio is sent as null
+        def reject(constant): raise ValueError(constant)
+        response = run_api.api_backend.test_client().post('/wadsim',json=dict(seed=1,N=50,T=60))
+        body = json.loads(response.get_data(as_text=True),parse_constant=reject)
+        self.assertIsNone(body['sample_summary']['Sortino Ratio'])
+        self.assertIn('E(R)',body['summary'])
+
+
+class TestBlockBootstrap(unittest.TestCase):
+    def test_indices(self):
+        index = bootstrap_indices(50,40,100,block_size=10,method='circular')
+        self.assertTrue(np.all((np.diff(index,axis=1) % 100 == 1)[:,np.arange(1,40) % 10 != 0]))
+        index = bootstrap_indices(200,40,100,block_size=5)
+        self.assertTrue(index.min() >= 0 and index.max() < 100)
+        continued = (np.diff(index,axis=1) % 100 == 1).mean()
+        self.assertTrue(0.7 < continued < 0.9)
+        with self.assertRaises(ValueError):
+            bootstrap_indices(2,2,10,5,method='iid')
+
+    def test_paths(self):
+        history = np.random.normal(0,0.02,size=300)
+        params = dict(history_returns=history,block_size=15)
+        np.random.seed(5)
+        paths = generate_time_series(100,60,50.,return_functions('Block Bootstrap'),params)
+        np.random.seed(5)
+        self.assertTrue(np.array_equal(paths,block_bootstrap_paths(100,60,50.,params)))
+        self.assertEqual(paths.shape,(100,60))
+        self.assertTrue(np.all(paths[:,0] == 50.))
+        self.assertTrue(np.all(np.isin(np.round(np.diff(np.log(paths),axis=1),12),np.round(history,12))))
+
+
+class TestVolatilityModels(unittest.TestCase):
+    def test_garch(self):
+        np.random.seed(11)
+        params = dict(mu=0.,garch_omega=2e-5,garch_alpha=0.1,garch_beta=0.85)
+        paths = generate_time_series(200,100,10.,return_functions('GARCH(1,1)'),params)
+        self.assertEqual(paths.shape,(200,100))
+        self.assertTrue(np.all(paths[:,0] == 10.))
+        self.assertAlmostEqual(np.diff(np.log(paths),axis=1).var(),2e-5/(1-0.95),delta=1.5e-4)
+
+        fitted = fit_garch(np.diff(np.log(garch_paths(1,4000,1.,params)[0])))
+        self.assertAlmostEqual(fitted['garch_alpha']+fitted['garch_beta'],0.95,delta=0.05)
+        self.assertEqual(garch_params(dict(calibrate=True,history_returns=np.random.normal(0,0.02,500)),10).keys(),fitted.keys())
+
+    def test_regime_switching(self):
+        np.random.seed(12)
+        params = dict(regime_mu_low=0.,regime_mu_high=0.,regime_sigma_low=0.01,regime_sigma_high=0.04,regime_stay_low=0.98,regime_stay_high=0.95)
+        paths = generate_time_series(20,3000,1.,return_functions('Regime Switching'),params)
+        fitted = fit_regime_switching(np.diff(np.log(paths[0])))
+        self.assertAlmostEqual(fitted['regime_sigma_low'],0.01,delta=0.002)
+        self.assertAlmostEqual(fitted['regime_sigma_high'],0.04,delta=0.008)
+        self.assertGreater(fitted['regime_stay_low'],0.9)
+
+
+class TestInnovationSources(unittest.TestCase):
+    def test_brownian_bridge(self):
+        z = np.random.standard_normal((20000,21))
+        increments = brownian_bridge_increments(z)
+        self.assertTrue(np.allclose(increments.sum(axis=1),np.sqrt(21)*z[:,0]))
+        self.assertTrue(np.allclose(np.cov(increments.T),np.eye(21),atol=0.05))
+
+    def test_sobol_converges_faster(self):
+        T, params = 100, dict(mu=0.,sigma=0.8)
+        exact = 100*np.exp((T-1)*params['sigma']**2/T/2)
+        errors = dict(pseudo=[],sobol=[])
+        for seed in range(10):
+            for innovations in errors:
+                np.random.seed(seed)
+                paths = generate_time_series(256,T,100.,log_normal_return,params,innovations=innovations,seed=seed) if innovations == 'sobol' \
+                        else log_normal_paths(256,T,100.,params)
+                errors[innovations].append(paths[:,-1].mean() - exact)
+        rmse = {k: np.sqrt(np.mean(np.square(v))) for k,v in errors.items()}
+        self.assertLess(rmse['sobol'],rmse['pseudo']/3)
+
+    def test_sources(self):
+        gh_params = dict(mu=0.,alpha=0.2444,beta=0.053,delta=0.0003,lambda_=-0.52)
+        for name in ['Normal Random Walk','Generalized Hyperbolic','GARCH(1,1)','Regime Switching']:
+            paths = generate_time_series(64,30,1.,return_functions(name),dict(sigma=0.5,**gh_params),innovations='sobol',seed=2)
+            self.assertEqual(paths.shape,(64,30))
+            self.assertTrue(np.all(np.isfinite(paths)) and np.all(paths >= 0))
+        first = generate_time_series(8,10,1.,log_normal_return,dict(sigma=0.5),innovations='sobol',seed=4)
+        self.assertTrue(np.array_equal(first,generate_time_series(8,10,1.,log_normal_return,dict(sigma=0.5),innovations='sobol',seed=4)))
+        with self.assertRaises(ValueError):
+            generate_time_series(8,10,1.,log_normal_return,dict(),innovations='halton')
+
+
+class TestAdaptivePathCount(unittest.TestCase):
+    def test_accumulators_merge(self):
+        x = np.random.standard_normal(20000)
+        moments, quantile = analysis.MomentAccumulator(), analysis.QuantileAccumulator(0.05)
+        for batch in np.array_split(x,7):
+            moments.merge(analysis.MomentAccumulator().update(batch))
+            quantile.merge(analysis.QuantileAccumulator(0.05).update(batch))
+        self.assertEqual(moments.n,x.size)
+        self.assertAlmostEqual(moments.estimate,x.mean())
+        self.assertAlmostEqual(moments.standard_error,x.std(ddof=1)/np.sqrt(x.size))
+        self.assertAlmostEqual(quantile.estimate,np.percentile(x,5))
+        #asymptotic standard error of a normal 5% quantile
+        expected = np.sqrt(0.05*0.95/x.size)/norm.pdf(norm.ppf(0.05))
+        self.assertAlmostEqual(quantile.standard_error,expected,delta=0.3*expected)
+        self.assertEqual(analysis.QuantileAccumulator(0.05).update(x[:10]).standard_error,float('inf'))
+
+    def test_adaptive_engine(self):
+        config = benchmark._config(20,30)
+        config.seed = 3
+        fixed = engine.MCSEngine(config).run(render_plots=False)
+        self.assertIsNone(fixed.precision)
+
+        config = benchmark._config(20,30)
+        config.seed = 3
+        config.adaptive = dict(tolerance=1e-9,max_paths=50)
+        results = engine.MCSEngine(config).run(render_plots=False)
+        precision = results.precision
+        self.assertEqual((precision.stop_reason,precision.n_paths,precision.batches),('max_paths',50,3))
+        self.assertEqual(results.series.sim_res.shape,(50,30))
+        self.assertEqual(config.return_function_params['N'],50)
+        #the first batch is the fixed run of the same seed
+        self.assertTrue(np.array_equal(results.series.sim_res[:20],fixed.series.sim_res))
+        self.assertAlmostEqual(precision.estimates['E(R)'],results.summary.run_summary.stats['E(R)'])
+        self.assertAlmostEqual(precision.estimates['Total 95% VaR'],results.summary.run_summary.stats['Total 95% VaR'])
+        self.assertIn('E(R) std error',precision.to_stats())
+
+        #the 5% VaR interval needs enough paths below the quantile to be finite
+        config.adaptive = dict(tolerance=10.,batch_paths=200)
+        precision = engine.MCSEngine(config).run(render_plots=False).precision
+        self.assertEqual((precision.stop_reason,precision.n_paths),('tolerance',200))
+        self.assertTrue(precision.converged)
+
+
+class TestImportanceSampling(unittest.TestCase):
+    def test_weighted_stats(self):
+        x = np.random.standard_normal((101,4))
+        for q in (0.,0.05,0.5,1.):
+            self.assertTrue(np.allclose(analysis.weighted_quantile(x,q,np.ones(101)),np.percentile(x,100*q,axis=0)))
+
+        allocated_capital = np.random.lognormal(sigma=0.1,size=(50,30,2))
+        plain = analysis.ReturnsCalculator(allocated_capital).calculate_returns().calculate_stats().stats
+        weighted = analysis.ReturnsCalculator(allocated_capital,weights=np.ones(50)).calculate_returns().calculate_stats().stats
+        self.assertAlmostEqual(weighted['Effective sims'],50)
+        for name in plain:
+            if name != 'Max Total VaR': self.assertAlmostEqual(weighted[name],plain[name],msg=name)
+
+    def test_tail_probability(self):
+        T, params = 365, dict(mu=0.,sigma=0.5)
+        exact = norm.cdf(np.log(0.5)/(params['sigma']*np.sqrt((T-1)/T)))
+        errors = dict(plain=[],importance=[])
+        for seed in range(10):
+            np.random.seed(seed)
+            paths, weights = generate_weighted_time_series(500,T,100.,log_normal_return,params)
+            plain = log_normal_paths(500,T,100.,params)
+            for name, (ts, w) in dict(plain=(plain,None),importance=(paths,weights)).items():
+                stats = analysis.ReturnsCalculator(ts[:,:,None],weights=w).calculate_returns().calculate_stats().stats
+                errors[name].append(1 - stats['P(losing <50%)'] - exact)
+        rmse = {k: np.sqrt(np.mean(np.square(v))) for k,v in errors.items()}
+        self.assertLess(rmse['importance'],rmse['plain']/2)
+
+    def test_engine(self):
+        config = benchmark._config(200,30)
+        config.seed = 5
+        config.importance_sampling = dict(target_loss=0.3)
+        results = engine.MCSEngine(config).run(render_plots=False)
+        self.assertEqual(results.series.weights.shape,(200,))
+        self.assertIn('Effective sims',results.summary.run_summary.stats)
+        self.assertLess(loss_tilt(log_normal_return,config.return_function_params,30,0.3),0.)
+
+        config.return_function = 'Normal Random Walk'
+        with self.assertRaises(ValueError):
+            engine.MCSEngine(config).run(render_plots=False)
+
+    def test_saved_run_keeps_weights(self):
+        config = benchmark._config(100,30)
+        config.seed = 5
+        config.importance_sampling = dict(target_loss=0.3)
+        results = engine.MCSEngine(config).run(render_plots=False)
+        run_env = utils.Env()
+        run_env.SIM_FOLDER = os.path.join(env.TESTS_FOLDER,'weighted_runs',run_env.timestp_)
+        utils.save_data(run_env,results.series.sim_res,results.series.allocated_capital,config=config,chunk_paths=40
+                        ,weights=results.series.weights)
+
+        run = catalog.RunCatalog(os.path.join(os.path.dirname(run_env.SIM_FOLDER),catalog.CATALOG_FILE)).load(run_env.timestp_)
+        self.assertIn('weights',run.manifest['arrays'])
+        self.assertTrue(np.array_equal(run.weights(),results.series.weights))
+        self.assertTrue(np.array_equal(run.series(paths=(10,50)).weights,results.series.weights[10:50]))
+        expected = results.summary.run_summary.bands((0.05,0.5,0.95))
+        bands = run.bands('allocated_capital',(0.05,0.5,0.95))
+        self.assertTrue(np.allclose(bands.mean,expected.mean))
+        self.assertTrue(np.allclose(bands.quantile(0.05),expected.quantile(0.05)))
+
+
+class TestCalibration(unittest.TestCase):
+    def test_lognormal(self):
+        log_returns = np.random.normal(0.001,0.02,size=1000)
+        fitted = calibration.calibrate_returns(log_returns,'Lognormal Random Walk')
+        self.assertAlmostEqual(fitted['sigma'],log_returns.std()*np.sqrt(365))
+        self.assertAlmostEqual(fitted['mu'],log_returns.mean())
+
+    def test_gh(self):
+        from scipy.integrate import quad
+        from scipy.stats import invgamma, norm
+        for beta in (0.,4.):
+            density = quad(lambda g: norm.pdf(0.01,0.001+beta*g,np.sqrt(g))*invgamma.pdf(g,2.5,scale=3e-4),0,np.inf)[0]
+            self.assertAlmostEqual(calibration.gh_log_likelihood(np.array([0.01]),0.001,beta,2.5,3e-4)[0],np.log(density),places=6)
+
+        np.random.seed(3)
+        params = dict(mu=0.0005,alpha=0.2444,beta=0.,delta=np.sqrt(3e-4*0.2444),lambda_=-2.5)
+        returns = np.array([generalized_hyperbolic_return(1.,0,1,params) - 1 for _ in range(3000)])
+        fitted = calibration.calibrate_returns(np.log1p(returns),'Generalized Hyperbolic')
+        self.assertAlmostEqual(fitted['lambda_'],-2.5,delta=0.5)
+        self.assertAlmostEqual(fitted['delta']**2/fitted['alpha'],3e-4,delta=1e-4)
+
+    def test_memoized(self):
+        history = np.random.normal(0,0.02,size=400)
+        loader = data_source.load_log_returns
+        calls = []
+        data_source.load_log_returns = lambda symbol, lookback_days=365: calls.append(symbol) or history
+        try:
+            calibration._calibrate.cache_clear()
+            first = calibration.calibrate('BTC','GARCH(1,1)',100)
+            first['garch_alpha'] = -1.
+            self.assertEqual(calibration.calibrate('BTC','GARCH(1,1)',100),calibration.calibrate_returns(history,'GARCH(1,1)'))
+            self.assertEqual(calls,['BTC'])
+
+            #warmed in the background, then looked up without loading or fitting
+            self.assertIsNone(calibration.cached_calibration('ETH','Lognormal Random Walk',100))
+            calibration.warm(['ETH'],['Lognormal Random Walk'],100).join()
+            self.assertEqual(calls,['BTC','ETH'])
+            self.assertEqual(calibration.cached_calibration('ETH','Lognormal Random Walk',100),calibration.calibrate_returns(history,'Lognormal Random Walk'))
+            self.assertEqual(calls,['BTC','ETH'])
+        finally:
+            data_source.load_log_returns = loader
+            calibration._calibrate.cache_clear()
+            calibration._fitted.clear()
+        with self.assertRaises(ValueError):
+            calibration.calibrate_returns(history,'Block Bootstrap')
+
+
+class TestRollingBacktest(unittest.TestCase):
+    def test_windows(self):
+        history = np.arange(1.,11.)
+        windows = data_source.rolling_windows(history,window=4,step=2)
+        self.assertEqual(windows.shape,(4,4))
+        self.assertTrue(np.shares_memory(windows,history))
+        self.assertTrue(np.array_equal(windows[1],[3.,4.,5.,6.]))
+
+        normalized = data_source.rolling_windows(np.stack([history,2*history]),window=4,start_price=100.)
+        self.assertEqual(normalized.shape,(14,4))
+        self.assertTrue(np.all(normalized[:,0] == 100.))
+        self.assertTrue(np.allclose(normalized[7],normalized[0]))
+        with self.assertRaises(ValueError):
+            data_source.rolling_windows(history,window=20)
+
+    def test_paginated_history(self):
+        class CappedExchange:
+            #300 daily candles per call, listed 1000 days ago (DOT only 500)
+            def milliseconds(self): return 2000 * data_source.DAY_MS
+            def fetch_ohlcv(self, symbol, timeframe, since=None):
+                listed = (1500 if symbol.startswith('DOT') else 1000) * data_source.DAY_MS
+                start = max(since, listed)
+                return [[t, 0, 0, 0, float(t // data_source.DAY_MS), 0] for t in range(start, min(start + 300 * data_source.DAY_MS, 2000 * data_source.DAY_MS), data_source.DAY_MS)]
+        ccxt.cappedexchange = CappedExchange
+        try:
+            prices = data_source.get_crypto_price_series('cappedexchange','ETH/USDT',lookback_days=4*365)
+            self.assertTrue(np.array_equal(prices,np.arange(1000.,2000.)))
+            history = data_source.load_array_series([names.Symbols.ETH,names.Symbols.DOT],exchange='cappedexchange',lookback_days=4*365)
+            self.assertEqual(history.shape,(2,500))
+            self.assertTrue(np.array_equal(history[0],history[1]))
+        finally:
+            del ccxt.cappedexchange
+
+    def test_executor_over_windows(self):
+        history = np.exp(np.cumsum(np.random.normal(0,0.03,size=200)))
+        windows = data_source.rolling_windows(history,window=30,step=5,start_price=100.)
+        config = utils.parse_config('default_config.json')
+        config.return_function_params.update(current_price=100.)
+        allocated_capital = simulator.run_one_asset_rebalance_portfolio_v1(windows,StrategyParams(percent_allocated=0.5),config)
+        self.assertEqual(allocated_capital.shape,(35,30,3))
+        self.assertTrue(np.allclose(allocated_capital[:,0,:2].sum(axis=1),100.))
+
+        #market price windows with per path multiples hold the same capital as the rescaled windows
+        view = data_source.rolling_windows(history,window=30,step=5)
+        scaled = simulator.run_one_asset_rebalance_portfolio_v1(view,StrategyParams(percent_allocated=0.5,amount_multiple=100./view[:,0]),config)
+        self.assertTrue(np.allclose(scaled,allocated_capital))
+
+    def test_engine_runs_on_the_history_view(self):
+        history = np.exp(np.cumsum(np.random.normal(0,0.03,size=120)))
+        config = benchmark._config(1,30)
+        config.data_mode = 'rolling_backtest'
+        config.return_function_params.update(current_price=100.,window_step=10)
+        config.strategy_function_params.update(all_series_backtest=False)
+        loader = data_source.load_array_series
+        data_source.load_array_series = lambda series, **kwargs: history
+        try:
+            sim_results = engine.MCSEngine(config).run(render_plots=False)
+        finally:
+            data_source.load_array_series = loader
+        self.assertEqual(sim_results.series.sim_res.shape,(10,30))
+        self.assertTrue(np.shares_memory(sim_results.series.sim_res,history))
+        self.assertTrue(np.allclose(sim_results.series.allocated_capital[:,0,:2].sum(axis=1),100.*config.strategy_function_params['amount_multiple']))
+
+
+class TestMultiAsset(unittest.TestCase):
+    def test_correlated_paths(self):
+        correlation = [[1.,.7,.2],[.7,1.,.1],[.2,.1,1.]]
+        paths = correlated_log_normal_paths(2000,50,[100.,50.,10.],[1.,.5,2.],correlation,rng=np.random.default_rng(0))
+        self.assertEqual(paths.shape,(2000,50,3))
+        self.assertTrue(np.array_equal(paths[0,0],[100.,50.,10.]))
+        log_returns = np.diff(np.log(paths),axis=1).reshape(-1,3)
+        self.assertTrue(np.allclose(np.corrcoef(log_returns.T),correlation,atol=0.02))
+        with self.assertRaises(ValueError):
+            correlated_log_normal_paths(10,5,[1.,1.],1.,[[1.,2.],[2.,1.]])
+
+    def test_single_asset_matches_tracker(self):
+        np.random.seed(2)
+        paths = correlated_log_normal_paths(10,40,[100.],[1.5],[[1.]])
+        strategy_params = StrategyParams(percent_allocated=0.6,rebalance_threshold_down=0.1,rebalance_threshold_up=0.1
+                                         ,max_rebalances=3,cash_interest=0.05,coin_interest=0.03,amount_multiple=2.)
+        config = utils.parse_config('default_config.json')
+        config.return_function_params.update(current_price=100.,sigma=1.5)
+        single = simulator.run_one_asset_rebalance_portfolio_v1(paths[:,:,0],strategy_params,config)
+        multi = simulator.run_multi_asset_rebalance_portfolio(paths,[1.],strategy_params)
+        self.assertTrue(np.allclose(single[:,:,:2],multi))
+
+    def test_run(self):
+        params = multi_asset.MultiAssetParams(N=50,T=30,weights=[2.,1.,1.],seed=4
+                                              ,strategy_function_params=dict(percent_allocated=0.5,rebalance_threshold_down=0.05,max_rebalances=5))
+        sim = multi_asset.run_multi_asset_simulation(params)
+        self.assertEqual(sim.allocated_capital.shape,(50,30,4))
+        self.assertTrue(np.allclose(sim.allocated_capital[:,0,:3].sum(axis=1),sim.allocated_capital[:,0,3]))
+        self.assertTrue(np.allclose(sim.allocated_capital[:,0,0],2*sim.allocated_capital[:,0,1]))
+        self.assertTrue(np.array_equal(sim.paths,multi_asset.run_multi_asset_simulation(params).paths))
+        with self.assertRaises(ValueError):
+            multi_asset.run_multi_asset_simulation(multi_asset.MultiAssetParams(N=5,T=5,tickers=['ETH','XRP']))
+
+
 class TestCapitalCapitalization(unittest.TestCase):
     
     def test_daily_compounding(self):